@@ -0,0 +1,211 @@
+"""
+binary_graph.py
+===============
+
+Compact memory-mappable binary format of a shortcuts output.
+
+The shortcuts are stored as CSR arrays over edge indices (edge i is the i-th
+smallest edge ID), one .npy file per array, so a query process maps them
+with np.load(mmap_mode="r"): loading takes milliseconds, pages are read on
+demand and shared between processes reading the same files.
+
+Files (directory <output>_csr/):
+- meta.json: format version and sizes
+- edge_ids, edge_cost, edge_lca_cell: per edge (int64, float64, int64)
+- offsets: forward CSR offsets by from_edge (int64, n_edges + 1)
+- targets, costs, vias, cells, inside: per shortcut, sorted by (from_edge, to_edge)
+  (int32 edge index, float32, int32 edge index, int64 H3 cell, int8)
+- rev_offsets, rev_sources, rev_rows: reverse CSR by to_edge; rev_rows points
+  into the forward arrays, so cost/via/cell/inside are stored once
+
+Usage:
+    python binary_graph.py [shortcuts_dir] [output_dir]
+"""
+
+import json
+import shutil
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from logging_config import get_logger, log_section, log_dict
+from h3_bitwise import h3_lca
+from generate_shortcuts_numpy import load_edges
+import config
+
+logger = get_logger(__name__)
+
+FORMAT_VERSION = 2
+
+ARRAY_DTYPES = {
+    "edge_ids": np.int64,
+    "edge_cost": np.float64,
+    "edge_lca_cell": np.int64,
+    "offsets": np.int64,
+    "targets": np.int32,
+    "costs": np.float32,
+    "vias": np.int32,
+    "cells": np.int64,
+    "inside": np.int8,
+    "rev_offsets": np.int64,
+    "rev_sources": np.int32,
+    "rev_rows": np.int64
+}
+
+
+# ============================================================================
+# 1. CSR ARRAYS
+# ============================================================================
+
+def csr_offsets(sources: np.ndarray, n_nodes: int) -> np.ndarray:
+    """CSR offsets of arcs already sorted by source."""
+    offsets = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=n_nodes), out=offsets[1:])
+    return offsets
+
+
+def csr_positions(offsets: np.ndarray, nodes: np.ndarray) -> tuple:
+    """(positions, counts): rows of all arcs of nodes, in node order, and the arc count per node."""
+    lo = offsets[nodes]
+    counts = offsets[nodes + 1] - lo
+    positions = np.repeat(lo - (np.cumsum(counts) - counts), counts) + np.arange(int(counts.sum()))
+    return positions, counts
+
+
+class ShortcutCSR:
+    """
+    Forward and reverse CSR arrays of a shortcuts output.
+
+    Attributes are the arrays of ARRAY_DTYPES (NumPy arrays or read-only
+    memory maps). Arcs of edge i are rows offsets[i]:offsets[i + 1] of the
+    per-shortcut arrays; arcs into edge i are rev_rows[rev_offsets[i]:rev_offsets[i + 1]].
+    """
+
+    def __init__(self, arrays: dict):
+        for name in ARRAY_DTYPES:
+            setattr(self, name, arrays[name])
+        self.n_edges = len(self.edge_ids)
+        self.n_shortcuts = len(self.targets)
+
+    @classmethod
+    def from_shortcuts(cls, shortcuts: pd.DataFrame, edges) -> "ShortcutCSR":
+        """Build the arrays from a shortcuts DataFrame and its EdgeTable (costs kept in float64)."""
+        if edges.n_edges > np.iinfo(np.int32).max:
+            raise ValueError(f"{edges.n_edges} edges do not fit the int32 edge indices of the binary format")
+        from_index = edges.index_of(shortcuts["from_edge"].values)
+        to_index = edges.index_of(shortcuts["to_edge"].values)
+        via_index = edges.index_of(shortcuts["via_edge"].values)
+        order = np.lexsort((to_index, from_index))
+        from_index, to_index = from_index[order], to_index[order]
+
+        rev_rows = np.argsort(to_index, kind="stable")
+        return cls({
+            "edge_ids": edges.ids,
+            "edge_cost": edges.cost,
+            "edge_lca_cell": h3_lca(edges.from_cell, edges.to_cell),
+            "offsets": csr_offsets(from_index, edges.n_edges),
+            "targets": to_index.astype(np.int32),
+            "costs": shortcuts["cost"].values[order].astype(np.float64),
+            "vias": via_index[order].astype(np.int32),
+            "cells": shortcuts["cell"].values[order].astype(np.int64),
+            "inside": shortcuts["inside"].values[order].astype(np.int8),
+            "rev_offsets": csr_offsets(to_index[rev_rows], edges.n_edges),
+            "rev_sources": from_index[rev_rows].astype(np.int32),
+            "rev_rows": rev_rows.astype(np.int64)
+        })
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "ShortcutCSR":
+        """Open a binary graph directory (memory-mapped unless mmap is False)."""
+        directory = Path(directory)
+        meta = json.loads((directory / "meta.json").read_text())
+        if meta["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported binary graph format {meta['format_version']} in {directory}")
+        mode = "r" if mmap else None
+        return cls({name: np.load(directory / f"{name}.npy", mmap_mode=mode) for name in ARRAY_DTYPES})
+
+    def save(self, directory: str):
+        """Write all arrays in their file dtypes; the directory is replaced atomically."""
+        directory = Path(directory)
+        work_dir = directory.with_name(directory.name + ".tmp")
+        shutil.rmtree(work_dir, ignore_errors=True)
+        work_dir.mkdir(parents=True)
+
+        for name, dtype in ARRAY_DTYPES.items():
+            np.save(work_dir / f"{name}.npy", np.ascontiguousarray(getattr(self, name), dtype=dtype))
+        (work_dir / "meta.json").write_text(json.dumps({
+            "format_version": FORMAT_VERSION,
+            "n_edges": self.n_edges,
+            "n_shortcuts": self.n_shortcuts
+        }))
+
+        shutil.rmtree(directory, ignore_errors=True)
+        work_dir.rename(directory)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in ARRAY_DTYPES)
+
+
+def is_binary_graph(path: str) -> bool:
+    """True when path is a binary graph directory."""
+    return (Path(path) / "meta.json").exists() and (Path(path) / "offsets.npy").exists()
+
+
+def binary_dir_for(output_path: str) -> str:
+    """Binary graph directory kept next to an output directory."""
+    return str(output_path).rstrip("/") + "_csr"
+
+
+# ============================================================================
+# 2. EXPORT
+# ============================================================================
+
+def export_binary(shortcuts_path: str, output_dir: str = None, edges_file: str = None) -> ShortcutCSR:
+    """Convert a shortcuts output directory (Parquet) into a binary graph directory."""
+    output_dir = output_dir or binary_dir_for(shortcuts_path)
+    shortcuts = pd.read_parquet(shortcuts_path, columns=["from_edge", "to_edge", "cost", "via_edge", "inside", "cell"])
+    csr = ShortcutCSR.from_shortcuts(shortcuts, load_edges(str(edges_file or config.EDGES_FILE)))
+    csr.save(output_dir)
+    return csr
+
+
+# ============================================================================
+# MAIN EXECUTION
+# ============================================================================
+
+def main(shortcuts_path: str = None, output_dir: str = None):
+    """Export a shortcuts output and compare load time and memory with Parquet."""
+    shortcuts_path = shortcuts_path or str(config.SHORTCUTS_OUTPUT_FILE).replace("_shortcuts", "_spark_hybrid")
+    output_dir = output_dir or binary_dir_for(shortcuts_path)
+    log_section(logger, "BINARY GRAPH EXPORT")
+    log_dict(logger, {"shortcuts": shortcuts_path, "output_dir": output_dir}, "Configuration")
+
+    start = time.perf_counter()
+    shortcuts = pd.read_parquet(shortcuts_path)
+    parquet_time = time.perf_counter() - start
+    parquet_bytes = int(shortcuts.memory_usage(deep=True).sum())
+    del shortcuts
+
+    start = time.perf_counter()
+    csr = export_binary(shortcuts_path, output_dir)
+    logger.info(f"✓ Exported {csr.n_shortcuts} shortcuts in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    mapped = ShortcutCSR.load(output_dir)
+    mmap_time = time.perf_counter() - start
+
+    log_dict(logger, {
+        "parquet_load_s": f"{parquet_time:.3f}",
+        "parquet_memory_mb": f"{parquet_bytes / 1e6:.1f}",
+        "mmap_load_s": f"{mmap_time:.4f}",
+        "binary_size_mb": f"{mapped.nbytes / 1e6:.1f}"
+    }, "Load")
+    log_section(logger, "COMPLETED")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:3])
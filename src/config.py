@@ -63,6 +63,79 @@ RESOLUTION_RANGE_DOWN = range(MAX_H3_RESOLUTION, MIN_H3_RESOLUTION - 2, -1)
 # Process from low to high resolution (upward pass)
 RESOLUTION_RANGE_UP = range(MIN_H3_RESOLUTION, MAX_H3_RESOLUTION + 1)
 
+# Forward pass: emit only pairs between edges crossing the cell boundary
+# (validate the output with archive/verify_shortcuts.py when enabled)
+BOUNDARY_ONLY = os.getenv("BOUNDARY_ONLY", "0") == "1"
+
+# Scipy kernel: max distance entries held per Dijkstra call (bounds memory per cell)
+SCIPY_CHUNK_ENTRIES = int(os.getenv("SCIPY_CHUNK_ENTRIES", "4000000"))
+
+# Hybrid engine selection by cell size (distinct edges per cell).
+# Calibrate on the target machine with: python src/shortest_path_kernels.py
+DENSE_MAX_NODES = int(os.getenv("DENSE_MAX_NODES", "64"))
+SCIPY_MAX_NODES = int(os.getenv("SCIPY_MAX_NODES", "20000"))
+
+# Cells above SCIPY_MAX_NODES are split into this many source blocks across
+# executors (0 = twice the default parallelism)
+DISTRIBUTED_BLOCKS = int(os.getenv("DISTRIBUTED_BLOCKS", "0"))
+
+# Number of largest cells logged per resolution (every cell is logged at DEBUG)
+ENGINE_PLAN_LOG_CELLS = int(os.getenv("ENGINE_PLAN_LOG_CELLS", "5"))
+
+# Working shortcuts table between resolutions: "checkpoint" (localCheckpoint)
+# or "bucketed" (tables bucketed by from_edge in WAREHOUSE_DIR)
+SHORTCUTS_LAYOUT = os.getenv("SHORTCUTS_LAYOUT", "checkpoint")
+NUM_BUCKETS = int(os.getenv("NUM_BUCKETS", "64"))
+WAREHOUSE_DIR = PROJECT_ROOT / "spark-warehouse"
+
+# Skip cells whose active input is unchanged since they were last processed
+SKIP_CLEAN_CELLS = os.getenv("SKIP_CLEAN_CELLS", "1") == "1"
+
+# Pure Spark closure: "doubling" joins changed paths with the whole closure
+# (path length doubles per round); "linear" extends them by one shortcut
+PURE_SPARK_MODE = os.getenv("PURE_SPARK_MODE", "doubling")
+
+# NumPy engine: use a process pool over cells on machines with at least
+# NUMPY_POOL_MIN_CORES cores (NUMPY_WORKERS = 0: one worker per core)
+NUMPY_POOL_MIN_CORES = int(os.getenv("NUMPY_POOL_MIN_CORES", "8"))
+NUMPY_WORKERS = int(os.getenv("NUMPY_WORKERS", "0"))
+
+# NumPy engine: keep per-cell signatures and outputs next to the output
+# (<output>_state) so incremental_update.py can apply edge cost changes
+NUMPY_SAVE_STATE = os.getenv("NUMPY_SAVE_STATE", "0") == "1"
+
+# Distance matrices: worker processes for the per-edge searches (0 = in process);
+# workers memory-map the binary graph (binary_graph.py) instead of copying it
+MATRIX_WORKERS = int(os.getenv("MATRIX_WORKERS", "0"))
+
+# Routing service (routing_service.py): concurrent route requests are grouped
+# into micro-batches of up to SERVICE_BATCH_SIZE, waiting at most
+# SERVICE_BATCH_WAIT_MS; SERVICE_WORKERS processes run the searches
+# (0 = one background thread)
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8080"))
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", "0"))
+SERVICE_BATCH_SIZE = int(os.getenv("SERVICE_BATCH_SIZE", "64"))
+SERVICE_BATCH_WAIT_MS = float(os.getenv("SERVICE_BATCH_WAIT_MS", "2"))
+
+# Query result cache (query_cache.py, routing_service.py): LRU over
+# (from_edge, to_edge, profile), bounded by entries and by the total route
+# length held (shortcut route + unpacked edges)
+QUERY_CACHE_ENTRIES = int(os.getenv("QUERY_CACHE_ENTRIES", "100000"))
+QUERY_CACHE_ROUTE_EDGES = int(os.getenv("QUERY_CACHE_ROUTE_EDGES", "5000000"))
+
+# Coordinate snapping (snapping.py): H3 resolution of the segment index
+# (res 9 cells have ~200 m edges)
+SNAP_RESOLUTION = int(os.getenv("SNAP_RESOLUTION", "9"))
+
+# Cost profiles of generate_shortcuts_spark_profiles.py (one output per profile):
+# cost = length / speed, speed = maxspeed * speed_factor capped at max_speed (m/s, None = no cap)
+COST_PROFILES = {
+    "car_day": {"speed_factor": 1.0, "max_speed": None},
+    "car_night": {"speed_factor": 1.1, "max_speed": None},
+    "truck": {"speed_factor": 0.9, "max_speed": 25.0},
+}
+
 # ============================================================================
 # LOGGING
 # ============================================================================
@@ -0,0 +1,353 @@
+"""
+customization.py
+================
+
+Metric-independent preprocessing and fast cost customization, in the
+spirit of customizable contraction hierarchies.
+
+Which shortcut keys exist, the cells each key is active in at every
+resolution, and therefore the graph of every cell depend only on the H3
+geometry and the edge graph, not on edge costs. The pipeline is split into:
+
+1. Topology phase (once): a NumPy engine run that records, per resolution,
+   the nodes and deduplicated shortcut pairs of every cell as positions in
+   the final key set, plus the cost-independent output columns (inside,
+   cell).
+2. Customization phase (per metric): replays the resolutions on the
+   recorded cell graphs. Costs and vias are gathered by key position, the
+   same kernels run, and results are merged with the same rule as
+   ShortcutTable.merge. Cell assignment, H3 arithmetic, geometry and table
+   re-sorting are not repeated.
+
+The customized output is identical to a NumPy engine run with the same
+costs. The set of edges with infinite cost must match the topology run
+(unreachable pairs are not emitted, so it shapes the key set).
+
+Usage:
+    python customization.py topology             # once per network
+    python customization.py customize [costs]    # per metric (CSV: edge_id, cost)
+"""
+
+import json
+import shutil
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from logging_config import get_logger, log_section, log_dict
+from shared_arrays import SharedArrayStore
+from generate_shortcuts_numpy import (
+    ShortcutTable, cell_starts, create_pool, final_info, final_rows, initial_shortcuts, load_edges,
+    numpy_output_path, output_id_type, publish_edges, run_passes, write_output
+)
+from shortest_path_kernels import CellGraph, cell_shortest_paths
+import config
+
+logger = get_logger(__name__)
+
+
+# ============================================================================
+# 1. TOPOLOGY PHASE
+# ============================================================================
+
+class TopologyRecorder:
+    """
+    Records the cell graphs of every resolution during a NumPy engine run.
+
+    Per resolution (vectorized over all cells):
+        node_starts, node_edge: Nodes of each cell as edge indices (sorted per cell)
+        entry_starts, entry_src, entry_dst: Unique local (src, dst) pairs per cell,
+            sorted like CellGraph
+        entry_key: Table key of each pair (converted to final positions on save)
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def record(self, phase: str, current_res: int, table: ShortcutTable,
+               rows: np.ndarray, cells: np.ndarray, boundary_res: int = None):
+        n_edges = table.edges.n_edges
+        starts = cell_starts(cells)
+        n_cells = len(starts) - 1
+        cell_pos = np.repeat(np.arange(n_cells, dtype=np.int64), np.diff(starts))
+
+        keys = table.keys[rows]
+        from_node = cell_pos * n_edges + keys // n_edges
+        to_node = cell_pos * n_edges + keys % n_edges
+
+        # Nodes of all cells, ordered by (cell, edge index)
+        node_keys = np.unique(np.concatenate([from_node, to_node]))
+        node_starts = np.searchsorted(node_keys // n_edges, np.arange(n_cells + 1))
+
+        # Unique pairs ordered by (cell, src, dst); a row can be active twice in one cell
+        src = np.searchsorted(node_keys, from_node)
+        dst = np.searchsorted(node_keys, to_node)
+        order = np.lexsort((dst, src))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (src[order][1:] != src[order][:-1]) | (dst[order][1:] != dst[order][:-1])
+        order = order[first]
+
+        entry_cell = cell_pos[order]
+        self.records.append({
+            "phase": phase,
+            "resolution": current_res,
+            "boundary_res": -1 if boundary_res is None else boundary_res,
+            "node_starts": node_starts,
+            "node_edge": node_keys % n_edges,
+            "entry_starts": np.searchsorted(entry_cell, np.arange(n_cells + 1)),
+            "entry_src": src[order] - node_starts[entry_cell],
+            "entry_dst": dst[order] - node_starts[entry_cell],
+            "entry_key": keys[order]
+        })
+
+    def save(self, topology_dir: str, table: ShortcutTable, initial_keys: np.ndarray,
+             initial_vias: np.ndarray, boundary_only: bool):
+        """Write the topology of a finished run (final keys, initial shortcuts, cell graphs)."""
+        topology_dir = Path(topology_dir)
+        shutil.rmtree(topology_dir, ignore_errors=True)
+        topology_dir.mkdir(parents=True)
+
+        edges = table.edges
+        valid, inside, cell = final_rows(table)
+        np.savez(
+            topology_dir / "keys.npz",
+            keys=table.keys,
+            initial_pos=np.searchsorted(table.keys, initial_keys),
+            initial_from=initial_keys // edges.n_edges,
+            initial_via=initial_vias,
+            valid=valid,
+            inside=inside,
+            cell=cell,
+            edge_ids=edges.ids,
+            edge_lca_res=edges.lca_res,
+            edge_infinite=~np.isfinite(edges.cost)
+        )
+
+        resolutions = []
+        for i, record in enumerate(self.records):
+            arrays = {name: value for name, value in record.items() if isinstance(value, np.ndarray)}
+            arrays["entry_pos"] = np.searchsorted(table.keys, arrays.pop("entry_key"))
+            np.savez(topology_dir / f"resolution_{i:02d}.npz", **arrays)
+            resolutions.append([record["phase"], record["resolution"], record["boundary_res"]])
+
+        meta = {"boundary_only": boundary_only, "n_keys": len(table), "resolutions": resolutions}
+        (topology_dir / "meta.json").write_text(json.dumps(meta))
+
+
+def topology_dir_for(output_path: str) -> str:
+    """Topology directory kept next to an output directory."""
+    return str(output_path).rstrip("/") + "_topology"
+
+
+def build_topology(boundary_only: bool = config.BOUNDARY_ONLY) -> str:
+    """
+    Topology phase: one NumPy engine run that records every cell graph.
+
+    Also writes the output for the configured costs. Returns the topology directory.
+    """
+    log_section(logger, "TOPOLOGY PHASE")
+
+    output_path = numpy_output_path()
+    pool = create_pool()
+    store = SharedArrayStore() if pool else None
+
+    try:
+        edges = load_edges(str(config.EDGES_FILE))
+        if store:
+            publish_edges(store, edges)
+
+        table = ShortcutTable(edges, initial_shortcuts(str(config.GRAPH_FILE), edges))
+        initial_keys, initial_vias = table.keys.copy(), table.via_edge.copy()
+
+        recorder = TopologyRecorder()
+        run_passes(table, boundary_only, pool, store, topology=recorder)
+
+        write_output(final_info(table), output_path)
+
+        topology_dir = topology_dir_for(output_path)
+        recorder.save(topology_dir, table, initial_keys, initial_vias, boundary_only)
+        logger.info(f"✓ Saved topology of {len(recorder.records)} resolutions to: {topology_dir}")
+
+    finally:
+        if pool:
+            pool.shutdown()
+        if store:
+            store.close()
+
+    return topology_dir
+
+
+# ============================================================================
+# 2. CUSTOMIZATION PHASE
+# ============================================================================
+
+def customized_output(edges, keys: np.ndarray, cost: np.ndarray, via: np.ndarray,
+                      valid: np.ndarray, inside: np.ndarray, cell: np.ndarray) -> pd.DataFrame:
+    """Output DataFrame from per-key costs and vias (same columns as final_info)."""
+    id_type = output_id_type(edges)
+    return pd.DataFrame({
+        "from_edge": edges.ids[keys[valid] // edges.n_edges].astype(id_type),
+        "to_edge": edges.ids[keys[valid] % edges.n_edges].astype(id_type),
+        "cost": cost[valid],
+        "via_edge": via[valid].astype(id_type),
+        "inside": inside[valid],
+        "cell": cell[valid]
+    })
+
+
+class Topology:
+    """A saved topology (see TopologyRecorder.save)."""
+
+    def __init__(self, topology_dir: str):
+        self.topology_dir = Path(topology_dir)
+        self.meta = json.loads((self.topology_dir / "meta.json").read_text())
+        with np.load(self.topology_dir / "keys.npz") as data:
+            self.keys = {name: data[name] for name in data.files}
+        self.edge_ids = self.keys["edge_ids"]
+        self.n_edges = len(self.edge_ids)
+
+    def resolutions(self):
+        """Yield (phase, resolution, boundary_res, arrays) in processing order."""
+        for i, (phase, current_res, boundary_res) in enumerate(self.meta["resolutions"]):
+            with np.load(self.topology_dir / f"resolution_{i:02d}.npz") as data:
+                arrays = {name: data[name] for name in data.files}
+            yield phase, current_res, (None if boundary_res < 0 else boundary_res), arrays
+
+
+def customize_resolution(
+    topology: Topology,
+    arrays: dict,
+    cost: np.ndarray,
+    via: np.ndarray,
+    boundary_res: int = None,
+    dense_max_nodes: int = config.DENSE_MAX_NODES,
+    chunk_entries: int = config.SCIPY_CHUNK_ENTRIES
+) -> tuple:
+    """
+    Run the kernels on the recorded cell graphs of one resolution.
+
+    Returns:
+        (key positions, costs, vias) of the generated shortcuts, in cell order
+    """
+    node_starts, entry_starts = arrays["node_starts"], arrays["entry_starts"]
+    node_edge, entry_pos = arrays["node_edge"], arrays["entry_pos"]
+    edge_lca_res = topology.keys["edge_lca_res"]
+
+    results = []
+    for c in range(len(node_starts) - 1):
+        cell_nodes = node_edge[node_starts[c]:node_starts[c + 1]]
+        entries = slice(entry_starts[c], entry_starts[c + 1])
+        pos = entry_pos[entries]
+
+        cell = CellGraph.from_arrays(
+            topology.edge_ids[cell_nodes], arrays["entry_src"][entries], arrays["entry_dst"][entries],
+            cost[pos], via[pos], node_lca=edge_lca_res[cell_nodes] if boundary_res is not None else None
+        )
+        result = cell_shortest_paths(cell, dense_max_nodes, chunk_entries, boundary_res)
+        if len(result) > 0:
+            results.append(result)
+
+    if not results:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0, dtype=np.int64)
+
+    result = pd.concat(results, ignore_index=True)
+    from_index = np.searchsorted(topology.edge_ids, result["from_edge"].values.astype(np.int64))
+    to_index = np.searchsorted(topology.edge_ids, result["to_edge"].values.astype(np.int64))
+    out_pos = np.searchsorted(topology.keys["keys"], from_index * topology.n_edges + to_index)
+    return out_pos, result["cost"].values.astype(np.float64), result["via_edge"].values.astype(np.int64)
+
+
+def customize(topology: Topology, edges) -> pd.DataFrame:
+    """
+    Customization phase: final output for the costs of edges (an EdgeTable).
+
+    Raises:
+        ValueError: if the edges or their infinite-cost set differ from the topology run
+    """
+    if not np.array_equal(edges.ids, topology.edge_ids):
+        raise ValueError("Edge ids differ from the topology run")
+    if not np.array_equal(~np.isfinite(edges.cost), topology.keys["edge_infinite"]):
+        raise ValueError("Edges with infinite cost differ from the topology run")
+
+    n_keys = topology.meta["n_keys"]
+    cost = np.full(n_keys, np.inf)
+    via = np.full(n_keys, -1, dtype=np.int64)
+    exists = np.zeros(n_keys, dtype=bool)
+
+    initial_pos = topology.keys["initial_pos"]
+    cost[initial_pos] = edges.cost[topology.keys["initial_from"]]
+    via[initial_pos] = topology.keys["initial_via"]
+    exists[initial_pos] = True
+
+    for phase, current_res, boundary_res, arrays in topology.resolutions():
+        out_pos, out_cost, out_via = customize_resolution(topology, arrays, cost, via, boundary_res)
+
+        # Same rule as ShortcutTable.merge: cheapest per key, new or strictly cheaper wins
+        order = np.lexsort((out_cost, out_pos))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = out_pos[order][1:] != out_pos[order][:-1]
+        order = order[first]
+        out_pos, out_cost, out_via = out_pos[order], out_cost[order], out_via[order]
+
+        update = ~exists[out_pos] | (out_cost < cost[out_pos])
+        cost[out_pos[update]] = out_cost[update]
+        via[out_pos[update]] = out_via[update]
+        exists[out_pos] = True
+        logger.debug(f"{phase} res={current_res}: {len(out_pos)} generated, {int(update.sum())} updated")
+
+    return customized_output(
+        edges, topology.keys["keys"], cost, via,
+        topology.keys["valid"], topology.keys["inside"], topology.keys["cell"]
+    )
+
+
+def load_edge_costs(edges, file_path: str):
+    """Replace the costs of edges (in place) with a metric CSV (edge_id, cost); missing edges keep theirs."""
+    metric = pd.read_csv(file_path, usecols=["edge_id", "cost"])
+    edges.cost[edges.index_of(metric["edge_id"].values)] = metric["cost"].values.astype(np.float64)
+    return edges
+
+
+# ============================================================================
+# MAIN EXECUTION
+# ============================================================================
+
+def main(command: str = "customize", cost_file: str = None, boundary_only: bool = config.BOUNDARY_ONLY):
+    """
+    Run the topology phase or customize the saved topology for a metric.
+
+    Args:
+        command: "topology" or "customize"
+        cost_file: Optional metric CSV (edge_id, cost); default: length / maxspeed
+        boundary_only: Forward pass emission mode (topology phase only)
+    """
+    if command == "topology":
+        build_topology(boundary_only)
+        log_section(logger, "COMPLETED")
+        return
+
+    log_section(logger, "CUSTOMIZATION PHASE")
+    output_path = numpy_output_path()
+    topology_dir = topology_dir_for(output_path)
+    log_dict(logger, {"topology": topology_dir, "cost_file": cost_file, "output_file": output_path}, "Configuration")
+
+    start = time.perf_counter()
+    topology = Topology(topology_dir)
+    edges = load_edges(str(config.EDGES_FILE))
+    if cost_file:
+        load_edge_costs(edges, cost_file)
+
+    final_df = customize(topology, edges)
+    write_output(final_df, output_path)
+    logger.info(f"✓ Customized {len(final_df)} shortcuts in {time.perf_counter() - start:.1f}s → {output_path}")
+    log_section(logger, "COMPLETED")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("topology", "customize"):
+        print("Usage: python customization.py topology | customize [costs.csv]")
+        sys.exit(1)
+    main(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
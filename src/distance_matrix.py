@@ -0,0 +1,230 @@
+"""
+distance_matrix.py
+==================
+
+Many-to-many distance matrices over the shortcut hierarchy (bucket method).
+
+For a |S| × |T| matrix:
+1. Backward pass: one complete backward search per target t (downward
+   shortcuts, reversed, see QueryEngine.search_space); every settled edge v
+   gets a bucket entry (column of t, d_b(v)).
+2. Forward pass: one complete forward search per source s; each settled edge
+   v offers d_f(v) + d_b(v) to the columns of its bucket entries, and the row
+   is the columnwise minimum.
+3. cost(t) is added per column (shortcut cost convention).
+
+This is the meeting-edge minimum of the point-to-point query for all pairs
+at once: |S| + |T| one-sided searches instead of |S| × |T| bidirectional
+ones. Buckets are CSR arrays over edges and rows go into a NumPy buffer.
+
+With workers > 0 both passes run on a process pool: workers load the graph
+themselves (a binary graph is memory-mapped, so pages are shared), return
+bucket entries through shared memory and write their rows directly into a
+shared result buffer.
+
+Usage:
+    python distance_matrix.py [graph_dir] [size ...]   # throughput benchmark
+"""
+
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from logging_config import get_logger, log_section, log_dict
+from binary_graph import csr_positions
+from shared_arrays import SharedArrayStore, attach_arrays, export_columns, import_columns
+from query_engine import QueryEngine, ShortcutGraph, INF
+import config
+
+logger = get_logger(__name__)
+
+
+# ============================================================================
+# 1. BUCKETS
+# ============================================================================
+
+def backward_entries(engine: QueryEngine, targets: np.ndarray, col_offset: int = 0) -> dict:
+    """Bucket entries {"node", "col", "dist"} of the backward searches of targets (edge indices)."""
+    nodes, cols, dists = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)], [np.empty(0)]
+    for col, target in enumerate(targets.tolist(), start=col_offset):
+        space_nodes, space_dists = engine.search_space(target, backward=True)
+        nodes.append(space_nodes)
+        cols.append(np.full(len(space_nodes), col, dtype=np.int64))
+        dists.append(space_dists)
+    return {"node": np.concatenate(nodes), "col": np.concatenate(cols), "dist": np.concatenate(dists)}
+
+
+def build_buckets(entries: dict, n_edges: int) -> dict:
+    """CSR buckets over edges: entries of edge v are rows offsets[v]:offsets[v + 1]."""
+    order = np.argsort(entries["node"], kind="stable")
+    offsets = np.zeros(n_edges + 1, dtype=np.int64)
+    np.cumsum(np.bincount(entries["node"], minlength=n_edges), out=offsets[1:])
+    return {"bucket_offsets": offsets, "bucket_cols": entries["col"][order], "bucket_dists": entries["dist"][order]}
+
+
+def scan_buckets(nodes: np.ndarray, dists: np.ndarray, buckets: dict, n_cols: int) -> np.ndarray:
+    """Row of min d_f(v) + d_b(v) per column over the forward search space (nodes, dists)."""
+    row = np.full(n_cols, INF)
+    positions, counts = csr_positions(buckets["bucket_offsets"], nodes)
+    if len(positions) == 0:
+        return row
+    np.minimum.at(row, buckets["bucket_cols"][positions], np.repeat(dists, counts) + buckets["bucket_dists"][positions])
+    return row
+
+
+def forward_rows(engine: QueryEngine, sources: np.ndarray, buckets: dict, out: np.ndarray):
+    """Fill out[i] with the distances (without target costs) from sources[i]."""
+    for i, source in enumerate(sources.tolist()):
+        nodes, dists = engine.search_space(source)
+        out[i] = scan_buckets(nodes, dists, buckets, out.shape[1])
+
+
+def compute_matrix(engine: QueryEngine, from_edges, to_edges) -> np.ndarray:
+    """Route cost matrix (len(from_edges), len(to_edges)) computed in this process."""
+    graph = engine.graph
+    sources, targets = graph.index_of_many(from_edges), graph.index_of_many(to_edges)
+    if len(sources) == 0 or len(targets) == 0:
+        return np.empty((len(sources), len(targets)))
+    buckets = build_buckets(backward_entries(engine, targets), graph.n_edges)
+    matrix = np.empty((len(sources), len(targets)))
+    forward_rows(engine, sources, buckets, matrix)
+    matrix += np.asarray(graph.edge_cost)[targets]
+    return matrix
+
+
+# ============================================================================
+# 2. POOL WORKERS
+# ============================================================================
+
+# Query engine of this worker process (set by _init_worker)
+_WORKER_ENGINE = None
+
+
+def _init_worker(graph_path: str, edges_file: str):
+    global _WORKER_ENGINE
+    _WORKER_ENGINE = QueryEngine(ShortcutGraph.load(graph_path, edges_file))
+
+
+def _backward_task(targets: np.ndarray, col_offset: int):
+    return export_columns(backward_entries(_WORKER_ENGINE, targets, col_offset))
+
+
+def _forward_task(specs: dict, sources: np.ndarray, row_offset: int):
+    arrays = attach_arrays(specs)
+    buckets = {name: arrays[name] for name in ("bucket_offsets", "bucket_cols", "bucket_dists")}
+    forward_rows(_WORKER_ENGINE, sources, buckets, arrays["matrix"][row_offset:row_offset + len(sources)])
+
+
+def _chunks(values: np.ndarray, n_chunks: int) -> list:
+    """(offset, chunk) pairs of about equal size."""
+    bounds = np.linspace(0, len(values), min(n_chunks, len(values)) + 1).astype(np.int64)
+    return [(int(lo), values[lo:hi]) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+
+# ============================================================================
+# 3. MATRIX API
+# ============================================================================
+
+class DistanceMatrix:
+    """
+    Many-to-many distance matrices on one loaded graph.
+
+    Args:
+        graph_path: Binary graph directory (preferred with workers) or shortcuts output
+        workers: Worker processes (0: compute in this process)
+        edges_file: Edges file for a Parquet output (default: config.EDGES_FILE)
+    """
+
+    def __init__(self, graph_path: str, workers: int = config.MATRIX_WORKERS, edges_file: str = None):
+        self.graph = ShortcutGraph.load(graph_path, edges_file)
+        self.engine = QueryEngine(self.graph)
+        self.pool = None
+        self.store = None
+        if workers > 0:
+            self.pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                            initargs=(graph_path, edges_file))
+            self.store = SharedArrayStore()
+            self.n_chunks = 4 * workers
+
+    def compute(self, from_edges, to_edges) -> np.ndarray:
+        """
+        Matrix of route costs, shape (len(from_edges), len(to_edges)), float64.
+
+        Entry [i, j] equals QueryEngine.distance(from_edges[i], to_edges[j])
+        (inf when unreachable).
+        """
+        if self.pool is None:
+            return compute_matrix(self.engine, from_edges, to_edges)
+
+        sources, targets = self.graph.index_of_many(from_edges), self.graph.index_of_many(to_edges)
+        if len(sources) == 0 or len(targets) == 0:
+            return np.empty((len(sources), len(targets)))
+        matrix = self._compute_pool(sources, targets)
+        matrix += np.asarray(self.graph.edge_cost)[targets]
+        return matrix
+
+    def _compute_pool(self, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        futures = [self.pool.submit(_backward_task, chunk, offset) for offset, chunk in _chunks(targets, self.n_chunks)]
+        parts = [import_columns(spec) for spec in (f.result() for f in futures) if spec is not None]
+        parts = parts or [backward_entries(self.engine, targets[:0])]
+        entries = {name: np.concatenate([part[name] for part in parts]) for name in ("node", "col", "dist")}
+
+        for name, array in build_buckets(entries, self.graph.n_edges).items():
+            self.store.put(name, array)
+        self.store.put("matrix", np.empty((len(sources), len(targets))))
+        specs = self.store.specs()
+
+        futures = [self.pool.submit(_forward_task, specs, chunk, offset) for offset, chunk in _chunks(sources, self.n_chunks)]
+        for future in futures:
+            future.result()
+        return self.store.get("matrix").copy()
+
+    def close(self):
+        """Shut down the worker pool and release shared memory."""
+        if self.pool:
+            self.pool.shutdown()
+        if self.store:
+            self.store.close()
+
+
+# ============================================================================
+# MAIN EXECUTION
+# ============================================================================
+
+def main(graph_path: str = None, sizes: tuple = (100, 500, 1000, 2000), n_checks: int = 100, seed: int = 0):
+    """Throughput of square matrices of the given sizes, spot-checked against point-to-point queries."""
+    graph_path = graph_path or str(config.SHORTCUTS_OUTPUT_FILE).replace("_shortcuts", "_spark_hybrid")
+    log_section(logger, "DISTANCE MATRIX BENCHMARK")
+    log_dict(logger, {"graph": graph_path, "sizes": ", ".join(map(str, sizes)),
+                      "workers": config.MATRIX_WORKERS}, "Configuration")
+
+    matrices = DistanceMatrix(graph_path)
+    rng = np.random.default_rng(seed)
+    edge_ids = np.asarray(matrices.graph.edge_ids)
+
+    try:
+        for size in sizes:
+            from_edges = edge_ids[rng.integers(0, len(edge_ids), size)]
+            to_edges = edge_ids[rng.integers(0, len(edge_ids), size)]
+
+            start = time.perf_counter()
+            matrix = matrices.compute(from_edges, to_edges)
+            elapsed = time.perf_counter() - start
+
+            checks = rng.integers(0, size, (n_checks, 2))
+            expected = [matrices.engine.distance(int(from_edges[i]), int(to_edges[j])) for i, j in checks]
+            mismatches = int(np.count_nonzero(~np.isclose(matrix[checks[:, 0], checks[:, 1]], expected)))
+
+            logger.info(f"  {size:5d} x {size:<5d}: {elapsed:.2f}s, {size * size / elapsed:,.0f} entries/s, "
+                        f"{mismatches} of {n_checks} spot checks differ")
+    finally:
+        matrices.close()
+
+    log_section(logger, "COMPLETED")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None,
+         tuple(int(size) for size in sys.argv[2:]) or (100, 500, 1000, 2000))
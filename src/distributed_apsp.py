@@ -0,0 +1,147 @@
+"""
+distributed_apsp.py
+===================
+
+Distributed shortest path kernel for oversized cells.
+
+At resolution -1 (and often 0) all active shortcuts fall into one
+current_cell, and applyInPandas would run the whole network on a single
+Python worker. Here the distance matrix of such a cell is split into
+row blocks (blocks of source edges): the cell graph is broadcast once and
+every block is computed by its own Spark task with the sparse Dijkstra
+kernel, so all executors share the work.
+
+Key features:
+- Row-block decomposition: blocks are independent, no inter-block rounds
+- Output identical to sparse_shortest_paths (same via_edge convention)
+- Automatic split of a partitioned workload into local and oversized cells
+"""
+
+from pyspark.sql import DataFrame
+from pyspark.sql import functions as F
+from pyspark.sql.types import StructType, StructField, IntegerType, DoubleType
+
+from logging_config import get_logger
+from shortest_path_kernels import block_shortest_paths, count_cell_nodes
+from utilities import collect_cell_stats
+import config
+
+logger = get_logger(__name__)
+
+OUTPUT_SCHEMA = StructType([
+    StructField("from_edge", IntegerType(), False),
+    StructField("to_edge", IntegerType(), False),
+    StructField("via_edge", IntegerType(), False),
+    StructField("cost", DoubleType(), False),
+])
+
+
+# ============================================================================
+# 1. OVERSIZED CELL DETECTION
+# ============================================================================
+
+def find_oversized_cells(df_shortcuts: DataFrame, max_cell_nodes: int) -> list:
+    """current_cell values whose number of distinct edges exceeds max_cell_nodes."""
+    rows = collect_cell_stats(df_shortcuts).filter(
+        F.col("n_nodes") > max_cell_nodes
+    ).select("current_cell").collect()
+    return [row["current_cell"] for row in rows]
+
+
+# ============================================================================
+# 2. BLOCKED KERNEL FOR ONE CELL
+# ============================================================================
+
+def distributed_shortest_paths(
+    cell_shortcuts: DataFrame,
+    num_blocks: int = None,
+    chunk_entries: int = config.SCIPY_CHUNK_ENTRIES,
+    boundary_res: int = None
+) -> DataFrame:
+    """
+    Shortest paths of ONE cell, computed in source blocks across executors.
+
+    The cell's shortcuts are collected on the driver and broadcast; a
+    spark.range of block ids is mapped so that each task runs Dijkstra for
+    one strided block of sources.
+
+    Args:
+        cell_shortcuts: Active shortcuts of a single cell
+        num_blocks: Number of source blocks (default: config.DISTRIBUTED_BLOCKS,
+                    or 2x the default parallelism)
+        chunk_entries: Max distance entries computed per Dijkstra call
+        boundary_res: Cell resolution for boundary-only emission (None = all pairs)
+
+    Returns:
+        DataFrame (from_edge, to_edge, via_edge, cost)
+    """
+    spark = cell_shortcuts.sparkSession
+
+    kernel_columns = ["from_edge", "to_edge", "via_edge", "cost"]
+    if boundary_res is not None:
+        kernel_columns += ["lca_in", "lca_out"]
+    pdf = cell_shortcuts.select(*kernel_columns).toPandas()
+
+    if num_blocks is None:
+        num_blocks = config.DISTRIBUTED_BLOCKS or 2 * spark.sparkContext.defaultParallelism
+    num_blocks = max(1, min(num_blocks, pdf["from_edge"].nunique()))
+    logger.info(
+        f"Distributed kernel: {count_cell_nodes(pdf)} nodes, {len(pdf)} edges "
+        f"in {num_blocks} source blocks"
+    )
+
+    cell_broadcast = spark.sparkContext.broadcast(pdf)
+
+    def process_blocks(batches):
+        """Compute the rows of every block id in the incoming batches."""
+        cell_pdf = cell_broadcast.value
+        for batch in batches:
+            for block in batch["id"]:
+                result = block_shortest_paths(
+                    cell_pdf, int(block), num_blocks,
+                    chunk_entries=chunk_entries, boundary_res=boundary_res
+                )
+                if len(result) > 0:
+                    yield result[["from_edge", "to_edge", "via_edge", "cost"]]
+
+    return spark.range(0, num_blocks, numPartitions=num_blocks).mapInPandas(
+        process_blocks,
+        schema=OUTPUT_SCHEMA
+    )
+
+
+# ============================================================================
+# 3. OVERSIZED CELLS OF A PARTITIONED WORKLOAD
+# ============================================================================
+
+def compute_shortest_paths_distributed(
+    df_shortcuts: DataFrame,
+    cells: list,
+    num_blocks: int = None,
+    chunk_entries: int = config.SCIPY_CHUNK_ENTRIES,
+    boundary_res: int = None
+) -> DataFrame:
+    """
+    Run the blocked kernel for each of the given cells and union the results.
+
+    Args:
+        df_shortcuts: Active shortcuts with current_cell
+        cells: current_cell values to compute (must not be empty)
+
+    Returns:
+        DataFrame (from_edge, to_edge, via_edge, cost)
+    """
+    results = []
+    for cell in cells:
+        logger.info(f"Computing oversized cell {cell} with the distributed kernel")
+        results.append(distributed_shortest_paths(
+            df_shortcuts.filter(F.col("current_cell") == cell),
+            num_blocks=num_blocks,
+            chunk_entries=chunk_entries,
+            boundary_res=boundary_res
+        ))
+
+    result = results[0]
+    for other in results[1:]:
+        result = result.unionByName(other)
+    return result
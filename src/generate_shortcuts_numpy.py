@@ -0,0 +1,807 @@
+"""
+generate_shortcuts_numpy.py
+===========================
+
+Single-node shortcuts generation on NumPy arrays (no Spark).
+
+Runs the same algorithm as the Spark engines in one process, without
+Spark startup, scheduling and per-resolution checkpoints:
+1. Forward pass (resolution 15 → -1): Build LOCAL shortcuts within cells
+2. Backward pass (resolution 0 → 15): Build GLOBAL shortcuts with two-cell approach
+
+Cell assignment (inner/outer cell), the per-cell kernels and the merge rule
+(strictly cheaper or new keys win) match utilities.py, and the output has
+the same Parquet schema. On machines with many cores the cells of a
+resolution are spread over a process pool; edge attributes and the working
+shortcuts columns are shared with the workers through shared memory
+(shared_arrays.py), so tasks only carry cell index ranges.
+
+With save_state, the per-cell kernel inputs (signatures) and outputs of
+every resolution are kept next to the output; incremental_update.py replays
+the passes after edge cost changes and recomputes only the cells whose
+input differs.
+"""
+
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from logging_config import get_logger, log_section, log_dict
+from h3_bitwise import h3_parent, h3_lca, h3_resolution
+from shared_arrays import SharedArrayStore, attach_arrays, export_columns, import_columns
+from shortest_path_kernels import auto_shortest_paths, empty_result
+import config
+
+logger = get_logger(__name__)
+
+GEOMETRY_COLUMNS = ["lca_in", "lca_out", "lca_res", "inner_cell", "outer_cell", "inner_res", "outer_res"]
+RESULT_COLUMNS = ["from_edge", "to_edge", "via_edge", "cost"]
+
+
+# ============================================================================
+# 1. DATA LOADING
+# ============================================================================
+
+class EdgeTable:
+    """
+    Edge attributes as arrays sorted by edge id.
+
+    Attributes:
+        ids, from_cell, to_cell, lca_res, cost: Aligned arrays (int64 / float64)
+    """
+
+    def __init__(self, ids, from_cell, to_cell, lca_res, cost):
+        order = np.argsort(ids, kind="stable")
+        self.ids = np.asarray(ids, dtype=np.int64)[order]
+        self.from_cell = np.asarray(from_cell, dtype=np.int64)[order]
+        self.to_cell = np.asarray(to_cell, dtype=np.int64)[order]
+        self.lca_res = np.asarray(lca_res, dtype=np.int64)[order]
+        self.cost = np.asarray(cost, dtype=np.float64)[order]
+        self.n_edges = len(self.ids)
+
+    def index_of(self, edge_ids: np.ndarray) -> np.ndarray:
+        """Positions of edge_ids in the table (all must exist)."""
+        edge_ids = np.asarray(edge_ids, dtype=np.int64)
+        pos = np.searchsorted(self.ids, edge_ids)
+        pos_clipped = np.minimum(pos, self.n_edges - 1)
+        if not np.all(self.ids[pos_clipped] == edge_ids):
+            raise ValueError("Shortcuts reference edge ids missing from the edges file")
+        return pos_clipped
+
+
+def load_edges(file_path: str) -> EdgeTable:
+    """Load edges (id or edge_index, from_cell, to_cell, lca_res, length, maxspeed) with costs."""
+    edges = pd.read_csv(file_path)
+
+    # Handle both 'id' and 'edge_index' column names
+    if "edge_index" in edges.columns and "id" not in edges.columns:
+        edges = edges.rename(columns={"edge_index": "id"})
+
+    # Same cost as utilities.dummy_cost: length / maxspeed (inf for maxspeed <= 0)
+    maxspeed = edges["maxspeed"].astype(np.float64).values
+    length = edges["length"].astype(np.float64).values
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cost = np.where(maxspeed <= 0, np.inf, length / maxspeed)
+
+    return EdgeTable(
+        edges["id"].values, edges["from_cell"].values, edges["to_cell"].values,
+        edges["lca_res"].values, cost
+    )
+
+
+def initial_shortcuts(file_path: str, edges: EdgeTable) -> pd.DataFrame:
+    """Initial shortcuts from the edge graph: via_edge = to_edge, cost = cost of from_edge."""
+    graph = pd.read_csv(file_path, usecols=["from_edge", "to_edge"])
+    from_edge = graph["from_edge"].values.astype(np.int64)
+    return pd.DataFrame({
+        "from_edge": from_edge,
+        "to_edge": graph["to_edge"].values.astype(np.int64),
+        "cost": edges.cost[edges.index_of(from_edge)],
+        "via_edge": graph["to_edge"].values.astype(np.int64)
+    })
+
+
+# ============================================================================
+# 2. SHORTCUTS TABLE (GEOMETRY AND MERGING)
+# ============================================================================
+
+class ShortcutTable:
+    """
+    Working shortcuts table as arrays sorted by key (from_edge, to_edge).
+
+    Attributes:
+        from_edge, to_edge, via_edge: Edge ids (int64)
+        cost: Shortcut cost (float64)
+        keys: from_index * n_edges + to_index (sorted, unique)
+        lca_in, lca_out, lca_res, inner_cell, outer_cell, inner_res, outer_res:
+            Geometry, as in utilities.add_shortcut_geometry
+    """
+
+    def __init__(self, edges: EdgeTable, shortcuts: pd.DataFrame):
+        self.edges = edges
+        batch = self._best_per_key(
+            shortcuts["from_edge"].values, shortcuts["to_edge"].values,
+            shortcuts["via_edge"].values, shortcuts["cost"].values
+        )
+        self._set_rows(*batch)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _keys(self, from_edge: np.ndarray, to_edge: np.ndarray) -> np.ndarray:
+        return self.edges.index_of(from_edge) * self.edges.n_edges + self.edges.index_of(to_edge)
+
+    def _best_per_key(self, from_edge, to_edge, via_edge, cost) -> tuple:
+        """Cheapest row per key, sorted by key."""
+        from_edge = np.asarray(from_edge, dtype=np.int64)
+        to_edge = np.asarray(to_edge, dtype=np.int64)
+        via_edge = np.asarray(via_edge, dtype=np.int64)
+        cost = np.asarray(cost, dtype=np.float64)
+        keys = self._keys(from_edge, to_edge)
+
+        order = np.lexsort((cost, keys))
+        keys = keys[order]
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+        order = order[first]
+        return keys[first], from_edge[order], to_edge[order], via_edge[order], cost[order]
+
+    def _geometry(self, from_edge: np.ndarray, to_edge: np.ndarray) -> dict:
+        """Inner/outer cell geometry of shortcuts (A = from_edge, B = to_edge)."""
+        a = self.edges.index_of(from_edge)
+        b = self.edges.index_of(to_edge)
+        lca_in = self.edges.lca_res[a]
+        lca_out = self.edges.lca_res[b]
+        inner_cell = h3_lca(self.edges.to_cell[a], self.edges.from_cell[b])
+        outer_cell = h3_lca(self.edges.from_cell[a], self.edges.to_cell[b])
+        return {
+            "lca_in": lca_in,
+            "lca_out": lca_out,
+            "lca_res": np.maximum(lca_in, lca_out),
+            "inner_cell": inner_cell,
+            "outer_cell": outer_cell,
+            "inner_res": h3_resolution(inner_cell),
+            "outer_res": h3_resolution(outer_cell)
+        }
+
+    def _set_rows(self, keys, from_edge, to_edge, via_edge, cost):
+        self.keys = keys
+        self.from_edge = from_edge
+        self.to_edge = to_edge
+        self.via_edge = via_edge
+        self.cost = cost
+        for name, values in self._geometry(from_edge, to_edge).items():
+            setattr(self, name, values)
+
+    def merge(self, new_shortcuts: pd.DataFrame) -> dict:
+        """
+        Merge new shortcuts, keeping minimum cost paths (same rule as merge_shortcuts).
+
+        Returns:
+            {"inserted": n, "improved": n}
+        """
+        if len(new_shortcuts) == 0:
+            return {"inserted": 0, "improved": 0}
+
+        keys, from_edge, to_edge, via_edge, cost = self._best_per_key(
+            new_shortcuts["from_edge"].values, new_shortcuts["to_edge"].values,
+            new_shortcuts["via_edge"].values, new_shortcuts["cost"].values
+        )
+
+        pos = np.searchsorted(self.keys, keys)
+        pos_clipped = np.minimum(pos, len(self.keys) - 1)
+        found = (pos < len(self.keys)) & (self.keys[pos_clipped] == keys)
+
+        # Improved keys: update in place
+        improved = found & (cost < self.cost[pos_clipped])
+        self.cost[pos_clipped[improved]] = cost[improved]
+        self.via_edge[pos_clipped[improved]] = via_edge[improved]
+
+        # New keys: append with their geometry, then restore key order
+        inserted = ~found
+        if inserted.any():
+            geometry = self._geometry(from_edge[inserted], to_edge[inserted])
+            all_keys = np.concatenate([self.keys, keys[inserted]])
+            order = np.argsort(all_keys, kind="stable")
+            self.keys = all_keys[order]
+            self.from_edge = np.concatenate([self.from_edge, from_edge[inserted]])[order]
+            self.to_edge = np.concatenate([self.to_edge, to_edge[inserted]])[order]
+            self.via_edge = np.concatenate([self.via_edge, via_edge[inserted]])[order]
+            self.cost = np.concatenate([self.cost, cost[inserted]])[order]
+            for name in GEOMETRY_COLUMNS:
+                setattr(self, name, np.concatenate([getattr(self, name), geometry[name]])[order])
+
+        return {"inserted": int(inserted.sum()), "improved": int(improved.sum())}
+
+
+# ============================================================================
+# 3. CELL ASSIGNMENT
+# ============================================================================
+
+def assign_cells(table: ShortcutTable, current_res: int) -> tuple:
+    """
+    Active rows and their current_cell at current_res (forward and backward).
+
+    Same rule as utilities._assign_inner_outer: a row is active in
+    parent(inner_cell) when lca_res <= R <= inner_res, and in
+    parent(outer_cell) when lca_res <= R <= outer_res (possibly both).
+
+    Returns:
+        (rows, cells) sorted by cell
+    """
+    inner_rows = np.flatnonzero((table.lca_res <= current_res) & (table.inner_res >= current_res))
+    outer_rows = np.flatnonzero((table.lca_res <= current_res) & (table.outer_res >= current_res))
+
+    rows = np.concatenate([inner_rows, outer_rows])
+    cells = np.concatenate([
+        h3_parent(table.inner_cell[inner_rows], current_res),
+        h3_parent(table.outer_cell[outer_rows], current_res)
+    ])
+
+    order = np.argsort(cells, kind="stable")
+    return rows[order], cells[order]
+
+
+def cell_starts(cells: np.ndarray) -> np.ndarray:
+    """Offsets of each cell's first row in cell-sorted rows, plus the total (n_cells + 1)."""
+    bounds = np.flatnonzero(cells[1:] != cells[:-1]) + 1
+    return np.concatenate([[0], bounds, [len(cells)]]).astype(np.int64)
+
+
+def split_cells(active: pd.DataFrame, starts: np.ndarray) -> list:
+    """Split cell-sorted kernel input into one DataFrame per cell."""
+    return [active.iloc[start:end] for start, end in zip(starts[:-1], starts[1:])]
+
+
+def cell_frames(table: ShortcutTable, rows: np.ndarray, cells: np.ndarray, boundary: bool = False) -> list:
+    """Kernel input DataFrame of every cell (rows sorted by cell)."""
+    active = pd.DataFrame({
+        "from_edge": table.from_edge[rows],
+        "to_edge": table.to_edge[rows],
+        "via_edge": table.via_edge[rows],
+        "cost": table.cost[rows]
+    })
+    if boundary:
+        active["lca_in"] = table.lca_in[rows]
+        active["lca_out"] = table.lca_out[rows]
+
+    return split_cells(active, cell_starts(cells))
+
+
+# ============================================================================
+# 4. PER-CELL SHORTEST PATHS
+# ============================================================================
+
+def run_cell_batch(
+    frames: list,
+    boundary_res: int = None,
+    dense_max_nodes: int = config.DENSE_MAX_NODES,
+    chunk_entries: int = config.SCIPY_CHUNK_ENTRIES,
+    cell_offset: int = None
+) -> pd.DataFrame:
+    """
+    Run the size-dispatched kernel on a batch of cells and concatenate the rows.
+
+    With cell_offset, rows get a cell_pos column: cell_offset + position of
+    their cell in frames.
+    """
+    results = []
+    for i, pdf in enumerate(frames):
+        result = auto_shortest_paths(pdf, dense_max_nodes, chunk_entries=chunk_entries, boundary_res=boundary_res)
+        if len(result) > 0:
+            if cell_offset is not None:
+                result["cell_pos"] = np.int64(cell_offset + i)
+            results.append(result)
+    if not results:
+        return empty_output(tag_cells=cell_offset is not None)
+    return pd.concat(results, ignore_index=True)
+
+
+def empty_output(tag_cells: bool = False) -> pd.DataFrame:
+    """Empty kernel output (with cell_pos when tagged)."""
+    result = empty_result()
+    if tag_cells:
+        result["cell_pos"] = pd.Series(dtype=np.int64)
+    return result
+
+
+def batch_cell_ranges(starts: np.ndarray, target_rows: int) -> list:
+    """Group consecutive cells into [cell_lo, cell_hi) ranges of about target_rows input rows."""
+    ranges, cell_lo = [], 0
+    n_cells = len(starts) - 1
+    for cell in range(n_cells):
+        if starts[cell + 1] - starts[cell_lo] >= target_rows:
+            ranges.append((cell_lo, cell + 1))
+            cell_lo = cell + 1
+    if cell_lo < n_cells:
+        ranges.append((cell_lo, n_cells))
+    return ranges
+
+
+def run_cell_range(specs: dict, cell_lo: int, cell_hi: int, boundary_res: int = None, tag_cells: bool = False):
+    """
+    Pool task: shortest paths of cells [cell_lo, cell_hi) read from shared memory.
+
+    Returns:
+        export_columns spec of the result rows (None if empty)
+    """
+    arrays = attach_arrays(specs)
+    starts = arrays["cell_starts"][cell_lo:cell_hi + 1]
+    rows = arrays["rows"][starts[0]:starts[-1]]
+
+    active = pd.DataFrame({
+        "from_edge": arrays["from_edge"][rows],
+        "to_edge": arrays["to_edge"][rows],
+        "via_edge": arrays["via_edge"][rows],
+        "cost": arrays["cost"][rows]
+    })
+    if boundary_res is not None:
+        edge_ids = arrays["edge_ids"]
+        active["lca_in"] = arrays["edge_lca_res"][np.searchsorted(edge_ids, active["from_edge"].values)]
+        active["lca_out"] = arrays["edge_lca_res"][np.searchsorted(edge_ids, active["to_edge"].values)]
+
+    result = run_cell_batch(
+        split_cells(active, starts - starts[0]), boundary_res=boundary_res,
+        cell_offset=cell_lo if tag_cells else None
+    )
+    columns = RESULT_COLUMNS + (["cell_pos"] if tag_cells else [])
+    return export_columns({name: result[name].values for name in columns})
+
+
+def publish_edges(store: SharedArrayStore, edges: EdgeTable):
+    """Publish the edge attribute arrays once (ids, cells, lca_res, cost)."""
+    store.put("edge_ids", edges.ids)
+    store.put("edge_from_cell", edges.from_cell)
+    store.put("edge_to_cell", edges.to_cell)
+    store.put("edge_lca_res", edges.lca_res)
+    store.put("edge_cost", edges.cost)
+
+
+def compute_cells(
+    table: ShortcutTable,
+    rows: np.ndarray,
+    cells: np.ndarray,
+    boundary_res: int = None,
+    pool: ProcessPoolExecutor = None,
+    store: SharedArrayStore = None,
+    tag_cells: bool = False
+) -> pd.DataFrame:
+    """
+    Shortest paths of all cells of one resolution, in-process or over the pool.
+
+    With a pool, the table columns and the cell-sorted active rows are copied
+    into the shared store (blocks are reused while they fit) and the workers
+    receive only cell ranges. With tag_cells, rows carry cell_pos (position of
+    their cell in cell order).
+    """
+    starts = cell_starts(cells)
+    n_cells = len(starts) - 1
+
+    if pool is None or n_cells < 2:
+        frames = cell_frames(table, rows, cells, boundary=boundary_res is not None)
+        return run_cell_batch(frames, boundary_res=boundary_res, cell_offset=0 if tag_cells else None)
+
+    store.put("from_edge", table.from_edge)
+    store.put("to_edge", table.to_edge)
+    store.put("via_edge", table.via_edge)
+    store.put("cost", table.cost)
+    store.put("rows", rows)
+    store.put("cell_starts", starts)
+    specs = store.specs(
+        ["from_edge", "to_edge", "via_edge", "cost", "rows", "cell_starts", "edge_ids", "edge_lca_res"]
+    )
+
+    # About four ranges per worker, so uneven cells still balance
+    target_rows = max(1, len(rows) // (4 * pool_workers()))
+    futures = [
+        pool.submit(run_cell_range, specs, cell_lo, cell_hi, boundary_res, tag_cells)
+        for cell_lo, cell_hi in batch_cell_ranges(starts, target_rows)
+    ]
+
+    results = []
+    for future in futures:
+        spec = future.result()
+        if spec is not None:
+            results.append(pd.DataFrame(import_columns(spec)))
+    if not results:
+        return empty_output(tag_cells)
+    return pd.concat(results, ignore_index=True)
+
+
+def pool_workers() -> int:
+    """Number of pool workers (NUMPY_WORKERS, default: all cores)."""
+    return config.NUMPY_WORKERS or os.cpu_count() or 1
+
+
+def create_pool():
+    """Process pool over cells when the machine has enough cores (None otherwise)."""
+    if (os.cpu_count() or 1) < config.NUMPY_POOL_MIN_CORES or pool_workers() < 2:
+        return None
+    return ProcessPoolExecutor(max_workers=pool_workers())
+
+
+# ============================================================================
+# 5. REBUILD STATE (INCREMENTAL UPDATES)
+# ============================================================================
+
+def _mix64(values: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer on uint64 arrays (wrapping arithmetic)."""
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def cell_signatures(table: ShortcutTable, rows: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    Order-independent 64-bit signature of each cell's input rows.
+
+    Sum of per-row hashes of (from_edge, to_edge, via_edge, cost bits) plus a
+    hash of the row count; equal signatures mean an identical kernel input.
+    """
+    row_hash = _mix64(table.from_edge[rows].astype(np.uint64))
+    for values in (table.to_edge[rows], table.via_edge[rows], table.cost[rows].view(np.int64)):
+        row_hash = _mix64(row_hash + values.astype(np.uint64))
+    return np.add.reduceat(row_hash, starts[:-1]) + _mix64(np.diff(starts).astype(np.uint64))
+
+
+class RebuildState:
+    """
+    Per-cell signatures and kernel outputs of every resolution of a run.
+
+    Records of the previous run are read from state_dir (when reuse is set
+    and the run settings match); records of the current run are written to a
+    work directory that replaces state_dir on commit().
+    """
+
+    def __init__(self, state_dir: str, boundary_only: bool, reuse: bool = True):
+        self.state_dir = Path(state_dir)
+        self.boundary_only = boundary_only
+        self.meta = self._read_meta() if reuse else None
+
+        if self.meta is not None and self.meta["boundary_only"] != boundary_only:
+            logger.warning("Saved state was built with a different boundary_only setting, ignoring it")
+            self.meta = None
+
+        self._work_dir = self.state_dir.with_name(self.state_dir.name + ".tmp")
+        shutil.rmtree(self._work_dir, ignore_errors=True)
+        self._work_dir.mkdir(parents=True)
+
+    def _read_meta(self):
+        meta_path = self.state_dir / "meta.json"
+        if not meta_path.exists():
+            return None
+        return json.loads(meta_path.read_text())
+
+    @property
+    def has_previous(self) -> bool:
+        return self.meta is not None
+
+    def edge_costs(self) -> tuple:
+        """(ids, cost) of the edges of the previous run."""
+        with np.load(self.state_dir / "edges.npz") as data:
+            return data["ids"], data["cost"]
+
+    def previous(self, phase: str, current_res: int):
+        """Record of the previous run for (phase, resolution), or None."""
+        path = self.state_dir / f"{phase}_{current_res}.npz"
+        if self.meta is None or not path.exists():
+            return None
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+
+    def record(self, phase: str, current_res: int, **arrays):
+        """Save the record of the current run for (phase, resolution)."""
+        np.savez(self._work_dir / f"{phase}_{current_res}.npz", **arrays)
+
+    def commit(self, edges: EdgeTable):
+        """Save the edge costs and replace the previous state with this run."""
+        np.savez(self._work_dir / "edges.npz", ids=edges.ids, cost=edges.cost)
+        (self._work_dir / "meta.json").write_text(json.dumps({"boundary_only": self.boundary_only}))
+        shutil.rmtree(self.state_dir, ignore_errors=True)
+        self._work_dir.rename(self.state_dir)
+
+    def discard(self):
+        """Drop the records of the current run."""
+        shutil.rmtree(self._work_dir, ignore_errors=True)
+
+
+def state_dir_for(output_path: str) -> str:
+    """State directory kept next to an output directory."""
+    return str(output_path).rstrip("/") + "_state"
+
+
+def compute_cells_incremental(
+    table: ShortcutTable,
+    rows: np.ndarray,
+    cells: np.ndarray,
+    phase: str,
+    current_res: int,
+    state: RebuildState,
+    boundary_res: int = None,
+    pool: ProcessPoolExecutor = None,
+    store: SharedArrayStore = None
+) -> tuple:
+    """
+    Like compute_cells, but reuse the previous output of cells whose input is unchanged.
+
+    Rows keep the cell order of a full run (cells ascending, kernel order
+    within a cell), so merging gives the same table as recomputing all cells.
+
+    Returns:
+        (new_shortcuts, number of recomputed cells)
+    """
+    starts = cell_starts(cells)
+    cell_ids = cells[starts[:-1]]
+    signatures = cell_signatures(table, rows, starts)
+
+    dirty = np.ones(len(cell_ids), dtype=bool)
+    previous = state.previous(phase, current_res)
+    if previous is not None and len(previous["cell_ids"]) > 0:
+        pos = np.minimum(np.searchsorted(previous["cell_ids"], cell_ids), len(previous["cell_ids"]) - 1)
+        dirty = ~((previous["cell_ids"][pos] == cell_ids) & (previous["signatures"][pos] == signatures))
+
+    parts = []
+    if dirty.any():
+        selected = np.repeat(dirty, np.diff(starts))
+        computed = compute_cells(
+            table, rows[selected], cells[selected], boundary_res=boundary_res,
+            pool=pool, store=store, tag_cells=True
+        )
+        computed_cells = cell_ids[dirty][computed["cell_pos"].values.astype(np.int64)]
+        parts.append({
+            **{name: computed[name].values for name in RESULT_COLUMNS},
+            "out_cell": computed_cells
+        })
+    if previous is not None and not dirty.all():
+        reused = np.isin(previous["out_cell"], cell_ids[~dirty])
+        parts.append({name: previous[name][reused] for name in RESULT_COLUMNS + ["out_cell"]})
+
+    output = {
+        "from_edge": np.concatenate([part["from_edge"] for part in parts]).astype(np.int64),
+        "to_edge": np.concatenate([part["to_edge"] for part in parts]).astype(np.int64),
+        "via_edge": np.concatenate([part["via_edge"] for part in parts]).astype(np.int64),
+        "cost": np.concatenate([part["cost"] for part in parts]).astype(np.float64),
+        "out_cell": np.concatenate([part["out_cell"] for part in parts]).astype(np.int64)
+    }
+    order = np.argsort(output["out_cell"], kind="stable")
+    output = {name: values[order] for name, values in output.items()}
+
+    state.record(phase, current_res, cell_ids=cell_ids, signatures=signatures, **output)
+    return pd.DataFrame({name: output[name] for name in RESULT_COLUMNS}), int(dirty.sum())
+
+
+# ============================================================================
+# 6. FINAL OUTPUT
+# ============================================================================
+
+def final_rows(table: ShortcutTable) -> tuple:
+    """
+    Output row mask, inside and cell of every table row (cost independent).
+
+    Same rules as utilities.add_final_info.
+    """
+    valid = (table.lca_res <= table.inner_res) | (table.lca_res <= table.outer_res)
+
+    inside = np.where(
+        table.lca_res > table.inner_res, -2,
+        np.where(table.lca_in == table.lca_out, 0,
+                 np.where(table.lca_in < table.lca_out, -1, 1))
+    ).astype(np.int8)
+
+    cell = h3_parent(table.outer_cell, np.minimum(table.lca_in, table.lca_out))
+    return valid, inside, cell
+
+
+def output_id_type(edges: EdgeTable):
+    """Spark infers int for edge ids that fit in 32 bits."""
+    return np.int32 if edges.ids.max(initial=0) < 2 ** 31 else np.int64
+
+
+def final_info(table: ShortcutTable) -> pd.DataFrame:
+    """
+    Output rows with cell and inside (same rules as utilities.add_final_info).
+
+    Columns: from_edge, to_edge, cost, via_edge, inside, cell
+    """
+    valid, inside, cell = final_rows(table)
+    id_type = output_id_type(table.edges)
+
+    return pd.DataFrame({
+        "from_edge": table.from_edge[valid].astype(id_type),
+        "to_edge": table.to_edge[valid].astype(id_type),
+        "cost": table.cost[valid],
+        "via_edge": table.via_edge[valid].astype(id_type),
+        "inside": inside[valid],
+        "cell": cell[valid]
+    })
+
+
+def write_output(final_df: pd.DataFrame, output_path: str):
+    """Write a Parquet directory like Spark's (single part file)."""
+    output_dir = Path(output_path)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for old_part in output_dir.glob("part-*.parquet"):
+        old_part.unlink()
+    final_df.to_parquet(output_dir / "part-00000.parquet", index=False)
+
+
+# ============================================================================
+# MAIN EXECUTION
+# ============================================================================
+
+def run_resolution(
+    table: ShortcutTable,
+    phase: str,
+    current_res: int,
+    boundary_res: int = None,
+    pool: ProcessPoolExecutor = None,
+    store: SharedArrayStore = None,
+    state: RebuildState = None,
+    topology=None
+):
+    """
+    Assign cells, compute shortest paths and merge for one resolution (None if idle).
+
+    topology: Optional recorder of the cell graphs (customization.TopologyRecorder)
+    """
+    rows, cells = assign_cells(table, current_res)
+    logger.info(f"✓ {len(rows)} active shortcuts at resolution {current_res}")
+
+    if len(rows) == 0:
+        logger.info("No active shortcuts, skipping...")
+        return None
+
+    if topology is not None:
+        topology.record(phase, current_res, table, rows, cells, boundary_res)
+
+    n_cells = len(cell_starts(cells)) - 1
+    if state is None:
+        new_shortcuts = compute_cells(table, rows, cells, boundary_res=boundary_res, pool=pool, store=store)
+        computed_cells = n_cells
+    else:
+        new_shortcuts, computed_cells = compute_cells_incremental(
+            table, rows, cells, phase, current_res, state, boundary_res=boundary_res, pool=pool, store=store
+        )
+    logger.info(f"✓ Generated {len(new_shortcuts)} shortcuts in {n_cells} cells ({computed_cells} computed)")
+
+    merge_stats = table.merge(new_shortcuts)
+    logger.info(f"✓ Merged: {merge_stats['inserted']} inserted, {merge_stats['improved']} improved")
+
+    return {
+        "phase": phase,
+        "resolution": current_res,
+        "active": len(rows),
+        "cells": n_cells,
+        "computed_cells": computed_cells,
+        "generated": len(new_shortcuts),
+        "inserted": merge_stats["inserted"],
+        "improved": merge_stats["improved"]
+    }
+
+
+def run_passes(
+    table: ShortcutTable,
+    boundary_only: bool = config.BOUNDARY_ONLY,
+    pool: ProcessPoolExecutor = None,
+    store: SharedArrayStore = None,
+    state: RebuildState = None,
+    topology=None
+) -> list:
+    """Run the forward and backward passes on the table (in place) and return per-resolution results."""
+    resolution_results = []
+
+    log_section(logger, "PHASE 1: FORWARD PASS (15 → -1)")
+    for current_res in range(15, -2, -1):
+        log_section(logger, f"Forward: Resolution {current_res}")
+        boundary_res = current_res if boundary_only and current_res >= 0 else None
+        result = run_resolution(table, "forward", current_res, boundary_res, pool, store, state, topology)
+        if result:
+            resolution_results.append(result)
+
+    log_section(logger, "PHASE 2: BACKWARD PASS (0 → 15)")
+    for current_res in range(0, 16):
+        log_section(logger, f"Backward: Resolution {current_res}")
+        result = run_resolution(
+            table, "backward", current_res, pool=pool, store=store, state=state, topology=topology
+        )
+        if result:
+            resolution_results.append(result)
+
+    return resolution_results
+
+
+def log_summary(resolution_results: list, total_shortcuts: int):
+    """Log one line per processed resolution and the total."""
+    log_section(logger, "SUMMARY")
+    for r in resolution_results:
+        logger.info(
+            f"  {r['phase']:8s} res={r['resolution']:2d}: {r['active']} active in {r['cells']} cells "
+            f"({r['computed_cells']} computed) → "
+            f"{r['generated']} generated, {r['inserted']} inserted, {r['improved']} improved"
+        )
+    logger.info(f"\n✓ Total shortcuts: {total_shortcuts}")
+
+
+def numpy_output_path() -> str:
+    """Output directory of the NumPy engine."""
+    return str(config.SHORTCUTS_OUTPUT_FILE).replace("_shortcuts", "_numpy")
+
+
+def main(boundary_only: bool = config.BOUNDARY_ONLY, save_state: bool = config.NUMPY_SAVE_STATE):
+    """
+    Main execution function for the NumPy version.
+
+    Args:
+        boundary_only: Forward pass emits only pairs between boundary edges of each cell
+        save_state: Keep per-cell signatures and outputs for incremental_update.py
+    """
+    log_section(logger, "SHORTCUTS GENERATION - NUMPY VERSION")
+
+    config_info = {
+        "edges_file": str(config.EDGES_FILE),
+        "graph_file": str(config.GRAPH_FILE),
+        "output_file": str(config.SHORTCUTS_OUTPUT_FILE),
+        "district": config.DISTRICT_NAME,
+        "boundary_only": boundary_only,
+        "save_state": save_state,
+        "cores": os.cpu_count()
+    }
+    log_dict(logger, config_info, "Configuration")
+
+    pool = create_pool()
+    store = SharedArrayStore() if pool else None
+    logger.info(f"Cell execution: {'process pool (shared memory)' if pool else 'in-process'}")
+
+    output_path = numpy_output_path()
+    state = RebuildState(state_dir_for(output_path), boundary_only, reuse=False) if save_state else None
+
+    try:
+        logger.info("Loading edge data...")
+        edges = load_edges(str(config.EDGES_FILE))
+        logger.info(f"✓ Loaded {edges.n_edges} edges")
+        if store:
+            publish_edges(store, edges)
+
+        logger.info("Creating initial shortcuts table...")
+        table = ShortcutTable(edges, initial_shortcuts(str(config.GRAPH_FILE), edges))
+        logger.info(f"✓ Created {len(table)} initial shortcuts")
+
+        resolution_results = run_passes(table, boundary_only, pool, store, state)
+
+        log_section(logger, "SAVING OUTPUT")
+        logger.info(f"Final shortcuts count: {len(table)}")
+
+        logger.info("Adding final info (cell, inside)...")
+        final_df = final_info(table)
+
+        logger.info(f"Saving to: {output_path}")
+        write_output(final_df, output_path)
+        logger.info("✓ Saved successfully!")
+
+        if state:
+            state.commit(edges)
+            state = None
+            logger.info(f"✓ Saved rebuild state to: {state_dir_for(output_path)}")
+
+        log_summary(resolution_results, len(final_df))
+
+    finally:
+        if state:
+            state.discard()
+        if pool:
+            pool.shutdown()
+        if store:
+            store.close()
+
+    log_section(logger, "COMPLETED")
+
+
+if __name__ == "__main__":
+    main()
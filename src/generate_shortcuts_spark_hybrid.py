@@ -4,7 +4,12 @@ generate_shortcuts_hybrid.py
 
 Hybrid shortcuts generation combining Scipy and Pure Spark algorithms.
 
-Allows selecting which algorithm to use for each resolution level:
+By default each cell is sent to a kernel chosen from its size:
+- Dense min-plus: tiny cells (vectorized Floyd-Warshall)
+- Scipy: medium cells (Dijkstra in one Python worker)
+- Distributed: giant cells (source blocks spread over the executors)
+
+Passing resolution lists instead selects the algorithm per resolution level:
 - Scipy: Faster for smaller partitions (fine resolutions)
 - Pure Spark: Better for larger partitions (coarse resolutions)
 
@@ -13,27 +18,40 @@ Algorithm:
 2. Backward pass (resolution 0 → 15): Build GLOBAL shortcuts with two-cell approach
 """
 
+import logging
+
 import pandas as pd
-import numpy as np
-from scipy.sparse import csr_matrix
-from scipy.sparse.csgraph import shortest_path
 
 from pyspark.sql import DataFrame
 from pyspark.sql import functions as F
-from pyspark.sql.window import Window
 from pyspark.sql.types import StructType, StructField, IntegerType, DoubleType
 
 from logging_config import get_logger, log_section, log_dict
+from generate_shortcuts_spark_pure import compute_shortest_paths_pure_spark
+from distributed_apsp import find_oversized_cells, compute_shortest_paths_distributed
+from shortest_path_kernels import sparse_shortest_paths, auto_shortest_paths
 from utilities import (
     initialize_spark,
     read_edges,
     initial_shortcuts_table,
+    add_shortcut_geometry,
     update_dummy_costs_for_edges,
     assign_cell_forward,
     assign_cell_backward,
     filter_active_shortcuts,
-    merge_shortcuts,
-    add_final_info
+    merge_shortcuts_with_stats,
+    partition_by_key,
+    ShortcutsTableStore,
+    DirtyCellTracker,
+    add_final_info,
+    shuffle_write_bytes,
+    shuffle_bytes_since,
+    format_bytes,
+    collect_cell_stats,
+    plan_cell_engines,
+    ENGINE_DENSE,
+    ENGINE_SCIPY,
+    ENGINE_DISTRIBUTED
 )
 import config
 
@@ -46,9 +64,19 @@ logger = get_logger(__name__)
 
 def compute_shortest_paths_scipy(
     df_shortcuts: DataFrame,
-    partition_columns: list = ["current_cell"]
+    partition_columns: list = ["current_cell"],
+    chunk_entries: int = config.SCIPY_CHUNK_ENTRIES,
+    boundary_res: int = None,
+    max_cell_nodes: int = config.SCIPY_MAX_NODES,
+    dense_max_nodes: int = None
 ) -> DataFrame:
-    """Compute all-pairs shortest paths using Scipy per partition."""
+    """
+    Compute all-pairs shortest paths using Scipy per partition.
+    
+    With dense_max_nodes set, partitions with at most that many nodes use the
+    dense min-plus kernel instead of Dijkstra. Cells with more than
+    max_cell_nodes nodes run on the distributed blocked kernel instead.
+    """
     logger.info("Computing shortest paths using Scipy (partition-wise)")
     
     output_schema = StructType([
@@ -59,192 +87,132 @@ def compute_shortest_paths_scipy(
     ])
     
     def process_partition_scipy(pdf: pd.DataFrame) -> pd.DataFrame:
-        """Process a single partition using Scipy's shortest_path."""
-        if len(pdf) == 0:
-            return pd.DataFrame(columns=['from_edge', 'to_edge', 'via_edge', 'cost'])
-        
-        # Map nodes to indices
-        nodes = pd.concat([pdf['from_edge'], pdf['to_edge']]).unique()
-        n_nodes = len(nodes)
-        node_to_idx = pd.Series(data=np.arange(n_nodes), index=nodes)
-        
-        # Deduplicate and keep minimum cost
-        pdf_dedup = pdf.loc[
-            pdf.groupby(['from_edge', 'to_edge'])['cost'].idxmin()
-        ]
-        
-        src_indices = pdf_dedup['from_edge'].map(node_to_idx).values
-        dst_indices = pdf_dedup['to_edge'].map(node_to_idx).values
-        costs = pdf_dedup['cost'].values
-        
-        # Store via_edges for direct paths
-        via_values = pdf_dedup['via_edge'].values + 1
-        via_matrix = csr_matrix((via_values, (src_indices, dst_indices)), shape=(n_nodes, n_nodes))
-        
-        # Build graph matrix
-        graph = csr_matrix((costs, (src_indices, dst_indices)), shape=(n_nodes, n_nodes))
-        
-        # Compute shortest paths
-        dist_matrix, predecessors = shortest_path(
-            csgraph=graph,
-            method='auto',
-            directed=True,
-            return_predecessors=True
-        )
-        
-        # Convert back to DataFrame
-        results = []
-        chunk_size = 2000
-        
-        for start_row in range(0, n_nodes, chunk_size):
-            end_row = min(start_row + chunk_size, n_nodes)
-            sub_dist = dist_matrix[start_row:end_row, :]
-            sub_pred = predecessors[start_row:end_row, :]
-            
-            valid_mask = (sub_dist != np.inf)
-            rows, cols = np.where(valid_mask)
-            global_rows = rows + start_row
-            
-            # Filter self-loops
-            non_loop_mask = (global_rows != cols)
-            rows = rows[non_loop_mask]
-            cols = cols[non_loop_mask]
-            global_rows = global_rows[non_loop_mask]
-            
-            if len(rows) == 0:
-                continue
-            
-            chunk_costs = sub_dist[rows, cols]
-            chunk_preds = sub_pred[rows, cols]
-            chunk_src = nodes[global_rows]
-            chunk_dst = nodes[cols]
-            
-            # Determine via_edge
-            original_vias = np.array(via_matrix[global_rows, cols]).flatten() - 1
-            is_direct = (chunk_preds == global_rows)
-            
-            final_vias = np.where(
-                is_direct,
-                original_vias,
-                nodes[chunk_preds]
+        """Process a single partition with the sparse Dijkstra (or dense) kernel."""
+        if dense_max_nodes is not None:
+            return auto_shortest_paths(
+                pdf, dense_max_nodes, chunk_entries=chunk_entries, boundary_res=boundary_res
             )
-            
-            chunk_df = pd.DataFrame({
-                'from_edge': chunk_src,
-                'to_edge': chunk_dst,
-                'via_edge': final_vias,
-                'cost': chunk_costs
-            })
-            results.append(chunk_df)
-        
-        if not results:
-            return pd.DataFrame(columns=['from_edge', 'to_edge', 'via_edge', 'cost'])
-        
-        return pd.concat(results, ignore_index=True)
+        return sparse_shortest_paths(pdf, chunk_entries=chunk_entries, boundary_res=boundary_res)
+    
+    # Ship only the kernel inputs to the Python workers (geometry stays in the JVM)
+    kernel_columns = ["from_edge", "to_edge", "via_edge", "cost"]
+    if boundary_res is not None:
+        kernel_columns += ["lca_in", "lca_out"]
+    df_shortcuts = df_shortcuts.select(*kernel_columns, *partition_columns)
+    
+    # Cells too large for one worker go to the distributed blocked kernel
+    oversized_cells = []
+    if max_cell_nodes is not None:
+        oversized_cells = find_oversized_cells(df_shortcuts, max_cell_nodes)
+    if oversized_cells:
+        logger.info(f"{len(oversized_cells)} cells exceed {max_cell_nodes} nodes")
+        distributed_result = compute_shortest_paths_distributed(
+            df_shortcuts, oversized_cells,
+            chunk_entries=chunk_entries, boundary_res=boundary_res
+        )
+        df_shortcuts = df_shortcuts.filter(~F.col("current_cell").isin(oversized_cells))
     
     result = df_shortcuts.groupBy(partition_columns).applyInPandas(
         process_partition_scipy,
         schema=output_schema
     )
     
+    if oversized_cells:
+        result = result.unionByName(distributed_result)
+    
     logger.info("✓ Scipy computation completed")
     return result
 
 
 # ============================================================================
-# PURE SPARK SHORTEST PATH COMPUTATION (from generate_shortcuts_spark.py)
+# SIZE-AWARE ENGINE SELECTION
 # ============================================================================
 
-def has_converged(current_paths: DataFrame, next_paths: DataFrame) -> bool:
-    """Check if the shortest path computation has converged."""
-    join_keys = ["from_edge", "to_edge", "cost", "current_cell"]
-    
-    changes = next_paths.join(
-        current_paths.select(join_keys),
-        on=join_keys,
-        how="left_anti"
+def log_engine_plan(plan: DataFrame, current_res: int) -> dict:
+    """Log the kernel chosen per cell and return the number of cells per engine."""
+    engine_counts = {ENGINE_DENSE: 0, ENGINE_SCIPY: 0, ENGINE_DISTRIBUTED: 0}
+    for row in plan.groupBy("engine").count().collect():
+        engine_counts[row["engine"]] = row["count"]
+    logger.info(
+        f"Engine plan at resolution {current_res}: "
+        + ", ".join(f"{engine}={count}" for engine, count in engine_counts.items())
     )
     
-    return changes.limit(1).count() == 0
+    largest = plan.orderBy(F.col("n_nodes").desc()).limit(config.ENGINE_PLAN_LOG_CELLS).collect()
+    for row in largest:
+        logger.info(
+            f"  cell {row['current_cell']}: {row['n_nodes']} nodes, "
+            f"{row['n_edges']} edges → {row['engine']}"
+        )
+    
+    if logger.isEnabledFor(logging.DEBUG):
+        for row in plan.collect():
+            logger.debug(
+                f"  cell {row['current_cell']}: {row['n_nodes']} nodes, "
+                f"{row['n_edges']} edges → {row['engine']}"
+            )
+    
+    return engine_counts
 
 
-def compute_shortest_paths_pure_spark(
-    shortcuts_df: DataFrame,
-    max_iterations: int = 10
-) -> DataFrame:
-    """Compute all-pairs shortest paths using pure Spark SQL operations."""
+def compute_shortest_paths_planned(
+    active_shortcuts: DataFrame,
+    current_res: int,
+    boundary_res: int = None,
+    dense_max_nodes: int = config.DENSE_MAX_NODES,
+    scipy_max_nodes: int = config.SCIPY_MAX_NODES
+) -> tuple:
+    """
+    Compute shortest paths sending each cell to the kernel chosen by its size.
     
-    logger.info(f"Computing shortest paths using pure Spark (max_iterations={max_iterations})")
+    Dense and scipy cells run in one applyInPandas pass (the kernel is picked
+    per partition); distributed cells run on the blocked kernel, one cell at
+    a time spread over all executors.
     
-    current_paths = shortcuts_df.select(
-        "from_edge", "to_edge", "cost", "via_edge", "current_cell"
+    Returns:
+        (new_shortcuts, engine_counts)
+    """
+    plan = plan_cell_engines(
+        collect_cell_stats(active_shortcuts), dense_max_nodes, scipy_max_nodes
     ).cache()
+    engine_counts = log_engine_plan(plan, current_res)
     
-    initial_count = current_paths.count()
-    logger.info(f"Initial paths count: {initial_count}")
+    planned = active_shortcuts.join(
+        F.broadcast(plan.select("current_cell", "engine")), on="current_cell"
+    )
     
-    for iteration in range(max_iterations):
-        logger.info(f"--- Iteration {iteration} ---")
-        
-        try:
-            # Path extension via self-join
-            new_paths = current_paths.alias("L").join(
-                current_paths.alias("R"),
-                [
-                    F.col("L.to_edge") == F.col("R.from_edge"),
-                    F.col("L.current_cell") == F.col("R.current_cell")
-                ],
-                "inner"
-            ).filter(
-                (F.col("L.from_edge") != F.col("R.to_edge"))
-            ).select(
-                F.col("L.from_edge").alias("from_edge"),
-                F.col("R.to_edge").alias("to_edge"),
-                (F.col("L.cost") + F.col("R.cost")).alias("cost"),
-                F.col("L.to_edge").alias("via_edge"),
-                F.col("L.current_cell").alias("current_cell")
-            ).cache()
-            
-            new_count = new_paths.count()
-            logger.info(f"Found {new_count} new paths")
-            
-            if new_count == 0:
-                logger.info("✓ No new paths found. Converged.")
-                new_paths.unpersist()
-                break
-            
-            # Cost minimization via window function
-            all_paths = current_paths.unionByName(new_paths)
-            
-            window_spec = Window.partitionBy(
-                "from_edge", "to_edge", "current_cell"
-            ).orderBy(F.col("cost").asc(), F.col("via_edge").asc())
-            
-            next_paths = all_paths.withColumn(
-                "rnk", F.row_number().over(window_spec)
-            ).filter(F.col("rnk") == 1).drop("rnk").localCheckpoint()
-            
-            next_count = next_paths.count()
-            logger.info(f"After cost minimization: {next_count} paths")
-            
-            current_paths.unpersist()
-            new_paths.unpersist()
-            
-            if next_count == initial_count and has_converged(current_paths, next_paths):
-                logger.info(f"✓ Iteration {iteration}: Converged!")
-                current_paths = next_paths
-                break
-            
-            current_paths = next_paths
-            initial_count = next_count
-            logger.info(f"✓ Iteration {iteration}: Completed")
-            
-        except Exception as e:
-            logger.error(f"Error in iteration {iteration}: {str(e)}")
-            raise
+    results = []
+    if engine_counts[ENGINE_DENSE] + engine_counts[ENGINE_SCIPY] > 0:
+        results.append(compute_shortest_paths_scipy(
+            planned.filter(F.col("engine") != ENGINE_DISTRIBUTED),
+            boundary_res=boundary_res,
+            max_cell_nodes=None,
+            dense_max_nodes=dense_max_nodes
+        ))
+    if engine_counts[ENGINE_DISTRIBUTED] > 0:
+        distributed_cells = [
+            row["current_cell"]
+            for row in plan.filter(F.col("engine") == ENGINE_DISTRIBUTED).select("current_cell").collect()
+        ]
+        results.append(compute_shortest_paths_distributed(
+            active_shortcuts, distributed_cells, boundary_res=boundary_res
+        ))
+    
+    # Every cell may have been skipped as unchanged
+    if not results:
+        plan.unpersist()
+        return planned.select("from_edge", "to_edge", "via_edge", "cost").limit(0), engine_counts
     
-    logger.info("✓ Pure Spark computation completed")
-    return current_paths.drop("current_cell")
+    new_shortcuts = results[0]
+    for result in results[1:]:
+        new_shortcuts = new_shortcuts.unionByName(result)
+    
+    # Materialize while the plan is still cached (the caller counts and merges
+    # the result), then release the plan
+    new_shortcuts = new_shortcuts.localCheckpoint()
+    plan.unpersist()
+    
+    return new_shortcuts, engine_counts
 
 
 # ============================================================================
@@ -254,22 +222,28 @@ def compute_shortest_paths_pure_spark(
 def main(
     scipy_resolutions: list = None,
     pure_spark_resolutions: list = None,
-    max_iterations: int = 10
+    max_iterations: int = 10,
+    boundary_only: bool = config.BOUNDARY_ONLY
 ):
     """
     Main execution function for hybrid version.
     
     Args:
-        scipy_resolutions: Resolutions to use Scipy for (default: 0-10)
-        pure_spark_resolutions: Resolutions to use pure Spark for (default: 11-15)
+        scipy_resolutions: Resolutions to use Scipy for (default: size-aware per cell)
+        pure_spark_resolutions: Resolutions to use pure Spark for (default: size-aware per cell)
         max_iterations: Max iterations for pure Spark algorithm
+        boundary_only: Forward pass emits only pairs between boundary edges of each cell
     """
     
-    # Default strategy: Scipy for fine, pure Spark for coarse
+    # Default strategy: pick the kernel per cell from its size.
+    # Giving either list selects the algorithm per resolution instead.
+    size_aware = scipy_resolutions is None and pure_spark_resolutions is None
     if scipy_resolutions is None:
-        scipy_resolutions = list(range(-1, 12))  # -1 to 11
+        scipy_resolutions = [] if size_aware else [
+            r for r in range(-1, 16) if r not in pure_spark_resolutions
+        ]
     if pure_spark_resolutions is None:
-        pure_spark_resolutions = list(range(12, 16))  # 12 to 15
+        pure_spark_resolutions = [r for r in range(-1, 16) if r not in scipy_resolutions]
     
     log_section(logger, "SHORTCUTS GENERATION - HYBRID VERSION")
     
@@ -278,23 +252,30 @@ def main(
         "graph_file": str(config.GRAPH_FILE),
         "output_file": str(config.SHORTCUTS_OUTPUT_FILE),
         "district": config.DISTRICT_NAME,
+        "engine_selection": "size-aware" if size_aware else "per-resolution",
+        "dense_max_nodes": config.DENSE_MAX_NODES,
+        "scipy_max_nodes": config.SCIPY_MAX_NODES,
         "scipy_resolutions": str(scipy_resolutions),
         "pure_spark_resolutions": str(pure_spark_resolutions),
-        "max_iterations": max_iterations
+        "max_iterations": max_iterations,
+        "boundary_only": boundary_only
     }
     log_dict(logger, config_info, "Configuration")
     
     spark = None
+    store = None
     
     try:
         # Initialize
         logger.info("Initializing Spark session...")
         spark = initialize_spark()
-        logger.info("✓ Spark session initialized")
+        store = ShortcutsTableStore(spark, config.SHORTCUTS_LAYOUT, config.NUM_BUCKETS)
+        cell_tracker = DirtyCellTracker(enabled=config.SKIP_CLEAN_CELLS)
+        logger.info(f"✓ Spark session initialized (layout: {config.SHORTCUTS_LAYOUT})")
         
         # Load data
         logger.info("Loading edge data...")
-        edges_df = read_edges(spark, str(config.EDGES_FILE)).cache()
+        edges_df = store.persist_edges(read_edges(spark, str(config.EDGES_FILE)))
         edges_count = edges_df.count()
         logger.info(f"✓ Loaded {edges_count} edges")
         
@@ -304,6 +285,10 @@ def main(
         
         logger.info("Creating initial shortcuts table...")
         shortcuts_df = initial_shortcuts_table(spark, str(config.GRAPH_FILE), edges_cost_df)
+        
+        # Inner/outer cell geometry is computed once and carried on the table,
+        # which stays partitioned by from_edge for the incremental merges
+        shortcuts_df = store.persist(partition_by_key(add_shortcut_geometry(shortcuts_df, edges_df)))
         shortcuts_count = shortcuts_df.count()
         logger.info(f"✓ Created {shortcuts_count} initial shortcuts")
         
@@ -320,7 +305,8 @@ def main(
             # Determine which algorithm to use
             use_scipy = current_res in scipy_resolutions
             algorithm = "Scipy" if use_scipy else "Pure Spark"
-            logger.info(f"Using {algorithm} algorithm for resolution {current_res}")
+            if not size_aware:
+                logger.info(f"Using {algorithm} algorithm for resolution {current_res}")
             
             # Assign cells
             logger.info(f"Assigning cells for resolution {current_res}...")
@@ -337,29 +323,55 @@ def main(
             
             active_shortcuts = active_shortcuts.cache()
             
+            # Skip cells whose input is unchanged since they were last processed
+            dirty_shortcuts, cell_stats = cell_tracker.filter_dirty(
+                active_shortcuts, current_res, boundary=boundary_only and current_res >= 0
+            )
+            if cell_stats["skipped"]:
+                logger.info(f"✓ Skipping {cell_stats['skipped']} of {cell_stats['cells']} unchanged cells")
+            
             # Compute shortest paths with selected algorithm
-            if use_scipy:
-                new_shortcuts = compute_shortest_paths_scipy(active_shortcuts)
+            # (boundary pairs only, except at the root)
+            boundary_res = current_res if boundary_only and current_res >= 0 else None
+            if size_aware:
+                new_shortcuts, engine_counts = compute_shortest_paths_planned(
+                    dirty_shortcuts, current_res, boundary_res=boundary_res
+                )
+                algorithm = ", ".join(f"{e}={c}" for e, c in engine_counts.items())
+            elif use_scipy:
+                new_shortcuts = compute_shortest_paths_scipy(
+                    dirty_shortcuts, boundary_res=boundary_res
+                )
             else:
                 new_shortcuts = compute_shortest_paths_pure_spark(
-                    active_shortcuts, max_iterations=max_iterations
+                    dirty_shortcuts, max_iterations=max_iterations, boundary_res=boundary_res
                 )
             
             new_count = new_shortcuts.count()
             logger.info(f"✓ Generated {new_count} shortcuts using {algorithm}")
             
+            # Merge back (the shuffle counts persisting the result)
+            shuffle_before = shuffle_write_bytes(spark)
+            shortcuts_df, merge_stats = merge_shortcuts_with_stats(shortcuts_df, new_shortcuts, edges_df)
+            shortcuts_df = store.persist(shortcuts_df)
+            merge_stats["shuffle_bytes"] = shuffle_bytes_since(spark, shuffle_before)
+            logger.info(
+                f"✓ Merged: {merge_stats['inserted']} inserted, {merge_stats['improved']} improved "
+                f"({format_bytes(merge_stats['shuffle_bytes'])} shuffled)"
+            )
+            
             resolution_results.append({
                 "phase": "forward",
                 "resolution": current_res,
                 "active": active_count,
                 "generated": new_count,
-                "algorithm": algorithm
+                "algorithm": algorithm,
+                "inserted": merge_stats["inserted"],
+                "improved": merge_stats["improved"],
+                "merge_shuffle_bytes": merge_stats["shuffle_bytes"],
+                "skipped_cells": cell_stats["skipped"]
             })
             
-            # Merge back
-            shortcuts_df = merge_shortcuts(shortcuts_df, new_shortcuts)
-            shortcuts_df = shortcuts_df.localCheckpoint()
-            
             active_shortcuts.unpersist()
         
         # ================================================================
@@ -373,7 +385,8 @@ def main(
             # Determine which algorithm to use
             use_scipy = current_res in scipy_resolutions
             algorithm = "Scipy" if use_scipy else "Pure Spark"
-            logger.info(f"Using {algorithm} algorithm for resolution {current_res}")
+            if not size_aware:
+                logger.info(f"Using {algorithm} algorithm for resolution {current_res}")
             
             # Assign cells using two-cell approach
             logger.info(f"Assigning cells for resolution {current_res}...")
@@ -390,29 +403,51 @@ def main(
             
             active_shortcuts = active_shortcuts.cache()
             
+            # Skip cells whose input is unchanged since they were last processed
+            dirty_shortcuts, cell_stats = cell_tracker.filter_dirty(
+                active_shortcuts, current_res, boundary=False
+            )
+            if cell_stats["skipped"]:
+                logger.info(f"✓ Skipping {cell_stats['skipped']} of {cell_stats['cells']} unchanged cells")
+            
             # Compute shortest paths with selected algorithm
-            if use_scipy:
-                new_shortcuts = compute_shortest_paths_scipy(active_shortcuts)
+            if size_aware:
+                new_shortcuts, engine_counts = compute_shortest_paths_planned(
+                    dirty_shortcuts, current_res
+                )
+                algorithm = ", ".join(f"{e}={c}" for e, c in engine_counts.items())
+            elif use_scipy:
+                new_shortcuts = compute_shortest_paths_scipy(dirty_shortcuts)
             else:
                 new_shortcuts = compute_shortest_paths_pure_spark(
-                    active_shortcuts, max_iterations=max_iterations
+                    dirty_shortcuts, max_iterations=max_iterations
                 )
             
             new_count = new_shortcuts.count()
             logger.info(f"✓ Generated {new_count} shortcuts using {algorithm}")
             
+            # Merge back (the shuffle counts persisting the result)
+            shuffle_before = shuffle_write_bytes(spark)
+            shortcuts_df, merge_stats = merge_shortcuts_with_stats(shortcuts_df, new_shortcuts, edges_df)
+            shortcuts_df = store.persist(shortcuts_df)
+            merge_stats["shuffle_bytes"] = shuffle_bytes_since(spark, shuffle_before)
+            logger.info(
+                f"✓ Merged: {merge_stats['inserted']} inserted, {merge_stats['improved']} improved "
+                f"({format_bytes(merge_stats['shuffle_bytes'])} shuffled)"
+            )
+            
             resolution_results.append({
                 "phase": "backward",
                 "resolution": current_res,
                 "active": active_count,
                 "generated": new_count,
-                "algorithm": algorithm
+                "algorithm": algorithm,
+                "inserted": merge_stats["inserted"],
+                "improved": merge_stats["improved"],
+                "merge_shuffle_bytes": merge_stats["shuffle_bytes"],
+                "skipped_cells": cell_stats["skipped"]
             })
             
-            # Merge back
-            shortcuts_df = merge_shortcuts(shortcuts_df, new_shortcuts)
-            shortcuts_df = shortcuts_df.localCheckpoint()
-            
             active_shortcuts.unpersist()
         
         # ================================================================
@@ -436,7 +471,7 @@ def main(
         # ================================================================
         log_section(logger, "SUMMARY")
         for r in resolution_results:
-            logger.info(f"  {r['phase']:8s} res={r['resolution']:2d}: {r['active']} active → {r['generated']} generated ({r['algorithm']})")
+            logger.info(f"  {r['phase']:8s} res={r['resolution']:2d}: {r['active']} active → {r['generated']} generated, {r['inserted']} inserted, {r['improved']} improved, {r['skipped_cells']} cells skipped ({r['algorithm']})")
         logger.info(f"\n✓ Total shortcuts: {final_count}")
         
     except Exception as e:
@@ -445,6 +480,8 @@ def main(
     
     finally:
         if spark:
+            if store:
+                store.cleanup()
             logger.info("Shutting down Spark...")
             spark.stop()
             logger.info("✓ Spark session closed")
@@ -453,5 +490,5 @@ def main(
 
 
 if __name__ == "__main__":
-    # Default: Scipy for -1 to 11, Pure Spark for 12-15
+    # Default: kernel chosen per cell from its size (dense / Scipy / distributed)
     main(max_iterations=100)
@@ -0,0 +1,281 @@
+"""
+generate_shortcuts_spark_profiles.py
+====================================
+
+Shortcuts generation for several cost profiles in one run (Spark + Scipy).
+
+The shortcuts table carries one cost_<profile> / via_<profile> column pair
+per profile of config.COST_PROFILES (e.g. car_day, car_night, truck). Cell
+assignment, the shuffle into cells and the merge join are done once per
+resolution for all profiles; only the per-cell kernels run once per profile,
+on a shared cell graph. One output is written per profile.
+
+Algorithm (as generate_shortcuts_spark_scipy.py):
+1. Forward pass (resolution 15 → -1): Build LOCAL shortcuts within cells
+2. Backward pass (resolution 0 → 15): Build GLOBAL shortcuts with two-cell approach
+
+A key reachable in only some profiles carries cost inf in the others; each
+profile's output keeps only its finite rows, which gives the same rows as a
+single-profile run with that profile's costs.
+"""
+
+import pandas as pd
+
+from pyspark.sql import DataFrame
+from pyspark.sql import functions as F
+from pyspark.sql.types import StructType, StructField, IntegerType, DoubleType
+
+from logging_config import get_logger, log_section, log_dict
+from shortest_path_kernels import profile_columns, profile_shortest_paths
+from utilities import (
+    initialize_spark,
+    read_edges,
+    add_shortcut_geometry,
+    update_profile_costs_for_edges,
+    initial_profile_shortcuts_table,
+    assign_cell_forward,
+    assign_cell_backward,
+    filter_active_shortcuts,
+    merge_profile_shortcuts_with_stats,
+    partition_by_key,
+    ShortcutsTableStore,
+    DirtyCellTracker,
+    add_final_info,
+    shuffle_write_bytes,
+    shuffle_bytes_since,
+    format_bytes
+)
+import config
+
+logger = get_logger(__name__)
+
+
+# ============================================================================
+# MULTI-PROFILE SHORTEST PATH COMPUTATION
+# ============================================================================
+
+def compute_profile_shortest_paths(
+    df_shortcuts: DataFrame,
+    profiles: list,
+    chunk_entries: int = config.SCIPY_CHUNK_ENTRIES,
+    boundary_res: int = None,
+    dense_max_nodes: int = config.DENSE_MAX_NODES
+) -> DataFrame:
+    """
+    Compute all-pairs shortest paths of every profile per cell partition.
+
+    One applyInPandas over current_cell ships each cell once with all
+    profile columns; the kernel builds the cell graph once and runs the
+    size-dispatched kernel (dense or sparse) for each profile.
+    """
+    cost_columns, via_columns = profile_columns(profiles)
+
+    output_schema = StructType(
+        [StructField("from_edge", IntegerType(), False), StructField("to_edge", IntegerType(), False)]
+        + [StructField(c, DoubleType(), False) for c in cost_columns]
+        + [StructField(v, IntegerType(), False) for v in via_columns]
+    )
+
+    def process_partition_profiles(pdf: pd.DataFrame) -> pd.DataFrame:
+        """Process a single partition for all profiles."""
+        return profile_shortest_paths(
+            pdf, profiles, dense_max_nodes, chunk_entries=chunk_entries, boundary_res=boundary_res
+        )
+
+    kernel_columns = ["from_edge", "to_edge", *cost_columns, *via_columns]
+    if boundary_res is not None:
+        kernel_columns += ["lca_in", "lca_out"]
+
+    return df_shortcuts.select(*kernel_columns, "current_cell").groupBy("current_cell").applyInPandas(
+        process_partition_profiles,
+        schema=output_schema
+    )
+
+
+# ============================================================================
+# MAIN EXECUTION
+# ============================================================================
+
+def process_resolution(
+    shortcuts_df: DataFrame,
+    edges_df: DataFrame,
+    phase: str,
+    current_res: int,
+    profiles: list,
+    store: ShortcutsTableStore,
+    cell_tracker: DirtyCellTracker,
+    boundary_res: int = None
+) -> tuple:
+    """
+    Assign cells, compute all profiles and merge for one resolution.
+
+    Returns:
+        (shortcuts_df, result dict or None if no shortcut is active)
+    """
+    logger.info(f"Assigning cells for resolution {current_res}...")
+    if phase == "forward":
+        shortcuts_with_cell = assign_cell_forward(shortcuts_df, edges_df, current_res)
+    else:
+        shortcuts_with_cell = assign_cell_backward(shortcuts_df, edges_df, current_res)
+
+    active_shortcuts = filter_active_shortcuts(shortcuts_with_cell)
+    active_count = active_shortcuts.count()
+    logger.info(f"✓ {active_count} active shortcuts at resolution {current_res}")
+
+    if active_count == 0:
+        logger.info("No active shortcuts, skipping...")
+        return shortcuts_df, None
+
+    active_shortcuts = active_shortcuts.cache()
+
+    # Skip cells whose input is unchanged since they were last processed
+    dirty_shortcuts, cell_stats = cell_tracker.filter_dirty(
+        active_shortcuts, current_res, boundary=boundary_res is not None
+    )
+    if cell_stats["skipped"]:
+        logger.info(f"✓ Skipping {cell_stats['skipped']} of {cell_stats['cells']} unchanged cells")
+
+    new_shortcuts = compute_profile_shortest_paths(dirty_shortcuts, profiles, boundary_res=boundary_res)
+    new_count = new_shortcuts.count()
+    logger.info(f"✓ Generated {new_count} shortcuts for {len(profiles)} profiles")
+
+    # Merge back (the shuffle counts persisting the result)
+    spark = shortcuts_df.sparkSession
+    shuffle_before = shuffle_write_bytes(spark)
+    shortcuts_df, merge_stats = merge_profile_shortcuts_with_stats(shortcuts_df, new_shortcuts, profiles, edges_df)
+    shortcuts_df = store.persist(shortcuts_df)
+    merge_stats["shuffle_bytes"] = shuffle_bytes_since(spark, shuffle_before)
+    logger.info(
+        f"✓ Merged: {merge_stats['inserted']} inserted, {merge_stats['improved']} improved "
+        f"({format_bytes(merge_stats['shuffle_bytes'])} shuffled)"
+    )
+
+    active_shortcuts.unpersist()
+
+    return shortcuts_df, {
+        "phase": phase,
+        "resolution": current_res,
+        "active": active_count,
+        "generated": new_count,
+        "inserted": merge_stats["inserted"],
+        "improved": merge_stats["improved"],
+        "merge_shuffle_bytes": merge_stats["shuffle_bytes"],
+        "skipped_cells": cell_stats["skipped"]
+    }
+
+
+def main(boundary_only: bool = config.BOUNDARY_ONLY, profiles: dict = None):
+    """
+    Main execution function.
+
+    Args:
+        boundary_only: Forward pass emits only pairs between boundary edges of each cell
+        profiles: {name: {"speed_factor", "max_speed"}} (default: config.COST_PROFILES)
+    """
+    profiles = profiles or config.COST_PROFILES
+    profile_names = list(profiles)
+    cost_columns, via_columns = profile_columns(profile_names)
+
+    log_section(logger, "SHORTCUTS GENERATION - MULTI-PROFILE VERSION")
+
+    config_info = {
+        "edges_file": str(config.EDGES_FILE),
+        "graph_file": str(config.GRAPH_FILE),
+        "output_file": str(config.SHORTCUTS_OUTPUT_FILE),
+        "district": config.DISTRICT_NAME,
+        "boundary_only": boundary_only,
+        "profiles": ", ".join(profile_names)
+    }
+    log_dict(logger, config_info, "Configuration")
+
+    spark = None
+    store = None
+
+    try:
+        logger.info("Initializing Spark session...")
+        spark = initialize_spark()
+        store = ShortcutsTableStore(spark, config.SHORTCUTS_LAYOUT, config.NUM_BUCKETS)
+        cell_tracker = DirtyCellTracker(enabled=config.SKIP_CLEAN_CELLS, value_columns=via_columns + cost_columns)
+        logger.info(f"✓ Spark session initialized (layout: {config.SHORTCUTS_LAYOUT})")
+
+        logger.info("Loading edge data...")
+        edges_df = store.persist_edges(read_edges(spark, str(config.EDGES_FILE)))
+        logger.info(f"✓ Loaded {edges_df.count()} edges")
+
+        logger.info("Computing edge costs per profile...")
+        edges_cost_df = update_profile_costs_for_edges(spark, str(config.EDGES_FILE), edges_df, profiles)
+
+        logger.info("Creating initial shortcuts table...")
+        shortcuts_df = initial_profile_shortcuts_table(spark, str(config.GRAPH_FILE), edges_cost_df, profile_names)
+        shortcuts_df = store.persist(partition_by_key(add_shortcut_geometry(shortcuts_df, edges_df)))
+        logger.info(f"✓ Created {shortcuts_df.count()} initial shortcuts")
+
+        resolution_results = []
+
+        log_section(logger, "PHASE 1: FORWARD PASS (15 → -1)")
+        for current_res in range(15, -2, -1):
+            log_section(logger, f"Forward: Resolution {current_res}")
+            boundary_res = current_res if boundary_only and current_res >= 0 else None
+            shortcuts_df, result = process_resolution(
+                shortcuts_df, edges_df, "forward", current_res, profile_names, store, cell_tracker, boundary_res
+            )
+            if result:
+                resolution_results.append(result)
+
+        log_section(logger, "PHASE 2: BACKWARD PASS (0 → 15)")
+        for current_res in range(0, 16):
+            log_section(logger, f"Backward: Resolution {current_res}")
+            shortcuts_df, result = process_resolution(
+                shortcuts_df, edges_df, "backward", current_res, profile_names, store, cell_tracker
+            )
+            if result:
+                resolution_results.append(result)
+
+        # ================================================================
+        # SAVE OUTPUT (ONE PER PROFILE)
+        # ================================================================
+        log_section(logger, "SAVING OUTPUT")
+
+        logger.info("Adding final info (cell, inside)...")
+        final_df = add_final_info(shortcuts_df, edges_df).cache()
+
+        output_counts = {}
+        for name, cost_column, via_column in zip(profile_names, cost_columns, via_columns):
+            output_path = str(config.SHORTCUTS_OUTPUT_FILE).replace("_shortcuts", f"_spark_profiles_{name}")
+            profile_df = final_df.filter(F.col(cost_column) < float("inf")).select(
+                "from_edge", "to_edge",
+                F.col(cost_column).alias("cost"),
+                F.col(via_column).alias("via_edge"),
+                "inside", "cell"
+            )
+            logger.info(f"Saving {name} to: {output_path}")
+            profile_df.write.mode("overwrite").parquet(output_path)
+            output_counts[name] = spark.read.parquet(output_path).count()
+        logger.info("✓ Saved successfully!")
+
+        log_section(logger, "SUMMARY")
+        for result in resolution_results:
+            logger.info(f"  {result['phase']:8} res={result['resolution']:2}: "
+                       f"{result['active']} active → {result['generated']} generated, "
+                       f"{result['inserted']} inserted, {result['improved']} improved, "
+                       f"{result['skipped_cells']} cells skipped")
+        for name, count in output_counts.items():
+            logger.info(f"\n✓ {name}: {count} shortcuts")
+
+    except Exception as e:
+        logger.error(f"Fatal error: {str(e)}")
+        raise
+
+    finally:
+        if spark:
+            if store:
+                store.cleanup()
+            logger.info("Shutting down Spark...")
+            spark.stop()
+            logger.info("✓ Spark session closed")
+
+    log_section(logger, "COMPLETED")
+
+
+if __name__ == "__main__":
+    main()
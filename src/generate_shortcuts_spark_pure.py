@@ -8,7 +8,8 @@ Algorithm:
 1. Forward pass (resolution 15 → -1): Build LOCAL shortcuts within cells
 2. Backward pass (resolution 0 → 15): Build GLOBAL shortcuts with two-cell approach
 
-Uses self-joins and window functions instead of Scipy for shortest path computation.
+Uses semi-naive (delta-driven) joins and window functions instead of Scipy
+for shortest path computation.
 """
 
 from pyspark.sql import DataFrame
@@ -20,12 +21,19 @@ from utilities import (
     initialize_spark,
     read_edges,
     initial_shortcuts_table,
+    add_shortcut_geometry,
     update_dummy_costs_for_edges,
     assign_cell_forward,
     assign_cell_backward,
     filter_active_shortcuts,
-    merge_shortcuts,
-    add_final_info
+    merge_shortcuts_with_stats,
+    partition_by_key,
+    ShortcutsTableStore,
+    DirtyCellTracker,
+    add_final_info,
+    shuffle_write_bytes,
+    shuffle_bytes_since,
+    format_bytes
 )
 import config
 
@@ -36,140 +44,177 @@ logger = get_logger(__name__)
 # PURE SPARK SHORTEST PATH COMPUTATION
 # ============================================================================
 
-def has_converged(current_paths: DataFrame, next_paths: DataFrame) -> bool:
-    """
-    Check if the shortest path computation has converged.
+PATH_KEYS = ["from_edge", "to_edge", "current_cell"]
+
+
+def best_paths(paths: DataFrame) -> DataFrame:
+    """Keep the cheapest path per (from_edge, to_edge, current_cell); ties by via_edge."""
+    window_spec = Window.partitionBy(*PATH_KEYS).orderBy(
+        F.col("cost").asc(),
+        F.col("via_edge").asc()
+    )
     
-    Convergence occurs when no new paths or path improvements are found.
+    return paths.withColumn(
+        "rnk",
+        F.row_number().over(window_spec)
+    ).filter(
+        F.col("rnk") == 1
+    ).drop("rnk")
+
+
+def extend_paths(left: DataFrame, right: DataFrame, lca_columns: list = []) -> DataFrame:
     """
-    join_keys = ["from_edge", "to_edge", "cost", "current_cell"]
+    Concatenate paths of left with paths of right inside the same cell.
     
-    # Find rows in next_paths that don't exist in current_paths
-    changes = next_paths.join(
-        current_paths.select(join_keys),
-        on=join_keys,
-        how="left_anti"
+    via_edge of the result is the junction edge (left.to_edge); with
+    lca_columns, lca_in comes from left and lca_out from right.
+    """
+    return left.alias("L").join(
+        right.alias("R"),
+        [
+            F.col("L.to_edge") == F.col("R.from_edge"),
+            F.col("L.current_cell") == F.col("R.current_cell")
+        ],
+        "inner"
+    ).filter(
+        (F.col("L.from_edge") != F.col("R.to_edge"))
+    ).select(
+        F.col("L.from_edge").alias("from_edge"),
+        F.col("R.to_edge").alias("to_edge"),
+        (F.col("L.cost") + F.col("R.cost")).alias("cost"),
+        F.col("L.to_edge").alias("via_edge"),
+        F.col("L.current_cell").alias("current_cell"),
+        *([F.col("L.lca_in").alias("lca_in"), F.col("R.lca_out").alias("lca_out")]
+          if lca_columns else [])
     )
-    
-    # True if no changes found (converged)
-    return changes.limit(1).count() == 0
 
 
 def compute_shortest_paths_pure_spark(
     shortcuts_df: DataFrame,
-    max_iterations: int = 10
-) -> DataFrame:
+    max_iterations: int = 10,
+    boundary_res: int = None,
+    mode: str = config.PURE_SPARK_MODE,
+    return_stats: bool = False
+):
     """
     Compute all-pairs shortest paths using pure Spark SQL operations.
     
-    Uses self-joins and window functions to iteratively extend paths until
-    convergence (no new paths and no cost improvements).
+    Semi-naive evaluation: each iteration only extends the paths that were
+    new or improved in the previous iteration (delta). Candidates that beat
+    the current cost form the next delta; the loop ends when the delta is
+    empty.
+    
+    - doubling: delta is joined with the whole closure in both directions
+      (delta + paths, paths + delta), so path length doubles per round and
+      convergence takes O(log diameter) rounds
+    - linear: delta is extended by one input shortcut per round
+      (O(diameter) rounds, smaller joins)
     
     Args:
         shortcuts_df: Input shortcuts DataFrame with current_cell column
         max_iterations: Maximum iterations before stopping
+        boundary_res: Cell resolution for boundary-only emission (None = all pairs)
+        mode: "doubling" or "linear"
+        return_stats: Also return {"mode", "rounds", "shuffle_bytes"}
     
     Returns:
-        DataFrame with computed shortest paths
+        DataFrame with computed shortest paths (and the stats dict if requested)
     """
+    if mode not in ("doubling", "linear"):
+        raise ValueError(f"Unknown pure Spark mode: {mode}")
+    
+    logger.info(f"Starting pure Spark shortest path computation (mode={mode}, max_iterations={max_iterations})")
     
-    logger.info(f"Starting pure Spark shortest path computation (max_iterations={max_iterations})")
+    spark = shortcuts_df.sparkSession
+    shuffle_before = shuffle_write_bytes(spark)
     
     # Initialize
-    current_paths = shortcuts_df.select(
-        "from_edge", "to_edge", "cost", "via_edge", "current_cell"
-    ).cache()
+    # Boundary mode carries the edge lca columns to filter the emitted pairs
+    lca_columns = ["lca_in", "lca_out"] if boundary_res is not None else []
     
-    # Get initial stats
-    stats = current_paths.agg(
-        F.count("*").alias("count"),
-        F.sum("cost").alias("cost_sum")
-    ).collect()[0]
-    prev_count = stats["count"]
-    prev_cost_sum = stats["cost_sum"] if stats["cost_sum"] is not None else 0.0
+    current_paths = best_paths(shortcuts_df.select(
+        "from_edge", "to_edge", "cost", "via_edge", "current_cell", *lca_columns
+    )).localCheckpoint()
     
-    logger.info(f"Initial: {prev_count} paths, CostSum: {prev_cost_sum:.4f}")
+    # Every initial path counts as new; linear mode extends by these paths
+    base_paths = current_paths
+    delta = current_paths
+    delta_count = current_paths.count()
     
+    logger.info(f"Initial: {delta_count} paths")
+    
+    rounds = 0
     for iteration in range(max_iterations):
         try:
-            # --- PATH EXTENSION via self-join ---
-            new_paths = current_paths.alias("L").join(
-                current_paths.alias("R"),
-                [
-                    F.col("L.to_edge") == F.col("R.from_edge"),
-                    F.col("L.current_cell") == F.col("R.current_cell")
-                ],
-                "inner"
-            ).filter(
-                (F.col("L.from_edge") != F.col("R.to_edge"))
-            ).select(
-                F.col("L.from_edge").alias("from_edge"),
-                F.col("R.to_edge").alias("to_edge"),
-                (F.col("L.cost") + F.col("R.cost")).alias("cost"),
-                F.col("L.to_edge").alias("via_edge"),
-                F.col("L.current_cell").alias("current_cell")
-            ).cache()
+            rounds += 1
             
-            # --- COST MINIMIZATION using window function ---
-            all_paths = current_paths.unionByName(new_paths)
+            # --- PATH EXTENSION: only paths changed in the last iteration ---
+            if mode == "doubling":
+                extended = extend_paths(delta, current_paths, lca_columns).unionByName(
+                    extend_paths(current_paths, delta, lca_columns)
+                )
+            else:
+                extended = extend_paths(delta, base_paths, lca_columns)
+            candidates = best_paths(extended)
             
-            window_spec = Window.partitionBy(
-                "from_edge",
-                "to_edge",
-                "current_cell"
-            ).orderBy(
-                F.col("cost").asc(),
-                F.col("via_edge").asc()
+            # --- DELTA: candidates that are new or cheaper than the current path ---
+            current_costs = current_paths.select(
+                *PATH_KEYS, F.col("cost").alias("current_cost")
             )
-            
-            next_paths = all_paths.withColumn(
-                "rnk",
-                F.row_number().over(window_spec)
+            next_delta = candidates.join(
+                current_costs, on=PATH_KEYS, how="left"
             ).filter(
-                F.col("rnk") == 1
-            ).drop("rnk").localCheckpoint()
-            
-            # --- GET STATS FOR CONVERGENCE CHECK ---
-            stats = next_paths.agg(
-                F.count("*").alias("count"),
-                F.sum("cost").alias("cost_sum")
-            ).collect()[0]
-            curr_count = stats["count"]
-            curr_cost_sum = stats["cost_sum"] if stats["cost_sum"] is not None else 0.0
-            
-            cost_diff = prev_cost_sum - curr_cost_sum  # Positive = improvement
-            
-            logger.info(f"Iteration {iteration}: Rows {prev_count} -> {curr_count}, CostSum {prev_cost_sum:.4f} -> {curr_cost_sum:.4f} (diff: {cost_diff:.4f})")
+                F.col("current_cost").isNull() | (F.col("cost") < F.col("current_cost"))
+            ).drop("current_cost").localCheckpoint()
             
-            # Clean up
-            current_paths.unpersist()
-            new_paths.unpersist()
+            delta_count = next_delta.count()
+            logger.info(f"Iteration {iteration}: {delta_count} new or improved paths")
             
-            # --- CONVERGENCE CHECK: Same count AND no cost improvement ---
-            if curr_count == prev_count and abs(cost_diff) < 1e-6:
+            # --- CONVERGENCE CHECK: empty delta ---
+            if delta_count == 0:
                 logger.info("Converged.")
-                current_paths = next_paths
                 break
             
-            current_paths = next_paths
-            prev_count = curr_count
-            prev_cost_sum = curr_cost_sum
+            # --- UPDATE: replace improved paths and add new ones ---
+            current_paths = current_paths.join(
+                next_delta.select(*PATH_KEYS), on=PATH_KEYS, how="left_anti"
+            ).unionByName(next_delta).localCheckpoint()
+            delta = next_delta
             
         except Exception as e:
             logger.error(f"Error in iteration {iteration}: {str(e)}")
             raise
     
-    logger.info(f"Shortest path computation completed after {iteration + 1} iterations")
+    shuffle_bytes = shuffle_bytes_since(spark, shuffle_before)
+    stats = {"mode": mode, "rounds": rounds, "shuffle_bytes": shuffle_bytes}
+    
+    logger.info(
+        f"Shortest path computation completed after {rounds} rounds "
+        f"(mode={mode}, shuffle written: {format_bytes(shuffle_bytes)})"
+    )
+    
+    # Boundary mode: emit only pairs between edges crossing the cell boundary
+    if boundary_res is not None:
+        current_paths = current_paths.filter(
+            (F.col("lca_in") < boundary_res) & (F.col("lca_out") < boundary_res)
+        ).drop(*lca_columns)
     
     # Remove cell column and return result
-    return current_paths.drop("current_cell")
+    result = current_paths.drop("current_cell")
+    if return_stats:
+        return result, stats
+    return result
 
 
 # ============================================================================
 # MAIN EXECUTION
 # ============================================================================
 
-def main(max_iterations: int = 10):
+def main(
+    max_iterations: int = 10,
+    boundary_only: bool = config.BOUNDARY_ONLY,
+    mode: str = config.PURE_SPARK_MODE
+):
     """Main execution function for pure Spark version."""
     log_section(logger, "SHORTCUTS GENERATION - PURE SPARK VERSION")
     
@@ -178,21 +223,26 @@ def main(max_iterations: int = 10):
         "graph_file": str(config.GRAPH_FILE),
         "output_file": str(config.SHORTCUTS_OUTPUT_FILE),
         "district": config.DISTRICT_NAME,
-        "max_iterations": max_iterations
+        "max_iterations": max_iterations,
+        "boundary_only": boundary_only,
+        "mode": mode
     }
     log_dict(logger, config_info, "Configuration")
     
     spark = None
+    store = None
     
     try:
         # Initialize
         logger.info("Initializing Spark session...")
         spark = initialize_spark()
-        logger.info("✓ Spark session initialized")
+        store = ShortcutsTableStore(spark, config.SHORTCUTS_LAYOUT, config.NUM_BUCKETS)
+        cell_tracker = DirtyCellTracker(enabled=config.SKIP_CLEAN_CELLS)
+        logger.info(f"✓ Spark session initialized (layout: {config.SHORTCUTS_LAYOUT})")
         
         # Load data
         logger.info("Loading edge data...")
-        edges_df = read_edges(spark, str(config.EDGES_FILE)).cache()
+        edges_df = store.persist_edges(read_edges(spark, str(config.EDGES_FILE)))
         edges_count = edges_df.count()
         logger.info(f"✓ Loaded {edges_count} edges")
         
@@ -202,6 +252,10 @@ def main(max_iterations: int = 10):
         
         logger.info("Creating initial shortcuts table...")
         shortcuts_df = initial_shortcuts_table(spark, str(config.GRAPH_FILE), edges_cost_df)
+        
+        # Inner/outer cell geometry is computed once and carried on the table,
+        # which stays partitioned by from_edge for the incremental merges
+        shortcuts_df = store.persist(partition_by_key(add_shortcut_geometry(shortcuts_df, edges_df)))
         shortcuts_count = shortcuts_df.count()
         logger.info(f"✓ Created {shortcuts_count} initial shortcuts")
         
@@ -231,25 +285,48 @@ def main(max_iterations: int = 10):
             # Cache for computation
             active_shortcuts = active_shortcuts.cache()
             
-            # Compute shortest paths using pure Spark
-            new_shortcuts = compute_shortest_paths_pure_spark(
-                active_shortcuts, 
-                max_iterations=max_iterations
+            # Skip cells whose input is unchanged since they were last processed
+            dirty_shortcuts, cell_stats = cell_tracker.filter_dirty(
+                active_shortcuts, current_res, boundary=boundary_only and current_res >= 0
+            )
+            if cell_stats["skipped"]:
+                logger.info(f"✓ Skipping {cell_stats['skipped']} of {cell_stats['cells']} unchanged cells")
+            
+            # Compute shortest paths using pure Spark (boundary pairs only, except at the root)
+            boundary_res = current_res if boundary_only and current_res >= 0 else None
+            new_shortcuts, stats = compute_shortest_paths_pure_spark(
+                dirty_shortcuts, 
+                max_iterations=max_iterations,
+                boundary_res=boundary_res,
+                mode=mode,
+                return_stats=True
             )
             new_count = new_shortcuts.count()
             logger.info(f"✓ Generated {new_count} shortcuts")
             
+            # Merge back (the shuffle counts persisting the result)
+            shuffle_before = shuffle_write_bytes(spark)
+            shortcuts_df, merge_stats = merge_shortcuts_with_stats(shortcuts_df, new_shortcuts, edges_df)
+            shortcuts_df = store.persist(shortcuts_df)
+            merge_stats["shuffle_bytes"] = shuffle_bytes_since(spark, shuffle_before)
+            logger.info(
+                f"✓ Merged: {merge_stats['inserted']} inserted, {merge_stats['improved']} improved "
+                f"({format_bytes(merge_stats['shuffle_bytes'])} shuffled)"
+            )
+            
             resolution_results.append({
                 "phase": "forward",
                 "resolution": current_res,
                 "active": active_count,
-                "generated": new_count
+                "generated": new_count,
+                "rounds": stats["rounds"],
+                "shuffle_bytes": stats["shuffle_bytes"],
+                "inserted": merge_stats["inserted"],
+                "improved": merge_stats["improved"],
+                "merge_shuffle_bytes": merge_stats["shuffle_bytes"],
+                "skipped_cells": cell_stats["skipped"]
             })
             
-            # Merge back
-            shortcuts_df = merge_shortcuts(shortcuts_df, new_shortcuts)
-            shortcuts_df = shortcuts_df.localCheckpoint()
-            
             active_shortcuts.unpersist()
         
         # ================================================================
@@ -275,25 +352,46 @@ def main(max_iterations: int = 10):
             
             active_shortcuts = active_shortcuts.cache()
             
+            # Skip cells whose input is unchanged since they were last processed
+            dirty_shortcuts, cell_stats = cell_tracker.filter_dirty(
+                active_shortcuts, current_res, boundary=False
+            )
+            if cell_stats["skipped"]:
+                logger.info(f"✓ Skipping {cell_stats['skipped']} of {cell_stats['cells']} unchanged cells")
+            
             # Compute shortest paths using pure Spark
-            new_shortcuts = compute_shortest_paths_pure_spark(
-                active_shortcuts,
-                max_iterations=max_iterations
+            new_shortcuts, stats = compute_shortest_paths_pure_spark(
+                dirty_shortcuts,
+                max_iterations=max_iterations,
+                mode=mode,
+                return_stats=True
             )
             new_count = new_shortcuts.count()
             logger.info(f"✓ Generated {new_count} shortcuts")
             
+            # Merge back (the shuffle counts persisting the result)
+            shuffle_before = shuffle_write_bytes(spark)
+            shortcuts_df, merge_stats = merge_shortcuts_with_stats(shortcuts_df, new_shortcuts, edges_df)
+            shortcuts_df = store.persist(shortcuts_df)
+            merge_stats["shuffle_bytes"] = shuffle_bytes_since(spark, shuffle_before)
+            logger.info(
+                f"✓ Merged: {merge_stats['inserted']} inserted, {merge_stats['improved']} improved "
+                f"({format_bytes(merge_stats['shuffle_bytes'])} shuffled)"
+            )
+            
             resolution_results.append({
                 "phase": "backward",
                 "resolution": current_res,
                 "active": active_count,
-                "generated": new_count
+                "generated": new_count,
+                "rounds": stats["rounds"],
+                "shuffle_bytes": stats["shuffle_bytes"],
+                "inserted": merge_stats["inserted"],
+                "improved": merge_stats["improved"],
+                "merge_shuffle_bytes": merge_stats["shuffle_bytes"],
+                "skipped_cells": cell_stats["skipped"]
             })
             
-            # Merge back
-            shortcuts_df = merge_shortcuts(shortcuts_df, new_shortcuts)
-            shortcuts_df = shortcuts_df.localCheckpoint()
-            
             active_shortcuts.unpersist()
         
         # ================================================================
@@ -317,7 +415,15 @@ def main(max_iterations: int = 10):
         # ================================================================
         log_section(logger, "SUMMARY")
         for r in resolution_results:
-            logger.info(f"  {r['phase']:8s} res={r['resolution']:2d}: {r['active']} active → {r['generated']} generated")
+            logger.info(
+                f"  {r['phase']:8s} res={r['resolution']:2d}: {r['active']} active → {r['generated']} generated, "
+                f"{r['inserted']} inserted, {r['improved']} improved, {r['skipped_cells']} cells skipped "
+                f"({r['rounds']} rounds, {format_bytes(r['shuffle_bytes'])} shuffled)"
+            )
+        total_rounds = sum(r["rounds"] for r in resolution_results)
+        shuffle_known = [r["shuffle_bytes"] for r in resolution_results if r["shuffle_bytes"] is not None]
+        total_shuffle = sum(shuffle_known) if shuffle_known else None
+        logger.info(f"  mode={mode}: {total_rounds} rounds, {format_bytes(total_shuffle)} shuffled")
         logger.info(f"\n✓ Total shortcuts: {final_count}")
         
     except Exception as e:
@@ -326,6 +432,8 @@ def main(max_iterations: int = 10):
     
     finally:
         if spark:
+            if store:
+                store.cleanup()
             logger.info("Shutting down Spark...")
             spark.stop()
             logger.info("✓ Spark session closed")
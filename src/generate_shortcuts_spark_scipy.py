@@ -10,25 +10,31 @@ Algorithm:
 """
 
 import pandas as pd
-import numpy as np
-from scipy.sparse import csr_matrix
-from scipy.sparse.csgraph import shortest_path
 
 from pyspark.sql import DataFrame
 from pyspark.sql import functions as F
 from pyspark.sql.types import StructType, StructField, IntegerType, DoubleType
 
 from logging_config import get_logger, log_section, log_dict
+from distributed_apsp import find_oversized_cells, compute_shortest_paths_distributed
+from shortest_path_kernels import sparse_shortest_paths
 from utilities import (
     initialize_spark,
     read_edges,
     initial_shortcuts_table,
+    add_shortcut_geometry,
     update_dummy_costs_for_edges,
     assign_cell_forward,
     assign_cell_backward,
     filter_active_shortcuts,
-    merge_shortcuts,
-    add_final_info
+    merge_shortcuts_with_stats,
+    partition_by_key,
+    ShortcutsTableStore,
+    DirtyCellTracker,
+    add_final_info,
+    shuffle_write_bytes,
+    shuffle_bytes_since,
+    format_bytes
 )
 import config
 
@@ -41,12 +47,19 @@ logger = get_logger(__name__)
 
 def compute_shortest_paths_per_partition(
     df_shortcuts: DataFrame,
-    partition_columns: list = ["current_cell"]
+    partition_columns: list = ["current_cell"],
+    chunk_entries: int = config.SCIPY_CHUNK_ENTRIES,
+    boundary_res: int = None,
+    max_cell_nodes: int = config.SCIPY_MAX_NODES
 ) -> DataFrame:
     """
     Compute all-pairs shortest paths using Scipy per partition.
     
-    Uses Spark's applyInPandas to process each cell partition.
+    Uses Spark's applyInPandas to process each cell partition with a sparse,
+    source-restricted Dijkstra kernel; chunk_entries bounds the distance
+    entries held per Dijkstra call. With boundary_res set, only pairs between
+    edges crossing the cell boundary are emitted. Cells with more than
+    max_cell_nodes edges run on the distributed blocked kernel instead.
     """
     logger.info("Computing shortest paths using Scipy (partition-wise)")
     
@@ -58,94 +71,35 @@ def compute_shortest_paths_per_partition(
     ])
     
     def process_partition_scipy(pdf: pd.DataFrame) -> pd.DataFrame:
-        """Process a single partition using Scipy's shortest_path."""
-        if len(pdf) == 0:
-            return pd.DataFrame(columns=['from_edge', 'to_edge', 'via_edge', 'cost'])
-        
-        # Map nodes to indices
-        nodes = pd.concat([pdf['from_edge'], pdf['to_edge']]).unique()
-        n_nodes = len(nodes)
-        node_to_idx = pd.Series(data=np.arange(n_nodes), index=nodes)
-        
-        # Deduplicate and keep minimum cost
-        pdf_dedup = pdf.loc[
-            pdf.groupby(['from_edge', 'to_edge'])['cost'].idxmin()
-        ]
-        
-        src_indices = pdf_dedup['from_edge'].map(node_to_idx).values
-        dst_indices = pdf_dedup['to_edge'].map(node_to_idx).values
-        costs = pdf_dedup['cost'].values
-        
-        # Store via_edges for direct paths (add 1 to distinguish from 0)
-        via_values = pdf_dedup['via_edge'].values + 1
-        via_matrix = csr_matrix((via_values, (src_indices, dst_indices)), shape=(n_nodes, n_nodes))
-        
-        # Build graph matrix
-        graph = csr_matrix((costs, (src_indices, dst_indices)), shape=(n_nodes, n_nodes))
-        
-        # Compute shortest paths
-        dist_matrix, predecessors = shortest_path(
-            csgraph=graph,
-            method='auto',
-            directed=True,
-            return_predecessors=True
+        """Process a single partition with the sparse Dijkstra kernel."""
+        return sparse_shortest_paths(pdf, chunk_entries=chunk_entries, boundary_res=boundary_res)
+    
+    # Ship only the kernel inputs to the Python workers (geometry stays in the JVM)
+    kernel_columns = ["from_edge", "to_edge", "via_edge", "cost"]
+    if boundary_res is not None:
+        kernel_columns += ["lca_in", "lca_out"]
+    df_shortcuts = df_shortcuts.select(*kernel_columns, *partition_columns)
+    
+    # Cells too large for one worker go to the distributed blocked kernel
+    oversized_cells = []
+    if max_cell_nodes is not None:
+        oversized_cells = find_oversized_cells(df_shortcuts, max_cell_nodes)
+    if oversized_cells:
+        logger.info(f"{len(oversized_cells)} cells exceed {max_cell_nodes} nodes")
+        distributed_result = compute_shortest_paths_distributed(
+            df_shortcuts, oversized_cells,
+            chunk_entries=chunk_entries, boundary_res=boundary_res
         )
-        
-        # Convert back to DataFrame
-        results = []
-        chunk_size = 2000
-        
-        for start_row in range(0, n_nodes, chunk_size):
-            end_row = min(start_row + chunk_size, n_nodes)
-            sub_dist = dist_matrix[start_row:end_row, :]
-            sub_pred = predecessors[start_row:end_row, :]
-            
-            valid_mask = (sub_dist != np.inf)
-            rows, cols = np.where(valid_mask)
-            global_rows = rows + start_row
-            
-            # Filter self-loops
-            non_loop_mask = (global_rows != cols)
-            rows = rows[non_loop_mask]
-            cols = cols[non_loop_mask]
-            global_rows = global_rows[non_loop_mask]
-            
-            if len(rows) == 0:
-                continue
-            
-            chunk_costs = sub_dist[rows, cols]
-            chunk_preds = sub_pred[rows, cols]
-            chunk_src = nodes[global_rows]
-            chunk_dst = nodes[cols]
-            
-            # Determine via_edge
-            original_vias = np.array(via_matrix[global_rows, cols]).flatten() - 1
-            is_direct = (chunk_preds == global_rows)
-            
-            final_vias = np.where(
-                is_direct,
-                original_vias,
-                nodes[chunk_preds]
-            )
-            
-            chunk_df = pd.DataFrame({
-                'from_edge': chunk_src,
-                'to_edge': chunk_dst,
-                'via_edge': final_vias,
-                'cost': chunk_costs
-            })
-            results.append(chunk_df)
-        
-        if not results:
-            return pd.DataFrame(columns=['from_edge', 'to_edge', 'via_edge', 'cost'])
-        
-        return pd.concat(results, ignore_index=True)
+        df_shortcuts = df_shortcuts.filter(~F.col("current_cell").isin(oversized_cells))
     
     result = df_shortcuts.groupBy(partition_columns).applyInPandas(
         process_partition_scipy,
         schema=output_schema
     )
     
+    if oversized_cells:
+        result = result.unionByName(distributed_result)
+    
     logger.info("✓ Scipy computation completed")
     return result
 
@@ -154,29 +108,38 @@ def compute_shortest_paths_per_partition(
 # MAIN EXECUTION
 # ============================================================================
 
-def main():
-    """Main execution function."""
+def main(boundary_only: bool = config.BOUNDARY_ONLY):
+    """
+    Main execution function.
+    
+    Args:
+        boundary_only: Forward pass emits only pairs between boundary edges of each cell
+    """
     log_section(logger, "SHORTCUTS GENERATION - SCIPY VERSION")
     
     config_info = {
         "edges_file": str(config.EDGES_FILE),
         "graph_file": str(config.GRAPH_FILE),
         "output_file": str(config.SHORTCUTS_OUTPUT_FILE),
-        "district": config.DISTRICT_NAME
+        "district": config.DISTRICT_NAME,
+        "boundary_only": boundary_only
     }
     log_dict(logger, config_info, "Configuration")
     
     spark = None
+    store = None
     
     try:
         # Initialize
         logger.info("Initializing Spark session...")
         spark = initialize_spark()
-        logger.info("✓ Spark session initialized")
+        store = ShortcutsTableStore(spark, config.SHORTCUTS_LAYOUT, config.NUM_BUCKETS)
+        cell_tracker = DirtyCellTracker(enabled=config.SKIP_CLEAN_CELLS)
+        logger.info(f"✓ Spark session initialized (layout: {config.SHORTCUTS_LAYOUT})")
         
         # Load data
         logger.info("Loading edge data...")
-        edges_df = read_edges(spark, str(config.EDGES_FILE)).cache()
+        edges_df = store.persist_edges(read_edges(spark, str(config.EDGES_FILE)))
         edges_count = edges_df.count()
         logger.info(f"✓ Loaded {edges_count} edges")
         
@@ -186,6 +149,10 @@ def main():
         
         logger.info("Creating initial shortcuts table...")
         shortcuts_df = initial_shortcuts_table(spark, str(config.GRAPH_FILE), edges_cost_df)
+        
+        # Inner/outer cell geometry is computed once and carried on the table,
+        # which stays partitioned by from_edge for the incremental merges
+        shortcuts_df = store.persist(partition_by_key(add_shortcut_geometry(shortcuts_df, edges_df)))
         shortcuts_count = shortcuts_df.count()
         logger.info(f"✓ Created {shortcuts_count} initial shortcuts")
         
@@ -215,22 +182,42 @@ def main():
             # Cache for computation
             active_shortcuts = active_shortcuts.cache()
             
-            # Compute shortest paths
-            new_shortcuts = compute_shortest_paths_per_partition(active_shortcuts)
+            # Skip cells whose input is unchanged since they were last processed
+            dirty_shortcuts, cell_stats = cell_tracker.filter_dirty(
+                active_shortcuts, current_res, boundary=boundary_only and current_res >= 0
+            )
+            if cell_stats["skipped"]:
+                logger.info(f"✓ Skipping {cell_stats['skipped']} of {cell_stats['cells']} unchanged cells")
+            
+            # Compute shortest paths (boundary pairs only, except at the root)
+            boundary_res = current_res if boundary_only and current_res >= 0 else None
+            new_shortcuts = compute_shortest_paths_per_partition(
+                dirty_shortcuts, boundary_res=boundary_res
+            )
             new_count = new_shortcuts.count()
             logger.info(f"✓ Generated {new_count} shortcuts")
             
+            # Merge back (the shuffle counts persisting the result)
+            shuffle_before = shuffle_write_bytes(spark)
+            shortcuts_df, merge_stats = merge_shortcuts_with_stats(shortcuts_df, new_shortcuts, edges_df)
+            shortcuts_df = store.persist(shortcuts_df)
+            merge_stats["shuffle_bytes"] = shuffle_bytes_since(spark, shuffle_before)
+            logger.info(
+                f"✓ Merged: {merge_stats['inserted']} inserted, {merge_stats['improved']} improved "
+                f"({format_bytes(merge_stats['shuffle_bytes'])} shuffled)"
+            )
+            
             resolution_results.append({
                 "phase": "forward",
                 "resolution": current_res,
                 "active": active_count,
-                "generated": new_count
+                "generated": new_count,
+                "inserted": merge_stats["inserted"],
+                "improved": merge_stats["improved"],
+                "merge_shuffle_bytes": merge_stats["shuffle_bytes"],
+                "skipped_cells": cell_stats["skipped"]
             })
             
-            # Merge back
-            shortcuts_df = merge_shortcuts(shortcuts_df, new_shortcuts)
-            shortcuts_df = shortcuts_df.localCheckpoint()
-            
             active_shortcuts.unpersist()
         
         # ================================================================
@@ -256,22 +243,39 @@ def main():
             
             active_shortcuts = active_shortcuts.cache()
             
+            # Skip cells whose input is unchanged since they were last processed
+            dirty_shortcuts, cell_stats = cell_tracker.filter_dirty(
+                active_shortcuts, current_res, boundary=False
+            )
+            if cell_stats["skipped"]:
+                logger.info(f"✓ Skipping {cell_stats['skipped']} of {cell_stats['cells']} unchanged cells")
+            
             # Compute shortest paths (now GLOBALLY optimal)
-            new_shortcuts = compute_shortest_paths_per_partition(active_shortcuts)
+            new_shortcuts = compute_shortest_paths_per_partition(dirty_shortcuts)
             new_count = new_shortcuts.count()
             logger.info(f"✓ Generated {new_count} shortcuts")
             
+            # Merge back (the shuffle counts persisting the result)
+            shuffle_before = shuffle_write_bytes(spark)
+            shortcuts_df, merge_stats = merge_shortcuts_with_stats(shortcuts_df, new_shortcuts, edges_df)
+            shortcuts_df = store.persist(shortcuts_df)
+            merge_stats["shuffle_bytes"] = shuffle_bytes_since(spark, shuffle_before)
+            logger.info(
+                f"✓ Merged: {merge_stats['inserted']} inserted, {merge_stats['improved']} improved "
+                f"({format_bytes(merge_stats['shuffle_bytes'])} shuffled)"
+            )
+            
             resolution_results.append({
                 "phase": "backward",
                 "resolution": current_res,
                 "active": active_count,
-                "generated": new_count
+                "generated": new_count,
+                "inserted": merge_stats["inserted"],
+                "improved": merge_stats["improved"],
+                "merge_shuffle_bytes": merge_stats["shuffle_bytes"],
+                "skipped_cells": cell_stats["skipped"]
             })
             
-            # Merge back
-            shortcuts_df = merge_shortcuts(shortcuts_df, new_shortcuts)
-            shortcuts_df = shortcuts_df.localCheckpoint()
-            
             active_shortcuts.unpersist()
         
         # ================================================================
@@ -296,7 +300,9 @@ def main():
         log_section(logger, "SUMMARY")
         for result in resolution_results:
             logger.info(f"  {result['phase']:8} res={result['resolution']:2}: "
-                       f"{result['active']} active → {result['generated']} generated")
+                       f"{result['active']} active → {result['generated']} generated, "
+                       f"{result['inserted']} inserted, {result['improved']} improved, "
+                       f"{result['skipped_cells']} cells skipped")
         
         logger.info(f"\n✓ Total shortcuts: {final_count}")
         
@@ -306,6 +312,8 @@ def main():
     
     finally:
         if spark:
+            if store:
+                store.cleanup()
             logger.info("Shutting down Spark...")
             spark.stop()
             logger.info("✓ Spark session closed")
@@ -0,0 +1,74 @@
+"""
+h3_bitwise.py
+=============
+
+Vectorized H3 index arithmetic on NumPy int64 arrays.
+
+Same semantics as the native Spark expressions in utilities.py
+(h3_resolution, h3_parent, h3_lca_resolution, h3_lca), for engines that
+run without Spark. Cell 0 stands for "no cell" (above resolution 0).
+
+H3 index layout (64 bits, most significant first):
+  1 reserved | 4 mode | 3 reserved | 4 resolution | 7 base cell | 15 x 3 digits
+Digits finer than the cell's resolution are set to 7 (0b111).
+"""
+
+import numpy as np
+
+
+H3_MAX_RES = 15
+H3_RES_OFFSET = 52
+H3_RES_MASK = 0xF << H3_RES_OFFSET
+H3_DIGIT_BITS = 3
+
+# Bits of the digits finer than resolution r (all set to 1 in a parent at r)
+H3_DIGIT_MASKS = [(1 << (H3_DIGIT_BITS * (H3_MAX_RES - r))) - 1 for r in range(H3_MAX_RES + 1)]
+
+_DIGIT_MASKS = np.array(H3_DIGIT_MASKS, dtype=np.int64)
+# Ascending masks (coarse digits last) for searchsorted: index j <-> resolution 15 - j
+_DIGIT_MASKS_ASC = _DIGIT_MASKS[::-1].copy()
+_NOT_RES_MASK = np.int64(~H3_RES_MASK)
+
+
+def h3_resolution(cells: np.ndarray) -> np.ndarray:
+    """Resolution of H3 cells (-1 for cell 0)."""
+    cells = np.asarray(cells, dtype=np.int64)
+    return np.where(cells == 0, -1, (cells >> H3_RES_OFFSET) & 0xF).astype(np.int64)
+
+
+def h3_parent(cells: np.ndarray, target_res) -> np.ndarray:
+    """
+    Parents of H3 cells at target_res (an int or an array aligned with cells).
+
+    0 for cell 0 or target_res < 0, the cell itself when target_res is finer
+    than the cell.
+    """
+    cells = np.asarray(cells, dtype=np.int64)
+    target_res = np.broadcast_to(np.asarray(target_res, dtype=np.int64), cells.shape)
+    clipped = np.maximum(target_res, 0)
+
+    parent = (cells & _NOT_RES_MASK) | (clipped << H3_RES_OFFSET) | _DIGIT_MASKS[clipped]
+
+    return np.where(
+        (cells == 0) | (target_res < 0),
+        0,
+        np.where(target_res > h3_resolution(cells), cells, parent)
+    ).astype(np.int64)
+
+
+def h3_lca_resolution(cells1: np.ndarray, cells2: np.ndarray) -> np.ndarray:
+    """Resolution of the LCA of two arrays of H3 cells (-1 if none)."""
+    cells1 = np.asarray(cells1, dtype=np.int64)
+    cells2 = np.asarray(cells2, dtype=np.int64)
+    diff = (cells1 ^ cells2) & _NOT_RES_MASK
+
+    # Finest resolution r with diff <= mask[r]; -1 when even the base cells differ
+    common_res = H3_MAX_RES - np.searchsorted(_DIGIT_MASKS_ASC, diff, side="left")
+
+    lca_res = np.minimum(np.minimum(h3_resolution(cells1), h3_resolution(cells2)), common_res)
+    return np.where((cells1 == 0) | (cells2 == 0), -1, lca_res).astype(np.int64)
+
+
+def h3_lca(cells1: np.ndarray, cells2: np.ndarray) -> np.ndarray:
+    """LCA cells of two arrays of H3 cells (0 if none)."""
+    return h3_parent(cells1, h3_lca_resolution(cells1, cells2))
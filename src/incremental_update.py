@@ -0,0 +1,181 @@
+"""
+incremental_update.py
+=====================
+
+Apply edge cost changes to an existing NumPy engine output without a full rebuild.
+
+The shortcut topology (which keys exist and which cells they are active in)
+does not depend on costs, so after a cost change both passes are replayed
+on the same cells. The saved rebuild state (see generate_shortcuts_numpy.py,
+NUMPY_SAVE_STATE) holds a signature of every cell's input and the cell's
+kernel output; a cell is recomputed only when its signature differs, which
+happens exactly in the cells reached by the changed costs. Merging in the
+same cell order as a full run gives an identical table, and the output
+Parquet is patched with the changed rows.
+
+Usage:
+    python incremental_update.py changes.csv   # columns: edge_id, cost
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from logging_config import get_logger, log_section, log_dict
+from shared_arrays import SharedArrayStore
+from generate_shortcuts_numpy import (
+    RebuildState, ShortcutTable, create_pool, final_info, initial_shortcuts, load_edges, log_summary,
+    numpy_output_path, publish_edges, run_passes, state_dir_for, write_output
+)
+import config
+
+logger = get_logger(__name__)
+
+
+# ============================================================================
+# 1. COST CHANGES
+# ============================================================================
+
+def load_changes(file_path: str) -> list:
+    """Load (edge_id, new_cost) pairs from a CSV with columns edge_id, cost."""
+    changes = pd.read_csv(file_path, usecols=["edge_id", "cost"])
+    return list(zip(changes["edge_id"].astype(np.int64), changes["cost"].astype(np.float64)))
+
+
+def apply_cost_changes(edges, changes: list) -> int:
+    """Set new costs on the edge table in place; returns the number of edges whose cost changed."""
+    if not changes:
+        return 0
+    edge_ids, new_costs = zip(*changes)
+    positions = edges.index_of(np.array(edge_ids, dtype=np.int64))
+    new_costs = np.array(new_costs, dtype=np.float64)
+
+    changed = int(np.count_nonzero(edges.cost[positions] != new_costs))
+    edges.cost[positions] = new_costs
+    return changed
+
+
+# ============================================================================
+# 2. OUTPUT PATCHING
+# ============================================================================
+
+def patch_output(final_df: pd.DataFrame, output_path: str) -> int:
+    """
+    Replace the output with final_df if it differs and return the number of changed rows.
+
+    Rows are compared by key (from_edge, to_edge); when the existing output
+    has other keys (e.g. it was written by a different run) it is rewritten.
+    """
+    existing = pd.read_parquet(output_path) if os.path.exists(output_path) else None
+
+    if existing is not None and len(existing) == len(final_df):
+        existing = existing.sort_values(["from_edge", "to_edge"], kind="stable").reset_index(drop=True)
+        same_keys = (
+            np.array_equal(existing["from_edge"].values, final_df["from_edge"].values)
+            and np.array_equal(existing["to_edge"].values, final_df["to_edge"].values)
+        )
+        if same_keys:
+            changed = (
+                (existing["cost"].values != final_df["cost"].values)
+                | (existing["via_edge"].values != final_df["via_edge"].values)
+            )
+            n_changed = int(np.count_nonzero(changed))
+            if n_changed > 0:
+                write_output(final_df, output_path)
+            return n_changed
+
+    write_output(final_df, output_path)
+    return len(final_df)
+
+
+# ============================================================================
+# 3. UPDATE ENTRY POINT
+# ============================================================================
+
+def update_costs(changes: list, boundary_only: bool = config.BOUNDARY_ONLY) -> dict:
+    """
+    Apply (edge_id, new_cost) changes and patch the NumPy engine output.
+
+    Costs accumulate across updates: the costs saved with the state are the
+    starting point, not the edges file. Without a usable saved state every
+    cell is computed (a full rebuild) and the state is created.
+
+    Returns:
+        {"changed_edges", "computed_cells", "total_cells", "changed_rows"}
+    """
+    log_section(logger, "INCREMENTAL UPDATE - NUMPY VERSION")
+
+    output_path = numpy_output_path()
+    log_dict(logger, {
+        "edges_file": str(config.EDGES_FILE),
+        "output_file": output_path,
+        "changes": len(changes),
+        "boundary_only": boundary_only
+    }, "Configuration")
+
+    pool = create_pool()
+    store = SharedArrayStore() if pool else None
+    state = RebuildState(state_dir_for(output_path), boundary_only, reuse=True)
+
+    try:
+        edges = load_edges(str(config.EDGES_FILE))
+
+        if state.has_previous:
+            saved_ids, saved_cost = state.edge_costs()
+            if np.array_equal(saved_ids, edges.ids):
+                edges.cost = saved_cost.copy()
+            else:
+                logger.warning("Saved state does not match the edges file, recomputing every cell")
+                state.meta = None
+        else:
+            logger.warning("No saved state found, recomputing every cell")
+
+        changed_edges = apply_cost_changes(edges, changes)
+        logger.info(f"✓ Applied {len(changes)} changes ({changed_edges} edges with a new cost)")
+        if store:
+            publish_edges(store, edges)
+
+        table = ShortcutTable(edges, initial_shortcuts(str(config.GRAPH_FILE), edges))
+        resolution_results = run_passes(table, boundary_only, pool, store, state)
+
+        log_section(logger, "PATCHING OUTPUT")
+        final_df = final_info(table)
+        changed_rows = patch_output(final_df, output_path)
+        logger.info(f"✓ {changed_rows} changed rows written to: {output_path}")
+
+        state.commit(edges)
+        state = None
+
+        log_summary(resolution_results, len(final_df))
+
+    finally:
+        if state:
+            state.discard()
+        if pool:
+            pool.shutdown()
+        if store:
+            store.close()
+
+    stats = {
+        "changed_edges": changed_edges,
+        "computed_cells": sum(r["computed_cells"] for r in resolution_results),
+        "total_cells": sum(r["cells"] for r in resolution_results),
+        "changed_rows": changed_rows
+    }
+    log_dict(logger, stats, "Update")
+    log_section(logger, "COMPLETED")
+    return stats
+
+
+def main(changes_file: str):
+    """Apply the cost changes of a CSV file (edge_id, cost)."""
+    update_costs(load_changes(changes_file))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python incremental_update.py changes.csv")
+        sys.exit(1)
+    main(sys.argv[1])
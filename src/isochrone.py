@@ -0,0 +1,254 @@
+"""
+isochrone.py
+============
+
+One-to-all and isochrone queries over the shortcut hierarchy.
+
+A one-to-all search from edge s runs in two phases:
+1. Up: the forward search of the point-to-point query (upward and lateral
+   shortcuts on s's ancestor chain), bounded by max_cost.
+2. Down: a sweep over the downward shortcuts (inside = -1) in their own
+   direction, in every cell. A downward shortcut always ends on an edge of
+   a strictly finer level (resolution of the edge's LCA cell), so the levels
+   are processed coarse to fine and every edge is final before its own
+   shortcuts are relaxed. Each level keeps a frontier of the edges reached
+   on it so far; processing a level is one vectorized relaxation of the
+   shortcuts leaving its frontier, which feeds the frontiers of finer levels.
+
+Every shortest route is a chain of up/lateral shortcuts followed by down
+shortcuts (see query_engine.py), so the sweep gives each edge its route
+cost. Both phases prune at max_cost and keep distances for reached edges
+only: the up phase stops at max_cost, and the sweep only relaxes shortcuts
+out of frontier edges into edges within max_cost. The work of a query grows
+with the number of edges it reaches and the shortcuts leaving them, not with
+the size of the graph. Costs follow the shortcut convention (the cost of an
+edge is the route cost including the edge itself).
+
+Results are edge IDs with costs, or rolled up to H3 cells at a chosen
+resolution (cell of the edge's to_cell, minimum cost and edge count per cell).
+
+Usage:
+    python isochrone.py [graph_dir] [max_cost ...]   # benchmark against plain Dijkstra
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from logging_config import get_logger, log_section, log_dict
+from h3_bitwise import h3_parent, h3_resolution
+from generate_shortcuts_numpy import load_edges
+from binary_graph import csr_offsets, csr_positions
+from query_engine import EdgeGraphDijkstra, QueryEngine, ShortcutGraph, INF, _latency_stats
+import config
+
+logger = get_logger(__name__)
+
+
+# ============================================================================
+# 1. ONE-TO-ALL SEARCH
+# ============================================================================
+
+def _add_to_frontier(frontier: dict, levels: np.ndarray, nodes: np.ndarray):
+    """Append newly reached nodes to the frontiers of their levels."""
+    if len(nodes) == 0:
+        return
+    node_levels = levels[nodes]
+    for level in (np.flatnonzero(np.bincount(node_levels + 1)) - 1).tolist():
+        frontier.setdefault(level, []).append(nodes[node_levels == level])
+
+
+class IsochroneEngine:
+    """
+    One-to-all and isochrone queries on a ShortcutGraph (one query at a time).
+
+    Args:
+        graph: ShortcutGraph of a shortcuts output
+        edge_to_cell: H3 to_cell of each edge index (needed for roll-ups only)
+    """
+
+    def __init__(self, graph: ShortcutGraph, edge_to_cell: np.ndarray = None):
+        self.graph = graph
+        self.engine = QueryEngine(graph)
+        self.edge_to_cell = edge_to_cell
+
+        # Downward shortcuts as an in-memory CSR by from_edge
+        csr = graph.csr
+        inside = np.asarray(csr.inside)
+        rows = np.flatnonzero(inside == -1)
+        sources = np.repeat(np.arange(graph.n_edges), np.diff(np.asarray(csr.offsets)))[rows]
+        self.down_offsets = csr_offsets(sources, graph.n_edges)
+        self.down_targets = np.asarray(csr.targets)[rows].astype(np.int64)
+        self.down_costs = np.asarray(csr.costs)[rows].astype(np.float64)
+
+        # Edge levels; the sweep needs every downward shortcut to go to a finer level
+        self.levels = h3_resolution(np.asarray(graph.edge_lca_cell)).astype(np.int64)
+        if np.any(self.levels[self.down_targets] <= self.levels[sources]):
+            raise ValueError("Downward shortcuts must end on edges of a finer level")
+        self.level_order = np.unique(self.levels).tolist()
+
+        # Distances of the sweep and a scratch array for deduplication, allocated
+        # once; a query resets the distances of the edges it reached
+        self.dist = np.full(graph.n_edges, INF)
+        self.slot = np.zeros(graph.n_edges, dtype=np.int64)
+
+    @classmethod
+    def load(cls, graph_path: str, edges_file: str = None) -> "IsochroneEngine":
+        """Load a binary graph directory or shortcuts output, with edge cells from the edges file."""
+        graph = ShortcutGraph.load(graph_path, edges_file)
+        edges = load_edges(str(edges_file or config.EDGES_FILE))
+        return cls(graph, edges.to_cell[edges.index_of(np.asarray(graph.edge_ids))])
+
+    def one_to_all(self, from_edge: int, max_cost: float = INF) -> dict:
+        """
+        Every edge reachable from from_edge within max_cost.
+
+        Returns:
+            {"edges" (IDs), "costs" (route costs, ascending),
+             "settled" (up-phase edges plus edges whose shortcuts the sweep relaxed)}
+        """
+        graph = self.graph
+        source = graph.index_of(from_edge)
+
+        # Phase 1: up
+        nodes, dists = self.engine.search_space(source, max_dist=max_cost)
+        settled = len(nodes)
+
+        # Phase 2: down, level by level from the coarsest. frontier[level] holds
+        # the edges first reached on that level, each once
+        dist = self.dist
+        dist[nodes] = dists
+        frontier = {}
+        _add_to_frontier(frontier, self.levels, nodes)
+        reached_nodes = [np.array([], dtype=np.int64)]
+        try:
+            for level in self.level_order:
+                chunks = frontier.pop(level, None)
+                if chunks is None:
+                    continue
+                sources = np.concatenate(chunks)
+                reached_nodes.append(sources)
+
+                positions, counts = csr_positions(self.down_offsets, sources)
+                if len(positions) == 0:
+                    continue
+                settled += len(sources)
+                candidates = np.repeat(dist[sources], counts) + self.down_costs[positions]
+                keep = candidates <= max_cost
+                targets, candidates = self.down_targets[positions[keep]], candidates[keep]
+                fresh = targets[np.isinf(dist[targets])]
+                np.minimum.at(dist, targets, candidates)
+                # Each edge once: keep the occurrence that wrote its slot last
+                self.slot[fresh] = np.arange(len(fresh))
+                fresh = fresh[self.slot[fresh] == np.arange(len(fresh))]
+                _add_to_frontier(frontier, self.levels, fresh)
+
+            reached = np.concatenate(reached_nodes)
+            costs = dist[reached] + np.asarray(graph.edge_cost)[reached]
+        finally:
+            dist[nodes] = INF
+            for chunks in [reached_nodes, *frontier.values()]:
+                for chunk in chunks:
+                    dist[chunk] = INF
+
+        within = costs <= max_cost
+        reached, costs = reached[within], costs[within]
+        order = np.argsort(costs, kind="stable")
+        return {"edges": np.asarray(graph.edge_ids)[reached[order]], "costs": costs[order], "settled": settled}
+
+    def roll_up(self, result: dict, resolution: int) -> dict:
+        """
+        Roll a one_to_all result up to H3 cells at a resolution.
+
+        Returns:
+            {"cells", "costs" (minimum per cell), "edge_counts"}, ordered by cost
+        """
+        if self.edge_to_cell is None:
+            raise ValueError("Edge cells are required for roll-ups (use IsochroneEngine.load)")
+        nodes = self.graph.index_of_many(result["edges"])
+        cells = h3_parent(self.edge_to_cell[nodes], resolution)
+        unique, inverse, counts = np.unique(cells, return_inverse=True, return_counts=True)
+        costs = np.full(len(unique), INF)
+        np.minimum.at(costs, inverse, result["costs"])
+        order = np.argsort(costs, kind="stable")
+        return {"cells": unique[order], "costs": costs[order], "edge_counts": counts[order]}
+
+    def isochrone(self, from_edge: int, max_cost: float, resolution: int = None) -> dict:
+        """Edges within max_cost of from_edge, rolled up to cells when resolution is given."""
+        result = self.one_to_all(from_edge, max_cost)
+        return result if resolution is None else self.roll_up(result, resolution)
+
+
+# ============================================================================
+# 2. BENCHMARK
+# ============================================================================
+
+def benchmark(isochrones: IsochroneEngine, baseline: EdgeGraphDijkstra, max_cost: float,
+              n_queries: int = 20, seed: int = 0) -> dict:
+    """
+    Time isochrones from random edges on both engines and compare the results.
+
+    Returns:
+        {"max_cost", "queries", "mismatches", "mean_edges", "hierarchy": {...},
+         "dijkstra": {...}, "speedup"} with mean/p50/p95 latency (ms) per engine
+    """
+    graph = isochrones.graph
+    rng = np.random.default_rng(seed)
+    sources = np.asarray(graph.edge_ids)[rng.integers(0, graph.n_edges, n_queries)]
+
+    # Arc groups of the up phase are built on first use; build them before timing
+    for from_edge in sources.tolist():
+        isochrones.one_to_all(from_edge, max_cost)
+
+    latencies = {"hierarchy": [], "dijkstra": []}
+    mismatches, sizes = 0, []
+    for from_edge in sources.tolist():
+        start = time.perf_counter()
+        result = isochrones.one_to_all(from_edge, max_cost)
+        latencies["hierarchy"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        expected = baseline.one_to_all(from_edge, max_cost)
+        latencies["dijkstra"].append(time.perf_counter() - start)
+
+        nodes = graph.index_of_many(result["edges"])
+        expected_costs = np.array([expected.get(node, INF) for node in nodes.tolist()])
+        if len(nodes) != len(expected) or not np.allclose(result["costs"], expected_costs):
+            mismatches += 1
+        sizes.append(len(nodes))
+
+    report = {"max_cost": max_cost, "queries": n_queries, "mismatches": mismatches,
+              "mean_edges": float(np.mean(sizes))}
+    for name, values in latencies.items():
+        report[name] = _latency_stats(values)
+    report["speedup"] = report["dijkstra"]["mean_ms"] / max(report["hierarchy"]["mean_ms"], 1e-9)
+    return report
+
+
+# ============================================================================
+# MAIN EXECUTION
+# ============================================================================
+
+def main(graph_path: str = None, max_costs: tuple = (60.0, 300.0, 900.0), n_queries: int = 20):
+    """Benchmark isochrones of several radii against plain Dijkstra on the edge graph."""
+    graph_path = graph_path or str(config.SHORTCUTS_OUTPUT_FILE).replace("_shortcuts", "_spark_hybrid")
+    log_section(logger, "ISOCHRONE BENCHMARK")
+    log_dict(logger, {"graph": graph_path, "max_costs": ", ".join(map(str, max_costs)),
+                      "queries": n_queries}, "Configuration")
+
+    isochrones = IsochroneEngine.load(graph_path)
+    baseline = EdgeGraphDijkstra(str(config.GRAPH_FILE), isochrones.graph)
+
+    for max_cost in max_costs:
+        report = benchmark(isochrones, baseline, max_cost, n_queries)
+        logger.info(f"  max_cost {max_cost:8.1f}: {report['mean_edges']:8.0f} edges, "
+                    f"hierarchy {report['hierarchy']['mean_ms']:.2f} ms, "
+                    f"dijkstra {report['dijkstra']['mean_ms']:.2f} ms, speedup {report['speedup']:.1f}x, "
+                    f"{report['mismatches']} mismatches")
+    log_section(logger, "COMPLETED")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None,
+         tuple(float(cost) for cost in sys.argv[2:]) or (60.0, 300.0, 900.0))
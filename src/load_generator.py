@@ -0,0 +1,140 @@
+"""
+load_generator.py
+=================
+
+Concurrent load against a running routing_service.py.
+
+Each client keeps one HTTP/1.1 connection open and sends its requests back
+to back; client-side latencies give p50/p99 and throughput, and the
+service's own histograms and batch counters are fetched at the end.
+
+Request kinds:
+- route: POST /route between random edges
+- route_unpack: POST /route with unpack = true
+- unpack: POST /unpack of shortcut routes fetched from /route before the run
+- matrix: POST /matrix, 10 x 10 random edges
+
+Usage:
+    python load_generator.py [clients] [requests_per_client] [route|route_unpack|unpack|matrix]
+"""
+
+import asyncio
+import json
+import sys
+import time
+
+import numpy as np
+
+from logging_config import get_logger, log_section, log_dict
+from routing_service import encode_message, read_message
+import config
+
+logger = get_logger(__name__)
+
+
+async def request(reader, writer, method: str, path: str, payload: dict = None) -> tuple:
+    """(status, payload) of one request on an open connection."""
+    writer.write(encode_message(f"{method} {path} HTTP/1.1", payload or {}, {"Host": config.SERVICE_HOST}))
+    await writer.drain()
+    start_line, _, body = await read_message(reader)
+    return int(start_line.split(" ")[1]), json.loads(body)
+
+
+def make_payload(kind: str, edges: list, routes: list, rng: np.random.Generator) -> tuple:
+    """(path, payload) of one random request; unpack requests pick one of routes."""
+    if kind == "matrix":
+        return "/matrix", {"sources": rng.choice(edges, 10).tolist(), "targets": rng.choice(edges, 10).tolist()}
+    if kind == "unpack":
+        return "/unpack", {"route": routes[int(rng.integers(len(routes)))]}
+    pair = rng.choice(edges, 2).tolist()
+    if kind == "route_unpack":
+        return "/route", {"from_edge": pair[0], "to_edge": pair[1], "unpack": True}
+    return "/route", {"from_edge": pair[0], "to_edge": pair[1]}
+
+
+async def fetch_routes(reader, writer, edges: list, n_routes: int, seed: int = 0) -> list:
+    """Non-empty shortcut routes between random edges, for /unpack load."""
+    rng = np.random.default_rng(seed)
+    routes = []
+    for _ in range(n_routes):
+        pair = rng.choice(edges, 2).tolist()
+        status, result = await request(reader, writer, "POST", "/route", {"from_edge": pair[0], "to_edge": pair[1]})
+        if status == 200 and result["route"]:
+            routes.append(result["route"])
+    if not routes:
+        raise RuntimeError("No routes found for /unpack load")
+    return routes
+
+
+async def client(host: str, port: int, kind: str, edges: list, routes: list, n_requests: int, seed: int) -> tuple:
+    """Latencies (s) and error count of one client."""
+    rng = np.random.default_rng(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    latencies, errors = [], 0
+    try:
+        for _ in range(n_requests):
+            path, payload = make_payload(kind, edges, routes, rng)
+            start = time.perf_counter()
+            status, _ = await request(reader, writer, "POST", path, payload)
+            latencies.append(time.perf_counter() - start)
+            errors += status != 200
+    finally:
+        writer.close()
+    return latencies, errors
+
+
+async def run_load(clients: int, n_requests: int, kind: str = "route", n_routes: int = 200,
+                   host: str = config.SERVICE_HOST, port: int = config.SERVICE_PORT) -> dict:
+    """
+    Run clients concurrently and summarize (unpack load draws from n_routes prefetched routes).
+
+    Returns:
+        {"requests", "errors", "seconds", "throughput", "p50_ms", "p99_ms", "server"}
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    _, sample = await request(reader, writer, "GET", "/edges?n=5000")
+    routes = await fetch_routes(reader, writer, sample["edges"], n_routes) if kind == "unpack" else []
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[
+        client(host, port, kind, sample["edges"], routes, n_requests, seed) for seed in range(clients)
+    ])
+    elapsed = time.perf_counter() - start
+
+    _, server_stats = await request(reader, writer, "GET", "/stats")
+    writer.close()
+
+    latencies = np.concatenate([np.array(lat) for lat, _ in results]) * 1e3
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors for _, errors in results),
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "server": server_stats
+    }
+
+
+def main(clients: int = 32, n_requests: int = 50, kind: str = "route"):
+    """Load the service and log client-side percentiles and server batch statistics."""
+    log_section(logger, "ROUTING SERVICE LOAD TEST")
+    log_dict(logger, {"address": f"{config.SERVICE_HOST}:{config.SERVICE_PORT}", "clients": clients,
+                      "requests_per_client": n_requests, "kind": kind}, "Configuration")
+
+    report = asyncio.run(run_load(clients, n_requests, kind))
+    batching = report["server"]["batching"]["unpack" if kind == "unpack" else "route"]
+    log_dict(logger, {
+        "requests": report["requests"],
+        "errors": report["errors"],
+        "throughput_rps": f"{report['throughput']:.1f}",
+        "p50_ms": f"{report['p50_ms']:.2f}",
+        "p99_ms": f"{report['p99_ms']:.2f}",
+        "mean_batch": f"{batching['mean_batch']:.1f}"
+    }, "Results")
+    log_section(logger, "COMPLETED")
+    return report
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]), *sys.argv[3:4])
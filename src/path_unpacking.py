@@ -0,0 +1,382 @@
+"""
+path_unpacking.py
+=================
+
+Expand shortcuts into their full edge sequences.
+
+A shortcut (a, b) with via_edge v is the path a .. v followed by v .. b:
+both (a, v) and (v, b) are shortcuts themselves, and via_edge = to_edge marks
+a direct edge-graph connection a → b. Unpacking follows via_edge
+recursively until every hop is direct.
+
+Key features:
+- ShortcutIndex: compact open-addressing hash (from, to) → via over edge
+  indices (positions in the sorted edge IDs), on two NumPy arrays, with
+  scalar and vectorized lookups; edges are expanded by index and mapped back
+  to IDs per result
+- PathUnpacker.unpack: single shortcut, memoizing every sub-path expansion
+- PathUnpacker.unpack_batch: many shortcuts at once, expanding all pending
+  segments level by level with one vectorized lookup per level
+- PathUnpacker.unpack_route: a QueryEngine route (chain of shortcuts)
+- Per route: the edge list, its cost recomputed from edge costs (equals the
+  shortcut cost) and the number of index lookups the expansion needed
+
+Usage:
+    python path_unpacking.py [shortcuts_dir]   # benchmark on sampled shortcuts
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from logging_config import get_logger, log_section, log_dict
+from generate_shortcuts_numpy import load_edges
+from binary_graph import ShortcutCSR, is_binary_graph
+import config
+
+logger = get_logger(__name__)
+
+EMPTY_KEY = np.iinfo(np.int64).min
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+UINT64_MASK = (1 << 64) - 1
+
+
+# ============================================================================
+# 1. HASH INDEX
+# ============================================================================
+
+def pack_keys(from_index, to_index) -> np.ndarray:
+    """One int64 key per (from, to) pair of edge indices (both below 2^32, so keys are unique)."""
+    from_index = np.asarray(from_index, dtype=np.int64)
+    to_index = np.asarray(to_index, dtype=np.int64)
+    return (from_index << 32) | to_index
+
+
+class ShortcutIndex:
+    """
+    Open-addressing hash table (linear probing) from (from, to) to via, over edge indices.
+
+    Attributes:
+        keys: Packed keys per slot (EMPTY_KEY for free slots)
+        vias: Edge index of via_edge per slot
+        shift: 64 - log2(number of slots)
+
+    Two flat arrays at load factor <= 0.5: about 24 bytes per shortcut.
+    """
+
+    def __init__(self, from_index, to_index, via_index):
+        if len(from_index) and max(np.max(from_index), np.max(to_index), np.max(via_index)) > np.iinfo(np.int32).max:
+            raise ValueError("ShortcutIndex takes edge indices below 2^31, not edge IDs")
+        packed = pack_keys(from_index, to_index)
+        bits = max(int(np.ceil(np.log2(max(len(packed), 1) * 2))), 4)
+        self.shift = 64 - bits
+        self.mask = (1 << bits) - 1
+        self.keys = np.full(1 << bits, EMPTY_KEY, dtype=np.int64)
+        self.vias = np.full(1 << bits, -1, dtype=np.int32)
+        self._insert(packed, np.asarray(via_index, dtype=np.int32))
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self.keys != EMPTY_KEY))
+
+    def _slots(self, packed: np.ndarray) -> np.ndarray:
+        """Home slots of packed keys (multiplicative hashing, top bits)."""
+        hashed = packed.astype(np.uint64) * np.uint64(HASH_MULTIPLIER)
+        return (hashed >> np.uint64(self.shift)).astype(np.int64)
+
+    def _insert(self, packed: np.ndarray, vias: np.ndarray):
+        """Insert keys in rounds: one winner per free slot, the rest probe the next slot."""
+        slots = self._slots(packed)
+        while len(packed):
+            free = self.keys[slots] == EMPTY_KEY
+            _, first = np.unique(slots[free], return_index=True)
+            winners = np.flatnonzero(free)[first]
+            self.keys[slots[winners]] = packed[winners]
+            self.vias[slots[winners]] = vias[winners]
+
+            pending = np.ones(len(packed), dtype=bool)
+            pending[winners] = False
+            packed, vias = packed[pending], vias[pending]
+            slots = (slots[pending] + 1) & self.mask
+
+    def lookup(self, from_index: int, to_index: int) -> int:
+        """Via index of one shortcut (-1 if the key is absent)."""
+        key = (int(from_index) << 32) | int(to_index)
+        slot = ((key * HASH_MULTIPLIER) & UINT64_MASK) >> self.shift
+        keys = self.keys
+        while True:
+            stored = keys[slot]
+            if stored == key:
+                return int(self.vias[slot])
+            if stored == EMPTY_KEY:
+                return -1
+            slot = (slot + 1) & self.mask
+
+    def lookup_many(self, from_index, to_index) -> np.ndarray:
+        """Via index of each (from, to) pair (-1 where absent)."""
+        packed = pack_keys(from_index, to_index)
+        slots = self._slots(packed)
+        result = np.full(len(packed), -1, dtype=np.int64)
+        active = np.arange(len(packed))
+        while len(active):
+            stored = self.keys[slots]
+            found = stored == packed[active]
+            result[active[found]] = self.vias[slots[found]]
+            probing = ~found & (stored != EMPTY_KEY)
+            active, slots = active[probing], (slots[probing] + 1) & self.mask
+        return result
+
+
+# ============================================================================
+# 2. UNPACKING
+# ============================================================================
+
+class PathUnpacker:
+    """
+    Shortcut → edge sequence expansion over a ShortcutIndex.
+
+    Args:
+        index: ShortcutIndex of the output to unpack, over positions in edge_ids
+        edge_ids, edge_cost: Aligned edge arrays (sorted IDs)
+        memo_limit: Maximum number of memoized sub-paths (0 disables memoization)
+
+    Shortcuts are given and returned as edge IDs and expanded as edge indices.
+    """
+
+    def __init__(self, index: ShortcutIndex, edge_ids: np.ndarray, edge_cost: np.ndarray,
+                 memo_limit: int = 1_000_000):
+        self.index = index
+        self.edge_ids = edge_ids
+        self.edge_cost = edge_cost
+        self.memo_limit = memo_limit
+        self.memo = {}
+
+    @classmethod
+    def load(cls, shortcuts_path: str, edges_file: str = None, **kwargs) -> "PathUnpacker":
+        """Build the index from a binary graph directory or a shortcuts output directory (Parquet)."""
+        if is_binary_graph(shortcuts_path):
+            csr = ShortcutCSR.load(shortcuts_path)
+            from_index = np.repeat(np.arange(csr.n_edges), np.diff(csr.offsets))
+            index = ShortcutIndex(from_index, csr.targets, csr.vias)
+            return cls(index, np.asarray(csr.edge_ids), np.asarray(csr.edge_cost), **kwargs)
+
+        shortcuts = pd.read_parquet(shortcuts_path, columns=["from_edge", "to_edge", "via_edge"])
+        edges = load_edges(str(edges_file or config.EDGES_FILE))
+        index = ShortcutIndex(edges.index_of(shortcuts["from_edge"].values),
+                              edges.index_of(shortcuts["to_edge"].values),
+                              edges.index_of(shortcuts["via_edge"].values))
+        return cls(index, edges.ids, edges.cost, **kwargs)
+
+    def _edge_index(self, edge_id: int) -> int:
+        """Index of one edge ID (-1 if unknown)."""
+        pos = int(self.edge_ids.searchsorted(edge_id))
+        return pos if pos < len(self.edge_ids) and self.edge_ids[pos] == edge_id else -1
+
+    def _edge_indices(self, from_edges, to_edges) -> tuple:
+        """Edge indices of shortcut endpoints given as IDs (KeyError naming the first unknown pair)."""
+        from_edges = np.asarray(from_edges, dtype=np.int64)
+        to_edges = np.asarray(to_edges, dtype=np.int64)
+        indices = []
+        known = np.ones(len(from_edges), dtype=bool)
+        for edges in (from_edges, to_edges):
+            pos = np.minimum(np.searchsorted(self.edge_ids, edges), len(self.edge_ids) - 1)
+            known &= self.edge_ids[pos] == edges
+            indices.append(pos)
+        if not known.all():
+            missing = np.flatnonzero(~known)[0]
+            raise KeyError(f"No shortcut ({from_edges[missing]}, {to_edges[missing]}) to unpack")
+        return indices[0], indices[1]
+
+    def _via(self, a: int, b: int) -> int:
+        via = self.index.lookup(a, b)
+        if via < 0:
+            raise KeyError(f"No shortcut ({self.edge_ids[a]}, {self.edge_ids[b]}) to unpack")
+        return via
+
+    def unpack(self, from_edge: int, to_edge: int) -> tuple:
+        """
+        Edge sequence of shortcut (from_edge, to_edge), both ends included.
+
+        Segments are expanded depth-first with an explicit stack (no recursion
+        limit on long via chains); every expanded sub-path is memoized (up to
+        memo_limit entries), so shortcuts sharing sub-paths are expanded once.
+        """
+        if from_edge == to_edge:
+            return (from_edge,)
+        from_index, to_index = self._edge_index(from_edge), self._edge_index(to_edge)
+        if from_index < 0 or to_index < 0:
+            raise KeyError(f"No shortcut ({from_edge}, {to_edge}) to unpack")
+        return self._expand(from_index, to_index)
+
+    def _expand(self, from_index: int, to_index: int) -> tuple:
+        """Edge IDs of shortcut (from_index, to_index); the memo maps index pairs to ID tuples."""
+        memo = self.memo
+        cached = memo.get((from_index, to_index))
+        if cached is not None:
+            return cached
+
+        edge_id = self.edge_ids.item
+        path = [edge_id(from_index)]
+        # Entries: (from, to) to expand, or (from, to, start) closing a segment at path[start:]
+        stack = [(from_index, to_index)]
+        while stack:
+            entry = stack.pop()
+            if len(entry) == 3:
+                if len(memo) < self.memo_limit:
+                    memo[entry[:2]] = tuple(path[entry[2]:])
+                continue
+
+            a, b = entry
+            cached = memo.get(entry)
+            if cached is not None:
+                path.extend(cached[1:])
+                continue
+            via = self._via(a, b)
+            if via == b:
+                path.append(edge_id(b))
+            else:
+                stack.append((a, b, len(path) - 1))
+                stack.append((via, b))
+                stack.append((a, via))
+
+        return tuple(path)
+
+    def unpack_route(self, route: list) -> list:
+        """Edge sequence of a route given as consecutive shortcut endpoints (QueryEngine route)."""
+        if len(route) < 2:
+            return list(route)
+        edges = [route[0]]
+        for from_edge, to_edge in zip(route[:-1], route[1:]):
+            edges.extend(self.unpack(from_edge, to_edge)[1:])
+        return edges
+
+    def route_cost(self, edges, include_last: bool = False) -> float:
+        """Cost of an edge sequence; the last edge is excluded (shortcut convention) unless include_last."""
+        edges = edges if include_last else edges[:-1]
+        positions = np.searchsorted(self.edge_ids, np.asarray(edges, dtype=np.int64))
+        return float(self.edge_cost[positions].sum())
+
+    def unpack_batch(self, from_edges, to_edges) -> list:
+        """
+        Unpack many shortcuts with one vectorized index lookup per expansion level.
+
+        All segments still to expand are kept in route order; each level looks
+        up their vias at once and replaces every non-direct segment (a, b)
+        by (a, v), (v, b).
+
+        Returns:
+            One dict per shortcut: {"edges", "cost", "lookups"}
+        """
+        n_routes = len(from_edges)
+        if n_routes == 0:
+            return []
+        seg_from, seg_to = self._edge_indices(from_edges, to_edges)
+
+        route = np.arange(n_routes)
+        done = seg_from == seg_to
+        lookups = np.zeros(n_routes, dtype=np.int64)
+
+        while not done.all():
+            pending = ~done
+            vias = np.full(len(seg_from), -1, dtype=np.int64)
+            vias[pending] = self.index.lookup_many(seg_from[pending], seg_to[pending])
+            lookups += np.bincount(route[pending], minlength=n_routes)
+            if np.any(vias[pending] < 0):
+                missing = np.flatnonzero(pending & (vias < 0))[0]
+                raise KeyError(
+                    f"No shortcut ({self.edge_ids[seg_from[missing]]}, {self.edge_ids[seg_to[missing]]}) to unpack"
+                )
+
+            # Direct segments are final, the others split into two at their via
+            split = pending & (vias != seg_to)
+            done = done | (pending & ~split)
+            repeats = np.where(split, 2, 1)
+            second = np.zeros(int(repeats.sum()), dtype=bool)
+            second[np.cumsum(repeats)[split] - 1] = True
+
+            new_from = np.repeat(seg_from, repeats)
+            new_to = np.repeat(seg_to, repeats)
+            new_vias = np.repeat(vias, repeats)
+            first = np.repeat(split, repeats) & ~second
+            new_to[first] = new_vias[first]
+            new_from[second] = new_vias[second]
+
+            route = np.repeat(route, repeats)
+            done = np.repeat(done, repeats)
+            seg_from, seg_to = new_from, new_to
+
+        # Each route's edges: first segment start, then every segment end
+        bounds = np.searchsorted(route, np.arange(n_routes + 1))
+        single = seg_from == seg_to
+        # Route cost excludes the last edge: sum the cost of every segment start
+        costs = np.bincount(route[~single], weights=self.edge_cost[seg_from[~single]], minlength=n_routes)
+        from_ids, to_ids = self.edge_ids[seg_from], self.edge_ids[seg_to]
+        results = []
+        for r in range(n_routes):
+            lo, hi = bounds[r], bounds[r + 1]
+            if single[lo]:
+                edges = [int(from_ids[lo])]
+            else:
+                edges = [int(from_ids[lo])] + to_ids[lo:hi].tolist()
+            results.append({"edges": edges, "cost": float(costs[r]), "lookups": int(lookups[r])})
+        return results
+
+
+# ============================================================================
+# MAIN EXECUTION
+# ============================================================================
+
+def _sample_shortcuts(shortcuts_path: str, n_shortcuts: int, seed: int = 0) -> tuple:
+    """(from_edges, to_edges, costs) of random shortcuts from a binary graph directory or a Parquet output."""
+    if is_binary_graph(shortcuts_path):
+        csr = ShortcutCSR.load(shortcuts_path)
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(csr.n_shortcuts, size=min(n_shortcuts, csr.n_shortcuts), replace=False))
+        from_index = np.searchsorted(csr.offsets, rows, side="right") - 1
+        return csr.edge_ids[from_index], csr.edge_ids[csr.targets[rows]], np.asarray(csr.costs[rows])
+
+    shortcuts = pd.read_parquet(shortcuts_path, columns=["from_edge", "to_edge", "cost"])
+    sample = shortcuts.sample(min(n_shortcuts, len(shortcuts)), random_state=seed)
+    return sample["from_edge"].values, sample["to_edge"].values, sample["cost"].values
+
+
+def main(shortcuts_path: str = None, n_shortcuts: int = 10_000, seed: int = 0):
+    """Unpack sampled shortcuts (scalar and batch), check costs and report time per hop."""
+    shortcuts_path = shortcuts_path or str(config.SHORTCUTS_OUTPUT_FILE).replace("_shortcuts", "_spark_hybrid")
+    log_section(logger, "PATH UNPACKING BENCHMARK")
+    log_dict(logger, {"shortcuts": shortcuts_path, "sample": n_shortcuts}, "Configuration")
+
+    start = time.perf_counter()
+    unpacker = PathUnpacker.load(shortcuts_path)
+    logger.info(f"✓ Indexed {len(unpacker.index)} shortcuts in {time.perf_counter() - start:.1f}s")
+
+    from_edges, to_edges, costs = _sample_shortcuts(shortcuts_path, n_shortcuts, seed)
+    pairs = list(zip(from_edges.tolist(), to_edges.tolist()))
+
+    start = time.perf_counter()
+    batch = unpacker.unpack_batch(from_edges, to_edges)
+    batch_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scalar = [unpacker.unpack(a, b) for a, b in pairs]
+    scalar_time = time.perf_counter() - start
+
+    hops = sum(len(result["edges"]) - 1 for result in batch)
+    mismatches = sum(list(path) != result["edges"] for path, result in zip(scalar, batch))
+    cost_errors = int(np.count_nonzero(~np.isclose([r["cost"] for r in batch], costs)))
+
+    log_dict(logger, {
+        "shortcuts": len(pairs),
+        "hops": hops,
+        "batch_us_per_hop": f"{batch_time / max(hops, 1) * 1e6:.2f}",
+        "memoized_us_per_hop": f"{scalar_time / max(hops, 1) * 1e6:.2f}",
+        "mean_lookups": f"{np.mean([r['lookups'] for r in batch]):.1f}",
+        "path_mismatches": mismatches,
+        "cost_mismatches": cost_errors
+    }, "Unpacking")
+    log_section(logger, "COMPLETED")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,260 @@
+"""
+query_cache.py
+==============
+
+Bounded result cache in front of the shortcut query engine.
+
+Query traffic is skewed (a few thousand origin-destination pairs make up
+most requests), so results are cached by (from_edge, to_edge, profile):
+- LRU eviction bounded by the number of entries and by the total route
+  length held (QUERY_CACHE_ENTRIES, QUERY_CACHE_ROUTE_EDGES)
+- hit, miss and eviction counters
+- invalidation when a profile's shortcuts output is (re)loaded; each
+  invalidation starts a new generation, and a result computed under an
+  older generation is not stored
+
+Key features:
+- QueryCache: the cache itself (also used by routing_service.py)
+- CachedQueryEngine: one QueryEngine per profile behind one cache
+- skewed_pairs + benchmark: cached vs uncached latency on a Zipf workload
+
+Usage:
+    python query_cache.py [graph_dir] [n_queries] [n_pairs]
+"""
+
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from logging_config import get_logger, log_section, log_dict
+from query_engine import QueryEngine, ShortcutGraph, _latency_stats
+import config
+
+logger = get_logger(__name__)
+
+DEFAULT_PROFILE = "default"
+
+
+# ============================================================================
+# 1. LRU CACHE
+# ============================================================================
+
+def _result_size(result: dict) -> int:
+    """Route edges held by a cached result (at least 1 per entry)."""
+    return 1 + len(result.get("route", ())) + len(result.get("edges", ()))
+
+
+class QueryCache:
+    """
+    LRU cache of query results keyed by (from_edge, to_edge, profile).
+
+    Cached results are shared between callers and must not be modified.
+
+    Args:
+        max_entries: Maximum number of cached results
+        max_route_edges: Maximum total route length (shortcut route plus
+            unpacked edges) of the cached results
+    """
+
+    def __init__(self, max_entries: int = config.QUERY_CACHE_ENTRIES,
+                 max_route_edges: int = config.QUERY_CACHE_ROUTE_EDGES):
+        self.max_entries = max_entries
+        self.max_route_edges = max_route_edges
+        self.entries = OrderedDict()
+        self.route_edges = 0
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: tuple, require: str = None):
+        """
+        Cached result of key, or None (counted as a miss).
+
+        A result without the field require (e.g. "edges" for an unpacked
+        route) also counts as a miss.
+        """
+        result = self.entries.get(key)
+        if result is None or (require is not None and require not in result):
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, key: tuple, result: dict, generation: int = None) -> bool:
+        """
+        Store a result, evicting least recently used entries as needed.
+
+        Args:
+            generation: Cache generation when the computation started; the
+                result is dropped if the cache was invalidated since
+
+        Returns:
+            True if the result was stored
+        """
+        if generation is not None and generation != self.generation:
+            return False
+        size = _result_size(result)
+        if size > self.max_route_edges:
+            return False
+
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.route_edges -= _result_size(previous)
+        self.entries[key] = result
+        self.route_edges += size
+
+        while len(self.entries) > self.max_entries or self.route_edges > self.max_route_edges:
+            _, evicted = self.entries.popitem(last=False)
+            self.route_edges -= _result_size(evicted)
+            self.evictions += 1
+        return key in self.entries
+
+    def invalidate(self, profile: str = None):
+        """Drop the results of one profile (all profiles when None) and start a new generation."""
+        if profile is None:
+            self.entries.clear()
+            self.route_edges = 0
+        else:
+            for key in [key for key in self.entries if key[2] == profile]:
+                self.route_edges -= _result_size(self.entries.pop(key))
+        self.generation += 1
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "route_edges": self.route_edges,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "generation": self.generation
+        }
+
+
+# ============================================================================
+# 2. CACHED ENGINE
+# ============================================================================
+
+class CachedQueryEngine:
+    """
+    Query engines of several profiles (one shortcuts output each) behind one QueryCache.
+
+    Example:
+        engine = CachedQueryEngine()
+        engine.load("car_day", "../output/<district>_spark_profiles_car_day_csr")
+        engine.query(from_edge, to_edge, "car_day")
+    """
+
+    def __init__(self, cache: QueryCache = None):
+        self.cache = cache if cache is not None else QueryCache()
+        self.engines = {}
+
+    def load(self, profile: str, graph_path: str, edges_file: str = None) -> QueryEngine:
+        """Load (or replace) the shortcuts output of a profile; its cached results are dropped."""
+        self.engines[profile] = QueryEngine(ShortcutGraph.load(graph_path, edges_file))
+        self.cache.invalidate(profile)
+        return self.engines[profile]
+
+    def query(self, from_edge: int, to_edge: int, profile: str = DEFAULT_PROFILE) -> dict:
+        """QueryEngine.query result, answered from the cache when possible."""
+        engine = self.engines.get(profile)
+        if engine is None:
+            raise ValueError(f"Unknown profile {profile}")
+
+        key = (int(from_edge), int(to_edge), profile)
+        result = self.cache.get(key)
+        if result is None:
+            result = engine.query(from_edge, to_edge)
+            self.cache.put(key, result)
+        return result
+
+    def distance(self, from_edge: int, to_edge: int, profile: str = DEFAULT_PROFILE) -> float:
+        return self.query(from_edge, to_edge, profile)["cost"]
+
+
+# ============================================================================
+# 3. BENCHMARK
+# ============================================================================
+
+def skewed_pairs(edge_ids: np.ndarray, n_queries: int, n_pairs: int = 2000,
+                 exponent: float = 1.1, seed: int = 0) -> np.ndarray:
+    """
+    Query workload (n_queries, 2) drawn from n_pairs random OD pairs with
+    Zipf weights (pair of rank k has weight k^-exponent).
+    """
+    rng = np.random.default_rng(seed)
+    pool = edge_ids[rng.integers(0, len(edge_ids), size=(n_pairs, 2))]
+    weights = np.arange(1, n_pairs + 1, dtype=np.float64) ** -exponent
+    return pool[rng.choice(n_pairs, size=n_queries, p=weights / weights.sum())]
+
+
+def benchmark(cached: CachedQueryEngine, pairs: np.ndarray, profile: str = DEFAULT_PROFILE) -> dict:
+    """
+    Run the workload uncached and through the cache (starting empty) and compare.
+
+    Returns:
+        {"queries", "mismatches", "uncached": {...}, "cached": {...}, "speedup", "cache"}
+        with mean/p50/p95 latency (ms) per path and the cache statistics
+    """
+    engine = cached.engines[profile]
+    cached.cache.invalidate(profile)
+    latencies = {"uncached": [], "cached": []}
+    mismatches = 0
+
+    for from_edge, to_edge in pairs.tolist():
+        start = time.perf_counter()
+        expected = engine.query(from_edge, to_edge)["cost"]
+        latencies["uncached"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        cost = cached.query(from_edge, to_edge, profile)["cost"]
+        latencies["cached"].append(time.perf_counter() - start)
+
+        if not (cost == expected or np.isclose(cost, expected)):
+            mismatches += 1
+
+    report = {"queries": len(pairs), "mismatches": mismatches}
+    for name, values in latencies.items():
+        report[name] = _latency_stats(values)
+    report["speedup"] = report["uncached"]["mean_ms"] / max(report["cached"]["mean_ms"], 1e-9)
+    report["cache"] = cached.cache.stats()
+    return report
+
+
+# ============================================================================
+# MAIN EXECUTION
+# ============================================================================
+
+def main(graph_path: str = None, n_queries: int = 5000, n_pairs: int = 2000):
+    """Compare cached and uncached query latency on a skewed OD workload."""
+    graph_path = graph_path or str(config.SHORTCUTS_OUTPUT_FILE).replace("_shortcuts", "_spark_hybrid")
+    log_section(logger, "QUERY CACHE BENCHMARK")
+    log_dict(logger, {"graph": graph_path, "queries": n_queries, "od_pairs": n_pairs,
+                      "max_entries": config.QUERY_CACHE_ENTRIES,
+                      "max_route_edges": config.QUERY_CACHE_ROUTE_EDGES}, "Configuration")
+
+    cached = CachedQueryEngine()
+    graph = cached.load(DEFAULT_PROFILE, graph_path).graph
+    report = benchmark(cached, skewed_pairs(np.asarray(graph.edge_ids), n_queries, n_pairs))
+
+    for name in ("uncached", "cached"):
+        stats = report[name]
+        logger.info(f"  {name:8s}: mean {stats['mean_ms']:.3f} ms, p50 {stats['p50_ms']:.4f} ms, "
+                    f"p95 {stats['p95_ms']:.3f} ms")
+    cache = report["cache"]
+    logger.info(f"✓ Hit rate {cache['hit_rate']:.1%} ({cache['entries']} entries, {cache['evictions']} evictions), "
+                f"speedup {report['speedup']:.1f}x, {report['mismatches']} cost mismatches")
+    log_section(logger, "COMPLETED")
+    return report
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None, *(int(arg) for arg in sys.argv[2:4]))
@@ -0,0 +1,472 @@
+"""
+query_engine.py
+===============
+
+Point-to-point route queries over a generated shortcuts output.
+
+The final shortcuts form a hierarchy over the H3 cells: inside = +1 goes up
+(towards coarser edges), 0 stays on a level and -1 goes down, and a shortest
+route is a chain of up, lateral and down shortcuts. A query from edge s to
+edge t runs a bidirectional Dijkstra:
+- forward from s over upward and lateral shortcuts (inside in {+1, 0})
+- backward from t over downward shortcuts, reversed (inside = -1)
+and the best meeting edge gives the distance. Each side only relaxes
+shortcuts whose cell lies on its endpoint's ancestor chain (the cells that
+contain the endpoint's LCA cell), so the searches stay in the part of the
+hierarchy above s and t. Outer-only shortcuts (inside = -2) are not used.
+
+A cell's shortcuts are shortest paths over everything inside it, including
+the lateral shortcuts of its finer cells, and a side uses one cell per
+resolution. So an edge reached over a lateral shortcut relaxes nothing: each
+continuation from it is matched by a direct shortcut of the same cell. Meetings
+are detected when an edge is reached, so a query does not even queue such edges.
+
+Restricting both sides to the LCA cell of s and t is not exact (the best
+route may leave that cell), so the ancestor chains are the only cell filter.
+
+Costs follow the shortcut convention (a shortcut excludes its last edge), so
+a route cost is the sum of the shortcut costs plus cost(to_edge).
+
+Key features:
+- ShortcutGraph: upward and reversed downward arcs per edge, sorted by cost,
+  over a Parquet output or a memory-mapped binary graph (binary_graph.py)
+- QueryEngine: bidirectional search returning cost, meeting edge, shortcut
+  route and settled counts
+- EdgeGraphDijkstra + benchmark: latency comparison with plain Dijkstra on
+  the edge graph (results are checked for equality)
+"""
+
+import heapq
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from logging_config import get_logger, log_section, log_dict
+from h3_bitwise import h3_parent, h3_resolution
+from generate_shortcuts_numpy import load_edges
+from binary_graph import ShortcutCSR, csr_offsets, is_binary_graph
+import config
+
+logger = get_logger(__name__)
+
+INF = float("inf")
+
+
+# ============================================================================
+# 1. SHORTCUT GRAPH
+# ============================================================================
+
+class NodeArcs:
+    """
+    Arcs of one search direction per node, built on first use.
+
+    Args:
+        offsets, neighbors: CSR of the direction (neighbor = next edge of the search)
+        rows: Row of each arc in the per-shortcut arrays (None: the CSR order itself)
+        csr: ShortcutCSR holding costs, cells and inside
+        inside_range: (lowest, highest) inside value the direction uses
+
+    A node's arcs are sorted by cost, so a search cuts them at its distance
+    bound and relaxes them in one vectorized step per settled node. The set
+    of their cells is kept as well: when it lies on the search's ancestor
+    chain, as it usually does, no per-arc cell check is needed. Arcs are built
+    from the CSR slice of a node when the node is first settled, which keeps
+    startup independent of the graph size (the CSR may be memory-mapped).
+    """
+
+    def __init__(self, offsets, neighbors, rows, csr, inside_range: tuple):
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.rows = rows
+        self.csr = csr
+        self.inside_low, self.inside_high = inside_range
+        self.cache = {}
+
+    def arcs(self, node: int) -> tuple:
+        """(cell set, cells, neighbors, costs, lateral flags) of a node's arcs, by ascending cost."""
+        cached = self.cache.get(node)
+        if cached is not None:
+            return cached
+
+        lo, hi = int(self.offsets[node]), int(self.offsets[node + 1])
+        rows = np.arange(lo, hi) if self.rows is None else np.asarray(self.rows[lo:hi])
+        inside = self.csr.inside[rows]
+        keep = (inside >= self.inside_low) & (inside <= self.inside_high)
+        rows, neighbors = rows[keep], np.asarray(self.neighbors[lo:hi])[keep]
+
+        costs = self.csr.costs[rows].astype(np.float64)
+        order = np.argsort(costs, kind="stable")
+        rows, neighbors, costs = rows[order], neighbors[order].astype(np.int64), costs[order]
+        cells, laterals = self.csr.cells[rows], self.csr.inside[rows] == 0
+        arcs = (frozenset(cells.tolist()), cells, neighbors, costs, laterals)
+        self.cache[node] = arcs
+        return arcs
+
+
+class ShortcutGraph:
+    """
+    Upward and downward shortcut graphs over edge indices.
+
+    Attributes:
+        csr: ShortcutCSR of the output (in memory or memory-mapped)
+        edge_ids: Sorted edge IDs (index = node)
+        edge_cost: Cost of each edge (added for the target edge)
+        edge_lca_cell: LCA cell of each edge's endpoints (0 if none)
+        up: NodeArcs of the shortcuts with inside in {+1, 0}
+        down: NodeArcs of the shortcuts with inside = -1, reversed (to_edge -> from_edge)
+    """
+
+    def __init__(self, csr: ShortcutCSR):
+        self.csr = csr
+        self.edge_ids = csr.edge_ids
+        self.n_edges = csr.n_edges
+        self.n_shortcuts = csr.n_shortcuts
+        self.edge_cost = csr.edge_cost
+        self.edge_lca_cell = csr.edge_lca_cell
+
+        self.up = NodeArcs(csr.offsets, csr.targets, None, csr, (0, 1))
+        self.down = NodeArcs(csr.rev_offsets, csr.rev_sources, csr.rev_rows, csr, (-1, -1))
+
+    @classmethod
+    def load(cls, shortcuts_path: str, edges_file: str = None) -> "ShortcutGraph":
+        """
+        Load a binary graph directory (memory-mapped, see binary_graph.py) or
+        a shortcuts output directory (Parquet, with the edges file for costs and cells).
+        """
+        if is_binary_graph(shortcuts_path):
+            return cls(ShortcutCSR.load(shortcuts_path))
+        shortcuts = pd.read_parquet(shortcuts_path, columns=["from_edge", "to_edge", "cost", "via_edge", "inside", "cell"])
+        return cls(ShortcutCSR.from_shortcuts(shortcuts, load_edges(str(edges_file or config.EDGES_FILE))))
+
+    def index_of_many(self, edge_ids) -> np.ndarray:
+        """Node indices of edge IDs (all must exist)."""
+        edge_ids = np.asarray(edge_ids, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.edge_ids, edge_ids), self.n_edges - 1)
+        if not np.all(self.edge_ids[pos] == edge_ids):
+            raise ValueError("Unknown edge id in query")
+        return pos
+
+    def index_of(self, edge_id: int) -> int:
+        """Node index of an edge ID."""
+        return int(self.index_of_many([edge_id])[0])
+
+    def ancestor_cells(self, node: int) -> set:
+        """Cells containing the node's LCA cell (all resolutions), plus 0 for shortcuts without a cell."""
+        cell = np.asarray(self.edge_lca_cell[node:node + 1])
+        res = int(h3_resolution(cell)[0])
+        if res < 0:
+            return {0}
+        return set(h3_parent(np.repeat(cell, res + 1), np.arange(res + 1)).tolist()) | {0}
+
+
+# ============================================================================
+# 2. BIDIRECTIONAL QUERY
+# ============================================================================
+
+class QueryEngine:
+    """
+    Point-to-point queries on a ShortcutGraph.
+
+    Distances, parents and lateral arrivals live in arrays allocated once per
+    engine; a search resets only the entries it touched, so a query costs its
+    search space, not O(|E|). An engine serves one search at a time.
+    """
+
+    def __init__(self, graph: ShortcutGraph):
+        self.graph = graph
+        self.dist = np.full((2, graph.n_edges), INF)
+        self.parent = np.full((2, graph.n_edges), -1, dtype=np.int64)
+        self.lateral = np.zeros((2, graph.n_edges), dtype=bool)
+
+    def distance(self, from_edge: int, to_edge: int) -> float:
+        """Route cost from from_edge to to_edge, including both edges (inf if unreachable)."""
+        return self.query(from_edge, to_edge)["cost"]
+
+    def _relax(self, side: int, arcs: NodeArcs, allowed: set, node: int, d: float, bound: float,
+               queue: list, touched: list, queue_laterals: bool = True):
+        """
+        Relax a node's arcs in allowed cells whose candidate distance is within bound.
+        Edges reached over a lateral shortcut are only queued when queue_laterals is set.
+
+        Returns:
+            (neighbors, candidates) arrays of the improved entries, or None
+            when nothing improved or the node was reached over a lateral shortcut
+        """
+        if self.lateral[side, node]:
+            return None
+        cell_set, cells, neighbors, costs, laterals = arcs.arcs(node)
+        if bound < INF:
+            limit = int(costs.searchsorted(bound - d, side="right"))
+            cells, neighbors, costs, laterals = cells[:limit], neighbors[:limit], costs[:limit], laterals[:limit]
+        candidates = d + costs
+        side_dist = self.dist[side]
+        better = candidates < side_dist[neighbors]
+        if not cell_set <= allowed:
+            better &= np.isin(cells, list(allowed))
+        neighbors, candidates = neighbors[better], candidates[better]
+        if len(neighbors) == 0:
+            return None
+        side_dist[neighbors] = candidates
+        self.parent[side][neighbors] = node
+        self.lateral[side][neighbors] = laterals[better]
+        touched.append(neighbors)
+        queued = (candidates, neighbors)
+        if not queue_laterals:
+            upward = ~laterals[better]
+            queued = (candidates[upward], neighbors[upward])
+        for entry in zip(queued[0].tolist(), queued[1].tolist()):
+            heapq.heappush(queue, entry)
+        return neighbors, candidates
+
+    def _reset(self, touched: list):
+        """Restore the distance, parent and lateral entries a search touched."""
+        if touched:
+            nodes = np.concatenate(touched)
+            self.dist[:, nodes] = INF
+            self.parent[:, nodes] = -1
+            self.lateral[:, nodes] = False
+
+    def query(self, from_edge: int, to_edge: int) -> dict:
+        """
+        Bidirectional search between two edge IDs.
+
+        Returns:
+            {"cost", "meeting_edge", "route" (edge IDs at shortcut level), "settled"}
+        """
+        graph = self.graph
+        source, target = graph.index_of(from_edge), graph.index_of(to_edge)
+
+        sides = [(graph.up, graph.ancestor_cells(source)), (graph.down, graph.ancestor_cells(target))]
+        dist = self.dist
+        dist[0, source] = dist[1, target] = 0.0
+        touched = [np.array([source, target], dtype=np.int64)]
+        queues = [[(0.0, source)], [(0.0, target)]]
+        settled = [0, 0]
+        best, meeting = (0.0, source) if source == target else (INF, -1)
+
+        try:
+            while queues[0] or queues[1]:
+                # Alternate sides; a side stops once its next key cannot improve best
+                for side in (0, 1):
+                    queue = queues[side]
+                    if not queue:
+                        continue
+                    d, node = heapq.heappop(queue)
+                    if d >= best:
+                        queue.clear()
+                        continue
+                    if d > dist[side, node]:
+                        continue
+                    settled[side] += 1
+
+                    # Arcs that cannot lead to a route below best are cut; an edge
+                    # the other side has reached is a meeting as soon as it improves
+                    arcs, allowed = sides[side]
+                    improved = self._relax(side, arcs, allowed, node, d, best, queue, touched, False)
+                    if improved is not None:
+                        neighbors, candidates = improved
+                        through = candidates + dist[1 - side][neighbors]
+                        k = int(through.argmin())
+                        if through[k] < best:
+                            best, meeting = float(through[k]), int(neighbors[k])
+
+            if meeting < 0:
+                return {"cost": INF, "meeting_edge": None, "route": [], "settled": sum(settled)}
+
+            route = self._route(self.parent, meeting)
+        finally:
+            self._reset(touched)
+
+        return {
+            "cost": float(best + graph.edge_cost[target]),
+            "meeting_edge": int(graph.edge_ids[meeting]),
+            "route": [int(e) for e in graph.edge_ids[route]],
+            "settled": sum(settled)
+        }
+
+    def search_space(self, node: int, backward: bool = False, max_dist: float = INF) -> tuple:
+        """
+        Complete one-sided search from an edge index (no meeting bound).
+
+        Forward: upward and lateral shortcuts from the edge; backward: downward
+        shortcuts into it, reversed. Both keep the ancestor-chain cell filter.
+        Edges farther than max_dist are not settled.
+
+        Returns:
+            (nodes, dists) arrays of every settled edge index and its distance
+        """
+        graph = self.graph
+        arcs = graph.down if backward else graph.up
+        allowed = graph.ancestor_cells(node)
+        side = 1 if backward else 0
+        dist = self.dist[side]
+
+        dist[node] = 0.0
+        touched = [np.array([node], dtype=np.int64)]
+        queue = [(0.0, node)]
+        nodes, dists = [], []
+        try:
+            while queue:
+                d, current = heapq.heappop(queue)
+                if d > max_dist:
+                    break
+                if d > dist[current]:
+                    continue
+                nodes.append(current)
+                dists.append(d)
+                self._relax(side, arcs, allowed, current, d, max_dist, queue, touched)
+        finally:
+            self._reset(touched)
+
+        return np.array(nodes, dtype=np.int64), np.array(dists, dtype=np.float64)
+
+    @staticmethod
+    def _route(parent: list, meeting: int) -> list:
+        """Node sequence source .. meeting .. target from the two parent maps."""
+        forward = []
+        node = meeting
+        while node != -1:
+            forward.append(node)
+            node = parent[0][node]
+        forward.reverse()
+
+        node = parent[1][meeting]
+        while node != -1:
+            forward.append(node)
+            node = parent[1][node]
+        return forward
+
+
+# ============================================================================
+# 3. BASELINE AND LATENCY BENCHMARK
+# ============================================================================
+
+class EdgeGraphDijkstra:
+    """Plain unidirectional Dijkstra on the edge graph (baseline for the benchmark)."""
+
+    def __init__(self, graph_file: str, graph: ShortcutGraph):
+        edge_graph = pd.read_csv(graph_file, usecols=["from_edge", "to_edge"])
+        self.graph = graph
+        self.edge_cost = np.asarray(graph.edge_cost).tolist()
+
+        sources = graph.index_of_many(edge_graph["from_edge"].values)
+        order = np.argsort(sources, kind="stable")
+        self.offsets = csr_offsets(sources[order], graph.n_edges).tolist()
+        self.targets = graph.index_of_many(edge_graph["to_edge"].values)[order].tolist()
+
+    def query(self, from_edge: int, to_edge: int) -> dict:
+        """Route cost (same convention as QueryEngine.query) and settled count."""
+        graph = self.graph
+        source, target = graph.index_of(from_edge), graph.index_of(to_edge)
+        edge_cost = self.edge_cost
+
+        dist = {source: 0.0}
+        queue = [(0.0, source)]
+        settled = 0
+        while queue:
+            d, node = heapq.heappop(queue)
+            if d > dist[node]:
+                continue
+            settled += 1
+            if node == target:
+                return {"cost": d + edge_cost[target], "settled": settled}
+            # Entering the next edge costs the current edge
+            candidate = d + edge_cost[node]
+            for k in range(self.offsets[node], self.offsets[node + 1]):
+                neighbor = self.targets[k]
+                if candidate < dist.get(neighbor, INF):
+                    dist[neighbor] = candidate
+                    heapq.heappush(queue, (candidate, neighbor))
+        return {"cost": INF, "settled": settled}
+
+    def one_to_all(self, from_edge: int, max_cost: float = INF) -> dict:
+        """Route cost of every edge reachable within max_cost: {edge index: cost}."""
+        source = self.graph.index_of(from_edge)
+        edge_cost = self.edge_cost
+        dist = {source: 0.0}
+        costs = {}
+        queue = [(0.0, source)]
+        while queue:
+            d, node = heapq.heappop(queue)
+            if d > max_cost:
+                break
+            if d > dist[node]:
+                continue
+            candidate = d + edge_cost[node]
+            if candidate <= max_cost:
+                costs[node] = candidate
+            for k in range(self.offsets[node], self.offsets[node + 1]):
+                neighbor = self.targets[k]
+                if candidate < dist.get(neighbor, INF):
+                    dist[neighbor] = candidate
+                    heapq.heappush(queue, (candidate, neighbor))
+        return costs
+
+
+def _latency_stats(latencies: list) -> dict:
+    values = np.array(latencies) * 1e3
+    return {"mean_ms": float(values.mean()), "p50_ms": float(np.percentile(values, 50)),
+            "p95_ms": float(np.percentile(values, 95))}
+
+
+def benchmark(engine: QueryEngine, baseline: EdgeGraphDijkstra, n_queries: int = 200, seed: int = 0) -> dict:
+    """
+    Time random queries on both engines and check that the costs agree.
+
+    Returns:
+        {"queries", "mismatches", "shortcuts": {...}, "dijkstra": {...}, "speedup"}
+        with mean/p50/p95 latency (ms) and mean settled nodes per engine
+    """
+    rng = np.random.default_rng(seed)
+    pairs = engine.graph.edge_ids[rng.integers(0, engine.graph.n_edges, size=(n_queries, 2))]
+
+    results = {"shortcuts": ([], []), "dijkstra": ([], [])}
+    mismatches = 0
+    for from_edge, to_edge in pairs.tolist():
+        costs = []
+        for name, runner in (("shortcuts", engine), ("dijkstra", baseline)):
+            start = time.perf_counter()
+            answer = runner.query(from_edge, to_edge)
+            results[name][0].append(time.perf_counter() - start)
+            results[name][1].append(answer["settled"])
+            costs.append(answer["cost"])
+        if not (costs[0] == costs[1] or np.isclose(costs[0], costs[1])):
+            mismatches += 1
+
+    report = {"queries": n_queries, "mismatches": mismatches}
+    for name, (latencies, settled) in results.items():
+        report[name] = {**_latency_stats(latencies), "settled": float(np.mean(settled))}
+    report["speedup"] = report["dijkstra"]["mean_ms"] / max(report["shortcuts"]["mean_ms"], 1e-9)
+    return report
+
+
+# ============================================================================
+# MAIN EXECUTION
+# ============================================================================
+
+def main(shortcuts_path: str = None, n_queries: int = 200):
+    """Load a shortcuts output and benchmark queries against plain Dijkstra."""
+    shortcuts_path = shortcuts_path or str(config.SHORTCUTS_OUTPUT_FILE).replace("_shortcuts", "_spark_hybrid")
+    log_section(logger, "QUERY ENGINE BENCHMARK")
+    log_dict(logger, {"shortcuts": shortcuts_path, "edges_file": str(config.EDGES_FILE),
+                      "queries": n_queries}, "Configuration")
+
+    start = time.perf_counter()
+    graph = ShortcutGraph.load(shortcuts_path)
+    logger.info(f"✓ Loaded {graph.n_shortcuts} shortcuts in {time.perf_counter() - start:.3f}s")
+
+    report = benchmark(QueryEngine(graph), EdgeGraphDijkstra(str(config.GRAPH_FILE), graph), n_queries)
+
+    for name in ("shortcuts", "dijkstra"):
+        stats = report[name]
+        logger.info(f"  {name:9s}: mean {stats['mean_ms']:.3f} ms, p50 {stats['p50_ms']:.3f} ms, "
+                    f"p95 {stats['p95_ms']:.3f} ms, {stats['settled']:.0f} settled")
+    logger.info(f"✓ Speedup: {report['speedup']:.1f}x, {report['mismatches']} cost mismatches")
+    log_section(logger, "COMPLETED")
+    return report
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,401 @@
+"""
+routing_service.py
+==================
+
+Asyncio HTTP service around the shortcut query engine.
+
+Endpoints (JSON in, JSON out):
+- POST /route   {"from_edge", "to_edge", "unpack": false} → {"cost", "route"[, "edges"]}
+- POST /matrix  {"sources": [...], "targets": [...]}      → {"matrix": [[...]]}
+- POST /unpack  {"route": [...]}                          → {"edges", "cost"} (cost as /route)
+- GET  /edges?n=1000                                      → {"edges": [...]} (random sample)
+- GET  /stats                                             → latency histograms and batch counters
+
+Unreachable costs are null. /route results are cached per (from_edge,
+to_edge, profile) in a QueryCache (query_cache.py); the profile is the graph
+directory name, and a service started on a new output starts with an empty
+cache. Concurrent uncached /route and /unpack requests are coalesced into
+micro-batches (up to SERVICE_BATCH_SIZE, waiting at most
+SERVICE_BATCH_WAIT_MS for the batch to fill), and each batch runs as one
+task on the worker pool, so the event loop only parses requests and
+dispatches. Workers load the graph themselves; a binary graph
+(binary_graph.py) is memory-mapped and shared between them.
+
+HTTP/1.1 with keep-alive is implemented on asyncio streams (no extra
+dependency); load_generator.py drives the service with concurrent clients.
+
+Usage:
+    python routing_service.py [graph_dir]
+"""
+
+import asyncio
+import json
+import math
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from logging_config import get_logger, log_section, log_dict
+from query_engine import QueryEngine, ShortcutGraph
+from path_unpacking import PathUnpacker
+from distance_matrix import compute_matrix
+from query_cache import QueryCache
+import config
+
+logger = get_logger(__name__)
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+# ============================================================================
+# 1. WORKER TASKS
+# ============================================================================
+
+# Engine and unpacker of this worker (set by init_worker)
+_ENGINE = None
+_UNPACKER = None
+
+
+def init_worker(graph_path: str, edges_file: str = None):
+    """Load the graph once per worker process (or once in-process for the thread executor)."""
+    global _ENGINE, _UNPACKER
+    _ENGINE = QueryEngine(ShortcutGraph.load(graph_path, edges_file))
+    _UNPACKER = PathUnpacker.load(graph_path, edges_file)
+
+
+def _json_cost(cost: float):
+    return cost if math.isfinite(cost) else None
+
+
+def route_batch(requests: list) -> list:
+    """Answer [(from_edge, to_edge, unpack)] point-to-point requests."""
+    results = []
+    for from_edge, to_edge, unpack in requests:
+        try:
+            answer = _ENGINE.query(from_edge, to_edge)
+            result = {"cost": _json_cost(answer["cost"]), "route": answer["route"]}
+            if unpack:
+                result["edges"] = _UNPACKER.unpack_route(answer["route"]) if answer["route"] else []
+        except (ValueError, KeyError) as e:
+            result = {"error": str(e)}
+        results.append(result)
+    return results
+
+
+def unpack_batch(routes: list) -> list:
+    """Unpack routes given as consecutive shortcut endpoints."""
+    results = []
+    for route in routes:
+        try:
+            edges = _UNPACKER.unpack_route(route)
+            results.append({"edges": edges, "cost": _UNPACKER.route_cost(edges, include_last=True)})
+        except KeyError as e:
+            results.append({"error": str(e)})
+    return results
+
+
+def matrix_task(sources: list, targets: list) -> list:
+    """Many-to-many matrix (rows of route costs, None when unreachable)."""
+    matrix = compute_matrix(_ENGINE, sources, targets)
+    return [[_json_cost(value) for value in row] for row in matrix.tolist()]
+
+
+# ============================================================================
+# 2. MICRO-BATCHING AND LATENCY HISTOGRAMS
+# ============================================================================
+
+class MicroBatcher:
+    """
+    Coalesce concurrent requests into batches run on an executor.
+
+    A batch is dispatched when it reaches max_batch items or max_wait seconds
+    after its first item. At most max_in_flight batches run at once (one per
+    worker); while all workers are busy, requests keep accumulating and are
+    dispatched as soon as a batch completes, so batches grow with the load.
+    submit() resolves with the item's result.
+    """
+
+    def __init__(self, executor, batch_function, max_batch: int, max_wait: float, max_in_flight: int = 1):
+        self.executor = executor
+        self.batch_function = batch_function
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_in_flight = max_in_flight
+        self.pending = []
+        self.timer = None
+        self.in_flight = 0
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((item, future))
+        if len(self.pending) >= self.max_batch:
+            self._flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending or self.in_flight >= self.max_in_flight:
+            return
+        batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+        self.batches += 1
+        self.items += len(batch)
+        self.in_flight += 1
+
+        task = asyncio.get_running_loop().run_in_executor(
+            self.executor, self.batch_function, [item for item, _ in batch]
+        )
+        task.add_done_callback(lambda done: self._resolve(batch, done))
+
+    def _resolve(self, batch: list, done):
+        self.in_flight -= 1
+        error = done.exception()
+        results = None if error else done.result()
+        for i, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(results[i])
+        # Requests that arrived while the workers were busy go out now
+        self._flush()
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "items": self.items,
+                "mean_batch": self.items / self.batches if self.batches else 0.0}
+
+
+class LatencyHistogram:
+    """Request latencies in log-spaced buckets (0.05 ms to 60 s)."""
+
+    BOUNDS_MS = np.geomspace(0.05, 60_000, 49)
+
+    def __init__(self):
+        self.counts = np.zeros(len(self.BOUNDS_MS) + 1, dtype=np.int64)
+        self.total_ms = 0.0
+
+    def record(self, seconds: float):
+        ms = seconds * 1e3
+        self.counts[np.searchsorted(self.BOUNDS_MS, ms)] += 1
+        self.total_ms += ms
+
+    def percentile(self, q: float) -> float:
+        """Upper bound (ms) of the bucket holding the q-th percentile."""
+        count = int(self.counts.sum())
+        if count == 0:
+            return 0.0
+        bucket = int(np.searchsorted(np.cumsum(self.counts), math.ceil(q / 100 * count)))
+        return float(self.BOUNDS_MS[min(bucket, len(self.BOUNDS_MS) - 1)])
+
+    def snapshot(self) -> dict:
+        count = int(self.counts.sum())
+        nonzero = np.flatnonzero(self.counts)
+        bounds = np.r_[self.BOUNDS_MS, np.inf]
+        return {
+            "count": count,
+            "mean_ms": self.total_ms / count if count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "buckets": [[float(bounds[i]) if np.isfinite(bounds[i]) else None, int(self.counts[i])] for i in nonzero]
+        }
+
+
+# ============================================================================
+# 3. HTTP
+# ============================================================================
+
+async def read_message(reader: asyncio.StreamReader):
+    """(start line, headers, body) of one HTTP/1.1 message, or None at end of stream."""
+    start_line = await reader.readline()
+    if not start_line:
+        return None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length") or 0))
+    return start_line.decode("latin-1").strip(), headers, body
+
+
+def encode_message(start_line: str, payload: dict, headers: dict = None) -> bytes:
+    """HTTP/1.1 message with a JSON body (keep-alive)."""
+    body = json.dumps(payload).encode()
+    lines = [start_line, "Content-Type: application/json", f"Content-Length: {len(body)}", "Connection: keep-alive"]
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+class RoutingService:
+    """
+    HTTP front end: parses requests, batches route/unpack requests, runs work on the executor.
+
+    Args:
+        graph_path: Binary graph directory (preferred) or shortcuts output
+        workers: Worker processes (0: one background thread in this process)
+        profile: Profile name of the graph in cache keys (default: graph directory name)
+    """
+
+    def __init__(self, graph_path: str, workers: int = config.SERVICE_WORKERS,
+                 batch_size: int = config.SERVICE_BATCH_SIZE,
+                 batch_wait_ms: float = config.SERVICE_BATCH_WAIT_MS, profile: str = None):
+        if workers > 0:
+            self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(graph_path,))
+            # Fork the workers now, before the listening socket exists (they must not inherit it)
+            self.executor.submit(int).result()
+        else:
+            init_worker(graph_path)
+            self.executor = ThreadPoolExecutor(max_workers=1)
+
+        self.edge_ids = np.asarray(ShortcutGraph.load(graph_path).edge_ids)
+        wait, in_flight = batch_wait_ms / 1e3, max(workers, 1)
+        self.route_batcher = MicroBatcher(self.executor, route_batch, batch_size, wait, in_flight)
+        self.unpack_batcher = MicroBatcher(self.executor, unpack_batch, batch_size, wait, in_flight)
+        self.profile = profile or Path(graph_path.rstrip("/")).name
+        self.cache = QueryCache()
+        self.histograms = {path: LatencyHistogram() for path in ("/route", "/matrix", "/unpack")}
+        self.rng = np.random.default_rng()
+        self.server = None
+
+    async def handle(self, method: str, path: str, query: dict, payload: dict) -> tuple:
+        """(status, response payload) of one request."""
+        if path == "/route" and method == "POST":
+            result = await self.route(int(payload["from_edge"]), int(payload["to_edge"]),
+                                      bool(payload.get("unpack", False)))
+        elif path == "/unpack" and method == "POST":
+            result = await self.unpack_batcher.submit([int(edge) for edge in payload["route"]])
+        elif path == "/matrix" and method == "POST":
+            matrix = await asyncio.get_running_loop().run_in_executor(
+                self.executor, matrix_task, [int(e) for e in payload["sources"]], [int(e) for e in payload["targets"]]
+            )
+            result = {"matrix": matrix}
+        elif path == "/edges" and method == "GET":
+            n = int(query.get("n", ["1000"])[0])
+            result = {"edges": self.edge_ids[self.rng.integers(0, len(self.edge_ids), n)].tolist()}
+        elif path == "/stats" and method == "GET":
+            result = {
+                "latency": {name: histogram.snapshot() for name, histogram in self.histograms.items()},
+                "batching": {"route": self.route_batcher.stats(), "unpack": self.unpack_batcher.stats()},
+                "cache": self.cache.stats()
+            }
+        elif path in self.histograms or path in ("/edges", "/stats"):
+            return 405, {"error": f"{method} not allowed on {path}"}
+        else:
+            return 404, {"error": f"Unknown path {path}"}
+
+        return (400 if "error" in result else 200), result
+
+    async def route(self, from_edge: int, to_edge: int, unpack: bool) -> dict:
+        """Route result from the cache, or from a route batch (then cached)."""
+        key = (from_edge, to_edge, self.profile)
+        result = self.cache.get(key, require="edges" if unpack else None)
+        if result is None:
+            generation = self.cache.generation
+            result = await self.route_batcher.submit((from_edge, to_edge, unpack))
+            if "error" not in result:
+                self.cache.put(key, result, generation)
+        if not unpack and "edges" in result:
+            result = {name: value for name, value in result.items() if name != "edges"}
+        return result
+
+    async def serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    message = await read_message(reader)
+                except ValueError as e:
+                    # Bad Content-Length: the next message cannot be found, so the connection is closed
+                    writer.write(encode_message(f"HTTP/1.1 400 {REASONS[400]}", {"error": f"Bad request: {e}"}))
+                    await writer.drain()
+                    break
+                if message is None:
+                    break
+                start_line, _, body = message
+                start = time.perf_counter()
+                path = None
+                try:
+                    parts = start_line.split(" ")
+                    if len(parts) < 2:
+                        raise ValueError(f"malformed request line {start_line!r}")
+                    method, target = parts[:2]
+                    url = urlsplit(target)
+                    path = url.path
+                    payload = json.loads(body) if body else {}
+                    status, result = await self.handle(method, path, parse_qs(url.query), payload)
+                except (ValueError, KeyError, TypeError) as e:
+                    status, result = 400, {"error": f"Bad request: {e}"}
+                except Exception as e:
+                    logger.error(f"Request failed: {e}")
+                    status, result = 500, {"error": str(e)}
+
+                writer.write(encode_message(f"HTTP/1.1 {status} {REASONS[status]}", result))
+                await writer.drain()
+                if path in self.histograms and status == 200:
+                    self.histograms[path].record(time.perf_counter() - start)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = config.SERVICE_HOST, port: int = config.SERVICE_PORT):
+        self.server = await asyncio.start_server(self.serve_connection, host, port)
+        return self.server
+
+    def close(self):
+        if self.server:
+            self.server.close()
+        self.executor.shutdown()
+
+
+# ============================================================================
+# MAIN EXECUTION
+# ============================================================================
+
+async def serve(graph_path: str):
+    service = RoutingService(graph_path)
+    server = await service.start()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, server.close)
+    logger.info(f"✓ Listening on http://{config.SERVICE_HOST}:{config.SERVICE_PORT}")
+    try:
+        async with server:
+            await server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        service.close()
+
+
+def main(graph_path: str = None):
+    """Serve the routing endpoints until interrupted."""
+    graph_path = graph_path or str(config.SHORTCUTS_OUTPUT_FILE).replace("_shortcuts", "_spark_hybrid")
+    log_section(logger, "ROUTING SERVICE")
+    log_dict(logger, {
+        "graph": graph_path,
+        "address": f"{config.SERVICE_HOST}:{config.SERVICE_PORT}",
+        "workers": config.SERVICE_WORKERS,
+        "batch_size": config.SERVICE_BATCH_SIZE,
+        "batch_wait_ms": config.SERVICE_BATCH_WAIT_MS
+    }, "Configuration")
+    try:
+        asyncio.run(serve(graph_path))
+    except KeyboardInterrupt:
+        logger.info("Shutting down...")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,158 @@
+"""
+shared_arrays.py
+================
+
+NumPy arrays in multiprocessing.shared_memory blocks, for process-pool
+cell workers.
+
+The owner publishes named arrays once (or re-publishes them in place when
+they change); workers receive only a small spec dictionary and attach to
+the blocks zero-copy, so tasks are just index ranges. Worker results are
+written to fresh blocks and returned as specs as well.
+
+Key features:
+- SharedArrayStore: named arrays with capacity reuse (no re-attach while
+  an updated array still fits its block)
+- attach_arrays: cached, zero-copy worker-side views
+- export_columns / import_columns: column results through shared memory
+"""
+
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+
+def _attach_block(shm_name: str) -> shared_memory.SharedMemory:
+    """Attach to an existing block without taking ownership of it."""
+    try:
+        # Python 3.13+: do not let this process's resource tracker unlink the block
+        return shared_memory.SharedMemory(name=shm_name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=shm_name)
+
+
+def _release(block: shared_memory.SharedMemory):
+    """Unlink an owned block; the mapping stays valid while views still use it."""
+    try:
+        block.close()
+    except BufferError:
+        pass
+    block.unlink()
+
+
+# ============================================================================
+# 1. OWNER SIDE
+# ============================================================================
+
+class SharedArrayStore:
+    """
+    Named NumPy arrays backed by shared memory blocks owned by this process.
+
+    put() copies an array into its block, reusing the block when the new
+    data fits (capacity grows by doubling otherwise). specs() describes the
+    current arrays for attach_arrays() in workers.
+    """
+
+    def __init__(self):
+        self._blocks = {}
+        self._specs = {}
+        # Workers forked after this point share the owner's resource tracker
+        # (otherwise each starts its own and unlinks attached blocks on exit)
+        resource_tracker.ensure_running()
+
+    def put(self, name: str, array: np.ndarray) -> np.ndarray:
+        """Publish array under name and return the shared view."""
+        array = np.ascontiguousarray(array)
+        block = self._blocks.get(name)
+
+        if block is None or block.size < array.nbytes or self._specs[name][2] != array.dtype.str:
+            if block is not None:
+                _release(block)
+            capacity = max(array.nbytes, 2 * block.size if block is not None else 0, 1)
+            block = shared_memory.SharedMemory(create=True, size=capacity)
+            self._blocks[name] = block
+
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+        view[...] = array
+        self._specs[name] = (block.name, array.shape, array.dtype.str)
+        return view
+
+    def get(self, name: str) -> np.ndarray:
+        """Shared view of a published array."""
+        shm_name, shape, dtype = self._specs[name]
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=self._blocks[name].buf)
+
+    def specs(self, names: list = None) -> dict:
+        """Picklable {name: (block name, shape, dtype)} of the published arrays."""
+        names = self._specs.keys() if names is None else names
+        return {name: self._specs[name] for name in names}
+
+    def close(self):
+        """Release and unlink all blocks."""
+        for block in self._blocks.values():
+            _release(block)
+        self._blocks.clear()
+        self._specs.clear()
+
+
+# ============================================================================
+# 2. WORKER SIDE
+# ============================================================================
+
+# Blocks attached by this worker process, by block name
+_ATTACHED = {}
+
+
+def attach_arrays(specs: dict) -> dict:
+    """Zero-copy views of the arrays described by specs (blocks cached per process)."""
+    arrays = {}
+    for name, (shm_name, shape, dtype) in specs.items():
+        block = _ATTACHED.get(shm_name)
+        if block is None:
+            block = _attach_block(shm_name)
+            _ATTACHED[shm_name] = block
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    return arrays
+
+
+def export_columns(columns: dict):
+    """
+    Write equal-length 1-D columns into one new block (worker result).
+
+    Returns:
+        (block name, n_rows, [(column, dtype), ...]) or None for empty results;
+        the receiver must call import_columns, which unlinks the block
+    """
+    n_rows = len(next(iter(columns.values())))
+    if n_rows == 0:
+        return None
+
+    layout = [(name, np.asarray(values).dtype.str) for name, values in columns.items()]
+    size = sum(np.dtype(dtype).itemsize for _, dtype in layout) * n_rows
+    block = shared_memory.SharedMemory(create=True, size=size)
+
+    offset = 0
+    for name, dtype in layout:
+        view = np.ndarray(n_rows, dtype=np.dtype(dtype), buffer=block.buf, offset=offset)
+        view[...] = columns[name]
+        offset += view.nbytes
+
+    block.close()
+    return block.name, n_rows, layout
+
+
+def import_columns(spec) -> dict:
+    """Copy the columns of an export_columns block and unlink it."""
+    shm_name, n_rows, layout = spec
+    block = shared_memory.SharedMemory(name=shm_name)
+
+    columns = {}
+    offset = 0
+    for name, dtype in layout:
+        view = np.ndarray(n_rows, dtype=np.dtype(dtype), buffer=block.buf, offset=offset)
+        columns[name] = view.copy()
+        offset += view.nbytes
+
+    block.close()
+    block.unlink()
+    return columns
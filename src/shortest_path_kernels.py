@@ -0,0 +1,522 @@
+"""
+shortest_path_kernels.py
+========================
+
+Per-cell shortest path kernels (pandas in, pandas out).
+
+Each kernel takes the active shortcuts of ONE cell (from_edge, to_edge,
+via_edge, cost) and returns the shortest paths between the edges of that
+cell in the same schema. They are used by Spark's applyInPandas and can be
+called directly on pandas DataFrames.
+
+Key features:
+- Sparse, source-restricted Dijkstra: only edges with outgoing shortcuts
+  are used as sources, and results are produced in bounded source chunks
+  (no dense n x n distance/predecessor matrices)
+- Optional boundary-only emission: only pairs between edges that cross the
+  cell boundary (lca_res < cell resolution) are emitted
+- Vectorized dense min-plus (Floyd-Warshall) kernel for tiny cells, and a
+  size-based dispatcher between the dense and sparse kernels
+- Benchmark-based calibration of the engine size thresholds
+- Source-block decomposition of one cell, so a giant cell can be spread
+  over several workers (see distributed_apsp.py)
+- Kernels on prepared cell graphs (CellGraph.from_arrays), for replaying
+  recorded cell structures with new costs (see customization.py)
+- Multi-profile kernel: one cell graph, one cost/via column pair per profile
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from logging_config import get_logger, log_section, log_dict
+
+logger = get_logger(__name__)
+
+
+OUTPUT_COLUMNS = ['from_edge', 'to_edge', 'via_edge', 'cost']
+
+# Per-profile cost and via columns of multi-profile tables: cost_<profile>, via_<profile>
+PROFILE_COST_PREFIX = 'cost_'
+PROFILE_VIA_PREFIX = 'via_'
+
+# Upper bound on distance/predecessor entries held at once per cell
+# (4M entries = 32 MB of float64 distances + 16 MB of int32 predecessors)
+DEFAULT_CHUNK_ENTRIES = 4_000_000
+
+
+def empty_result() -> pd.DataFrame:
+    """Empty kernel output with the expected columns."""
+    return pd.DataFrame(columns=OUTPUT_COLUMNS)
+
+
+# ============================================================================
+# 1. CELL GRAPH CONSTRUCTION
+# ============================================================================
+
+class CellGraph:
+    """
+    Sparse graph of one cell, with edges mapped to local node indices.
+
+    Attributes:
+        nodes: Edge IDs, indexed by local node index
+        graph: CSR matrix of minimum shortcut costs
+        src, dst, costs: Local indices and costs of the (deduplicated) input shortcuts
+        direct_keys: Sorted src * n + dst keys of the input shortcuts
+        direct_vias: via_edge of the input shortcuts, aligned with direct_keys
+        node_lca: lca_res per node (None when the input has no lca columns)
+        rows: Input row of each (deduplicated) shortcut (None for from_arrays)
+    """
+
+    def __init__(self, pdf: pd.DataFrame):
+        # Map nodes to indices (plain NumPy: this runs once per cell)
+        n_rows = len(pdf)
+        self.nodes, inverse = np.unique(
+            np.concatenate([pdf['from_edge'].to_numpy(), pdf['to_edge'].to_numpy()]),
+            return_inverse=True
+        )
+        self.n_nodes = len(self.nodes)
+        src = inverse[:n_rows].astype(np.int64)
+        dst = inverse[n_rows:].astype(np.int64)
+        costs = pdf['cost'].to_numpy(dtype=np.float64)
+
+        # Deduplicate and keep minimum cost (rows sorted by key, then cost)
+        keys = src * self.n_nodes + dst
+        order = np.lexsort((costs, keys))
+        first = np.ones(n_rows, dtype=bool)
+        first[1:] = keys[order][1:] != keys[order][:-1]
+        order = order[first]
+        self.rows = order
+
+        # lca_res per node, when the partition carries the edge lca columns
+        node_lca = None
+        if 'lca_in' in pdf.columns and 'lca_out' in pdf.columns:
+            node_lca = np.empty(self.n_nodes, dtype=np.int64)
+            node_lca[src] = pdf['lca_in'].to_numpy()
+            node_lca[dst] = pdf['lca_out'].to_numpy()
+
+        self._set_arrays(src[order], dst[order], costs[order], pdf['via_edge'].to_numpy()[order], node_lca)
+
+    @classmethod
+    def from_arrays(cls, nodes, src, dst, costs, vias, node_lca=None) -> "CellGraph":
+        """
+        Cell graph from prepared arrays (no deduplication).
+
+        Args:
+            nodes: Sorted unique edge IDs
+            src, dst: Local node indices, unique pairs sorted by (src, dst)
+            costs, vias: Cost and via_edge of each pair
+            node_lca: Optional lca_res per node (boundary mode)
+        """
+        cell = cls.__new__(cls)
+        cell.nodes = nodes
+        cell.n_nodes = len(nodes)
+        cell.rows = None
+        cell._set_arrays(src, dst, costs, vias, node_lca)
+        return cell
+
+    def _set_arrays(self, src, dst, costs, vias, node_lca):
+        self.src = src
+        self.dst = dst
+        self.costs = costs
+        self.node_lca = node_lca
+
+        # Build graph matrix
+        self.graph = csr_matrix((self.costs, (self.src, self.dst)), shape=(self.n_nodes, self.n_nodes))
+
+        # Sorted lookup of via_edges for direct paths
+        self.direct_keys = src * self.n_nodes + dst
+        self.direct_vias = vias
+
+    def sources(self) -> np.ndarray:
+        """Local indices of nodes that can start a shortcut (out-degree > 0)."""
+        return np.unique(self.src)
+
+    def boundary_mask(self, cell_res: int) -> np.ndarray:
+        """
+        Nodes that cross the boundary of a cell at cell_res (lca_res < cell_res).
+
+        Every edge of an active shortcut has lca_res <= cell_res; edges with
+        lca_res == cell_res are strictly inside the cell.
+        """
+        if self.node_lca is None:
+            raise ValueError("Boundary mode needs lca_in/lca_out columns in the partition")
+        return self.node_lca < cell_res
+
+    def direct_via(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        """via_edge of the input shortcuts rows -> cols (must exist)."""
+        pos = np.searchsorted(self.direct_keys, rows * self.n_nodes + cols)
+        return self.direct_vias[pos]
+
+
+# ============================================================================
+# 2. SPARSE SOURCE-RESTRICTED DIJKSTRA
+# ============================================================================
+
+def sparse_shortest_paths(
+    pdf: pd.DataFrame,
+    chunk_entries: int = DEFAULT_CHUNK_ENTRIES,
+    boundary_res: int = None
+) -> pd.DataFrame:
+    """
+    Shortest paths within one cell using Dijkstra from restricted sources.
+
+    Sources are processed in chunks of at most chunk_entries / n rows, so the
+    dense working arrays stay bounded; only reachable pairs are kept.
+
+    With boundary_res set, only pairs whose edges both cross the boundary of
+    the cell at that resolution are computed and emitted: these are the only
+    pairs that become active again at coarser resolutions of the forward pass.
+    Paths may still pass through interior edges.
+
+    via_edge is the input via_edge for direct paths, otherwise the
+    predecessor of to_edge on the path.
+
+    Args:
+        pdf: Active shortcuts of one cell (from_edge, to_edge, via_edge, cost)
+        chunk_entries: Max distance entries computed per Dijkstra call
+        boundary_res: Cell resolution for boundary-only emission (None = all pairs);
+                      requires lca_in/lca_out columns
+
+    Returns:
+        DataFrame (from_edge, to_edge, via_edge, cost) without self-loops
+    """
+    if len(pdf) == 0:
+        return empty_result()
+    return _sparse_cell_paths(CellGraph(pdf), chunk_entries, boundary_res)
+
+
+def _sparse_cell_paths(cell: CellGraph, chunk_entries: int, boundary_res: int = None) -> pd.DataFrame:
+    """Sparse kernel on a built cell graph."""
+    sources, target_mask = _restricted_sources(cell, boundary_res)
+    return _sources_shortest_paths(cell, sources, target_mask, chunk_entries)
+
+
+def block_shortest_paths(
+    pdf: pd.DataFrame,
+    block: int,
+    num_blocks: int,
+    chunk_entries: int = DEFAULT_CHUNK_ENTRIES,
+    boundary_res: int = None
+) -> pd.DataFrame:
+    """
+    Rows of one source block of a cell's shortest path matrix.
+
+    The restricted sources are split into num_blocks strided blocks, so the
+    blocks 0..num_blocks-1 together give exactly sparse_shortest_paths(pdf)
+    and can be computed independently (e.g. on different executors).
+
+    Args:
+        pdf: Active shortcuts of one cell (from_edge, to_edge, via_edge, cost)
+        block: Block index in [0, num_blocks)
+        num_blocks: Total number of source blocks
+        chunk_entries: Max distance entries computed per Dijkstra call
+        boundary_res: Cell resolution for boundary-only emission (None = all pairs)
+
+    Returns:
+        DataFrame (from_edge, to_edge, via_edge, cost) for the block's sources
+    """
+    if len(pdf) == 0:
+        return empty_result()
+
+    cell = CellGraph(pdf)
+    sources, target_mask = _restricted_sources(cell, boundary_res)
+    return _sources_shortest_paths(cell, sources[block::num_blocks], target_mask, chunk_entries)
+
+
+def _restricted_sources(cell: CellGraph, boundary_res: int = None) -> tuple:
+    """Sources to run Dijkstra from, and the target mask (None = all targets)."""
+    sources = cell.sources()
+    target_mask = None
+    if boundary_res is not None:
+        target_mask = cell.boundary_mask(boundary_res)
+        sources = sources[target_mask[sources]]
+    return sources, target_mask
+
+
+def _sources_shortest_paths(
+    cell: CellGraph,
+    sources: np.ndarray,
+    target_mask: np.ndarray,
+    chunk_entries: int
+) -> pd.DataFrame:
+    """Run Dijkstra from sources in bounded chunks and concatenate the rows."""
+    rows_per_chunk = max(1, chunk_entries // max(cell.n_nodes, 1))
+
+    results = []
+    for start in range(0, len(sources), rows_per_chunk):
+        chunk_sources = sources[start:start + rows_per_chunk]
+        chunk = _dijkstra_chunk(cell, chunk_sources, target_mask)
+        if chunk is not None:
+            results.append(chunk)
+
+    if not results:
+        return empty_result()
+
+    return pd.concat(results, ignore_index=True)
+
+
+def _dijkstra_chunk(cell: CellGraph, chunk_sources: np.ndarray, target_mask: np.ndarray = None):
+    """Run Dijkstra from chunk_sources and convert reachable pairs to rows."""
+    dist, pred = dijkstra(
+        csgraph=cell.graph,
+        directed=True,
+        indices=chunk_sources,
+        return_predecessors=True
+    )
+    return _paths_to_frame(cell, chunk_sources, dist, pred, target_mask)
+
+
+def _paths_to_frame(
+    cell: CellGraph,
+    chunk_sources: np.ndarray,
+    dist: np.ndarray,
+    pred: np.ndarray,
+    target_mask: np.ndarray = None
+):
+    """Convert distance/predecessor rows of chunk_sources to output rows (None if empty)."""
+    valid_mask = (dist != np.inf)
+    if target_mask is not None:
+        valid_mask &= target_mask[np.newaxis, :]
+    rows, cols = np.nonzero(valid_mask)
+    global_rows = chunk_sources[rows]
+
+    # Filter self-loops
+    non_loop_mask = (global_rows != cols)
+    rows = rows[non_loop_mask]
+    cols = cols[non_loop_mask]
+    global_rows = global_rows[non_loop_mask]
+
+    if len(rows) == 0:
+        return None
+
+    chunk_costs = dist[rows, cols]
+    chunk_preds = pred[rows, cols]
+
+    # Determine via_edge
+    is_direct = (chunk_preds == global_rows)
+    final_vias = cell.nodes[np.where(is_direct, 0, chunk_preds)]
+    final_vias[is_direct] = cell.direct_via(global_rows[is_direct], cols[is_direct])
+
+    return pd.DataFrame({
+        'from_edge': cell.nodes[global_rows],
+        'to_edge': cell.nodes[cols],
+        'via_edge': final_vias,
+        'cost': chunk_costs
+    })
+
+
+# ============================================================================
+# 3. DENSE MIN-PLUS KERNEL (TINY CELLS)
+# ============================================================================
+
+def dense_shortest_paths(pdf: pd.DataFrame, boundary_res: int = None) -> pd.DataFrame:
+    """
+    Shortest paths within one tiny cell using vectorized Floyd-Warshall.
+
+    Each of the n iterations is a min-plus rank-1 update over the whole n x n
+    matrix, which avoids per-source Python/Dijkstra overhead for small n.
+    Output and via_edge convention match sparse_shortest_paths.
+
+    Args:
+        pdf: Active shortcuts of one cell (from_edge, to_edge, via_edge, cost)
+        boundary_res: Cell resolution for boundary-only emission (None = all pairs)
+
+    Returns:
+        DataFrame (from_edge, to_edge, via_edge, cost) without self-loops
+    """
+    if len(pdf) == 0:
+        return empty_result()
+    return _dense_cell_paths(CellGraph(pdf), boundary_res)
+
+
+def _dense_cell_paths(cell: CellGraph, boundary_res: int = None) -> pd.DataFrame:
+    """Dense kernel on a built cell graph."""
+    n = cell.n_nodes
+
+    dist = np.full((n, n), np.inf)
+    dist[cell.src, cell.dst] = cell.costs
+    pred = np.full((n, n), -9999, dtype=np.int64)
+    pred[cell.src, cell.dst] = cell.src
+
+    for k in range(n):
+        candidate = dist[:, k:k + 1] + dist[k:k + 1, :]
+        better = candidate < dist
+        if not better.any():
+            continue
+        dist = np.where(better, candidate, dist)
+        pred = np.where(better, pred[k:k + 1, :], pred)
+
+    sources, target_mask = _restricted_sources(cell, boundary_res)
+    result = _paths_to_frame(cell, sources, dist[sources], pred[sources], target_mask)
+    return empty_result() if result is None else result
+
+
+# ============================================================================
+# 4. SIZE-BASED KERNEL DISPATCH
+# ============================================================================
+
+def count_cell_nodes(pdf: pd.DataFrame) -> int:
+    """Number of distinct edges (graph nodes) in one cell partition."""
+    return len(np.unique(np.concatenate([pdf['from_edge'].to_numpy(), pdf['to_edge'].to_numpy()])))
+
+
+def auto_shortest_paths(
+    pdf: pd.DataFrame,
+    dense_max_nodes: int,
+    chunk_entries: int = DEFAULT_CHUNK_ENTRIES,
+    boundary_res: int = None
+) -> pd.DataFrame:
+    """Dense kernel for cells with at most dense_max_nodes nodes, sparse Dijkstra otherwise."""
+    if len(pdf) == 0:
+        return empty_result()
+    return cell_shortest_paths(CellGraph(pdf), dense_max_nodes, chunk_entries, boundary_res)
+
+
+def cell_shortest_paths(
+    cell: CellGraph,
+    dense_max_nodes: int,
+    chunk_entries: int = DEFAULT_CHUNK_ENTRIES,
+    boundary_res: int = None
+) -> pd.DataFrame:
+    """Size-dispatched kernel on a built cell graph (e.g. CellGraph.from_arrays)."""
+    if cell.n_nodes <= dense_max_nodes:
+        return _dense_cell_paths(cell, boundary_res)
+    return _sparse_cell_paths(cell, chunk_entries, boundary_res)
+
+
+def profile_columns(profiles: list) -> tuple:
+    """(cost columns, via columns) of the given profile names."""
+    return (
+        [PROFILE_COST_PREFIX + name for name in profiles],
+        [PROFILE_VIA_PREFIX + name for name in profiles]
+    )
+
+
+def profile_shortest_paths(
+    pdf: pd.DataFrame,
+    profiles: list,
+    dense_max_nodes: int,
+    chunk_entries: int = DEFAULT_CHUNK_ENTRIES,
+    boundary_res: int = None
+) -> pd.DataFrame:
+    """
+    Shortest paths of one cell for several cost profiles.
+
+    The cell graph (node mapping, deduplicated pairs, boundary mask) is built
+    once and each profile runs the size-dispatched kernel on its own costs.
+    Pairs reachable in only some profiles get cost inf and via -1 in the
+    others.
+
+    Args:
+        pdf: Active shortcuts of one cell (from_edge, to_edge, cost_<p>, via_<p>
+             for every profile, and lca_in/lca_out for boundary mode)
+
+    Returns:
+        DataFrame (from_edge, to_edge, cost_<p>..., via_<p>...)
+    """
+    cost_columns, via_columns = profile_columns(profiles)
+    if len(pdf) == 0:
+        return pd.DataFrame(columns=['from_edge', 'to_edge', *cost_columns, *via_columns])
+
+    base = CellGraph(pdf.assign(cost=pdf[cost_columns[0]], via_edge=pdf[via_columns[0]]))
+
+    result = None
+    for cost_column, via_column in zip(cost_columns, via_columns):
+        cell = CellGraph.from_arrays(
+            base.nodes, base.src, base.dst,
+            pdf[cost_column].to_numpy(dtype=np.float64)[base.rows],
+            pdf[via_column].to_numpy()[base.rows],
+            base.node_lca
+        )
+        paths = cell_shortest_paths(cell, dense_max_nodes, chunk_entries, boundary_res).rename(
+            columns={'cost': cost_column, 'via_edge': via_column}
+        )
+        result = paths if result is None else result.merge(paths, on=['from_edge', 'to_edge'], how='outer')
+
+    result[cost_columns] = result[cost_columns].fillna(np.inf)
+    result[via_columns] = result[via_columns].fillna(-1).astype(np.int64)
+    return result[['from_edge', 'to_edge', *cost_columns, *via_columns]]
+
+
+# ============================================================================
+# 5. THRESHOLD CALIBRATION
+# ============================================================================
+
+def random_cell(n_nodes: int, out_degree: int = 3, seed: int = 0) -> pd.DataFrame:
+    """Synthetic road-like cell: each node links to out_degree random nodes."""
+    rng = np.random.default_rng(seed)
+    src = np.repeat(np.arange(n_nodes), out_degree)
+    dst = rng.integers(0, n_nodes, size=len(src))
+    keep = src != dst
+    return pd.DataFrame({
+        'from_edge': src[keep],
+        'to_edge': dst[keep],
+        'via_edge': dst[keep],
+        'cost': rng.uniform(1.0, 60.0, size=keep.sum())
+    })
+
+
+def _time_kernel(kernel, pdf: pd.DataFrame, repeats: int) -> float:
+    """Best-of-repeats wall time of kernel(pdf), in seconds."""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        kernel(pdf)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def calibrate_kernel_thresholds(
+    sizes: tuple = (8, 16, 32, 64, 128, 256, 512, 1024, 2048),
+    out_degree: int = 3,
+    repeats: int = 3,
+    max_cell_seconds: float = 60.0
+) -> dict:
+    """
+    Benchmark the local kernels on synthetic cells to calibrate engine thresholds.
+
+    - dense_max_nodes: largest benchmarked size where the dense kernel beats
+      sparse Dijkstra
+    - scipy_max_nodes: size at which sparse Dijkstra is projected to exceed
+      max_cell_seconds in one worker (fit of time ~ n^2 on the largest sizes);
+      larger cells should go to the distributed engine
+
+    Returns:
+        Dict with dense_max_nodes, scipy_max_nodes and the raw timings
+    """
+    timings = []
+    dense_max_nodes = 0
+    for n in sizes:
+        pdf = random_cell(n, out_degree)
+        sparse_time = _time_kernel(sparse_shortest_paths, pdf, repeats)
+        dense_time = _time_kernel(dense_shortest_paths, pdf, repeats) if n <= 512 else float('inf')
+        timings.append({'nodes': n, 'dense_s': dense_time, 'sparse_s': sparse_time})
+        if dense_time < sparse_time:
+            dense_max_nodes = n
+
+    # Sparse Dijkstra from all sources is ~ n * m log n with m ~ n: fit t = a * n^2
+    largest = timings[-1]
+    coef = largest['sparse_s'] / float(largest['nodes']) ** 2
+    scipy_max_nodes = int(np.sqrt(max_cell_seconds / coef)) if coef > 0 else sizes[-1]
+
+    return {
+        'dense_max_nodes': dense_max_nodes,
+        'scipy_max_nodes': max(scipy_max_nodes, dense_max_nodes),
+        'timings': timings
+    }
+
+
+if __name__ == "__main__":
+    log_section(logger, "KERNEL THRESHOLD CALIBRATION")
+    result = calibrate_kernel_thresholds()
+    for row in result['timings']:
+        logger.info(f"  {row['nodes']:>6} nodes: dense {row['dense_s']:.5f}s, sparse {row['sparse_s']:.5f}s")
+    log_dict(logger, {
+        "DENSE_MAX_NODES": result['dense_max_nodes'],
+        "SCIPY_MAX_NODES": result['scipy_max_nodes']
+    }, "Thresholds")
+    log_section(logger, "COMPLETED")
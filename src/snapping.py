@@ -0,0 +1,320 @@
+"""
+snapping.py
+===========
+
+Coordinate-to-edge snapping with an H3 cell index.
+
+The index is built once from the edges file: every edge is split into
+straight segments (its WKT geometry column when present, else the line
+between the centers of its from_cell and to_cell), each segment is
+registered in the H3 cells (SNAP_RESOLUTION) it passes through and in their
+neighbours (one ring), and the (cell, segment) pairs are stored as a CSR
+over sorted cells. A point is snapped by:
+1. mapping it to its H3 cell at the index resolution
+2. taking the segments of that cell (its own and the neighbouring cells' segments)
+3. computing point-to-segment distances for all candidates at once, in a
+   local planar projection (meters), and keeping the nearest per point
+
+A segment passing within a quarter of the cell edge length of the point is
+always a candidate, so a nearest candidate within that radius is the
+nearest edge. Points with no candidate that close go to a coarser index
+(COARSE_STEP resolutions up; each resolution step scales the edge length by
+about sqrt(7), so the radius grows about 7 times) and, if still too far
+from the road network, to a scan of all segments, so results always equal
+the brute-force scan.
+
+Usage:
+    python snapping.py [edges_file] [n_points]   # throughput and check against the brute-force scan
+"""
+
+import math
+import sys
+import time
+
+import h3
+import numpy as np
+import pandas as pd
+
+from logging_config import get_logger, log_section, log_dict
+from binary_graph import csr_offsets, csr_positions
+import config
+
+logger = get_logger(__name__)
+
+EARTH_RADIUS_M = 6_371_008.8
+
+# Segments are sampled at this fraction of the cell edge length, and a
+# candidate within this fraction of it is known to be the nearest edge
+SAMPLE_SPACING = 0.25
+EXACT_RADIUS = 0.25
+
+# Resolution step to the fallback index for points far from the network
+COARSE_STEP = 2
+
+
+# ============================================================================
+# 1. GEOMETRY
+# ============================================================================
+
+def cell_latlng(cells: np.ndarray) -> tuple:
+    """(lat, lon) arrays of the centers of H3 cells given as integers."""
+    points = [h3.cell_to_latlng(h3.int_to_str(int(cell))) for cell in cells]
+    lat, lon = np.array(points, dtype=np.float64).reshape(-1, 2).T
+    return lat, lon
+
+
+def latlng_cells(lat: np.ndarray, lon: np.ndarray, resolution: int) -> np.ndarray:
+    """H3 cells (integers) of points at a resolution."""
+    return np.array([h3.str_to_int(h3.latlng_to_cell(a, b, resolution)) for a, b in zip(lat.tolist(), lon.tolist())],
+                    dtype=np.int64)
+
+
+def parse_linestring(wkt) -> list:
+    """[(lon, lat), ...] of a WKT LINESTRING, or [] when it cannot be parsed."""
+    if not isinstance(wkt, str) or "(" not in wkt:
+        return []
+    try:
+        body = wkt[wkt.index("(") + 1:wkt.rindex(")")]
+        return [tuple(float(value) for value in point.split()[:2]) for point in body.split(",")]
+    except ValueError:
+        return []
+
+
+class LocalProjection:
+    """Equirectangular projection to meters around a reference latitude (district scale)."""
+
+    def __init__(self, lat0: float):
+        self.scale_x = EARTH_RADIUS_M * math.radians(1.0) * math.cos(math.radians(lat0))
+        self.scale_y = EARTH_RADIUS_M * math.radians(1.0)
+
+    def forward(self, lat: np.ndarray, lon: np.ndarray) -> tuple:
+        return np.asarray(lon) * self.scale_x, np.asarray(lat) * self.scale_y
+
+    def inverse(self, x: np.ndarray, y: np.ndarray) -> tuple:
+        return np.asarray(y) / self.scale_y, np.asarray(x) / self.scale_x
+
+
+def point_segment_distance(px, py, ax, ay, bx, by) -> tuple:
+    """(distance, fraction along the segment) of points to segments, elementwise."""
+    dx, dy = bx - ax, by - ay
+    length_sq = dx * dx + dy * dy
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.where(length_sq > 0, ((px - ax) * dx + (py - ay) * dy) / length_sq, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    return np.hypot(ax + t * dx - px, ay + t * dy - py), t
+
+
+# ============================================================================
+# 2. SNAPPING INDEX
+# ============================================================================
+
+class SnapIndex:
+    """
+    Nearest-edge lookup for coordinates.
+
+    Args:
+        edge_ids: Edge ID of each edge position
+        segment_edges: Edge position of each segment
+        segment_coords: (lat_a, lon_a, lat_b, lon_b) arrays of the segments
+        resolution: H3 resolution of the cell index
+        coarse_levels: Coarser indexes (COARSE_STEP resolutions apart) tried
+            for far points before the scan of all segments
+    """
+
+    def __init__(self, edge_ids: np.ndarray, segment_edges: np.ndarray, segment_coords: tuple,
+                 resolution: int = config.SNAP_RESOLUTION, coarse_levels: int = 1):
+        self.edge_ids = np.asarray(edge_ids, dtype=np.int64)
+        self.segment_edges = np.asarray(segment_edges, dtype=np.int64)
+        self.resolution = resolution
+        lat_a, lon_a, lat_b, lon_b = (np.asarray(values, dtype=np.float64) for values in segment_coords)
+
+        self.projection = LocalProjection(float(np.mean(np.r_[lat_a, lat_b])))
+        self.ax, self.ay = self.projection.forward(lat_a, lon_a)
+        self.bx, self.by = self.projection.forward(lat_b, lon_b)
+
+        edge_length_m = h3.average_hexagon_edge_length(resolution, unit="m")
+        self.exact_radius = EXACT_RADIUS * edge_length_m
+        self._build_cells(SAMPLE_SPACING * edge_length_m)
+
+        self.coarse = None
+        if coarse_levels > 0 and resolution >= COARSE_STEP:
+            self.coarse = SnapIndex(edge_ids, segment_edges, segment_coords, resolution - COARSE_STEP, coarse_levels - 1)
+
+    def _build_cells(self, spacing: float):
+        """CSR of segments per cell: samples along each segment, then one ring around their cells."""
+        lengths = np.hypot(self.bx - self.ax, self.by - self.ay)
+        n_samples = np.ceil(lengths / spacing).astype(np.int64) + 1
+        segments = np.repeat(np.arange(len(lengths)), n_samples)
+        steps = np.arange(len(segments)) - np.repeat(np.cumsum(n_samples) - n_samples, n_samples)
+        t = steps / np.repeat(n_samples - 1, n_samples).clip(min=1)
+        lat, lon = self.projection.inverse(self.ax[segments] + t * (self.bx - self.ax)[segments],
+                                           self.ay[segments] + t * (self.by - self.ay)[segments])
+
+        pairs = np.unique(np.stack([latlng_cells(lat, lon, self.resolution), segments], axis=1), axis=0)
+        covered, inverse = np.unique(pairs[:, 0], return_inverse=True)
+        disks = np.array([self._disk(cell) for cell in covered.tolist()], dtype=np.int64)
+        pairs = np.unique(np.stack([disks[inverse].ravel(), np.repeat(pairs[:, 1], disks.shape[1])], axis=1), axis=0)
+
+        self.cells, cell_index = np.unique(pairs[:, 0], return_inverse=True)
+        self.cell_offsets = csr_offsets(cell_index, len(self.cells))
+        self.cell_segments = pairs[:, 1]
+
+    @staticmethod
+    def _disk(cell: int) -> list:
+        """The cell and its neighbours (7 entries; a pentagon repeats itself)."""
+        disk = [h3.str_to_int(c) for c in h3.grid_disk(h3.int_to_str(cell), 1)]
+        return disk + [cell] * (7 - len(disk))
+
+    @classmethod
+    def load(cls, edges_file: str = None, resolution: int = config.SNAP_RESOLUTION) -> "SnapIndex":
+        """Build the index from an edges file (id or edge_index, from_cell, to_cell, optional geometry)."""
+        edges = pd.read_csv(edges_file or config.EDGES_FILE)
+        if "edge_index" in edges.columns and "id" not in edges.columns:
+            edges = edges.rename(columns={"edge_index": "id"})
+
+        from_lat, from_lon = cell_latlng(edges["from_cell"].values)
+        to_lat, to_lon = cell_latlng(edges["to_cell"].values)
+        lines = edges["geometry"].map(parse_linestring) if "geometry" in edges.columns else None
+
+        segment_edges, coords = [], []
+        for i in range(len(edges)):
+            line = lines.iat[i] if lines is not None else []
+            if len(line) < 2:
+                line = [(from_lon[i], from_lat[i]), (to_lon[i], to_lat[i])]
+            for (lon_a, lat_a), (lon_b, lat_b) in zip(line[:-1], line[1:]):
+                segment_edges.append(i)
+                coords.append((lat_a, lon_a, lat_b, lon_b))
+
+        return cls(edges["id"].values, segment_edges, tuple(np.array(coords, dtype=np.float64).T), resolution)
+
+    @property
+    def n_segments(self) -> int:
+        return len(self.segment_edges)
+
+    def snap(self, lat: float, lon: float) -> dict:
+        """Nearest edge of one coordinate: {"edge", "distance" (m), "fraction" (along the segment)}."""
+        result = self.snap_many([lat], [lon])
+        return {"edge": int(result["edges"][0]), "distance": float(result["distances"][0]),
+                "fraction": float(result["fractions"][0])}
+
+    def snap_many(self, lat, lon) -> dict:
+        """
+        Nearest edges of many coordinates (vectorized over all candidates).
+
+        Returns:
+            {"edges" (IDs), "distances" (m), "fractions" (position along the nearest segment)}
+        """
+        segment, distance, fraction = self._snap_segments(np.asarray(lat, dtype=np.float64),
+                                                          np.asarray(lon, dtype=np.float64))
+        return {"edges": self.edge_ids[self.segment_edges[segment]], "distances": distance, "fractions": fraction}
+
+    def _snap_segments(self, lat: np.ndarray, lon: np.ndarray) -> tuple:
+        """(segment, distance, fraction) of the nearest segment of each point."""
+        px, py = self.projection.forward(lat, lon)
+        n = len(px)
+
+        # Candidate segments of each point's cell
+        cells = latlng_cells(lat, lon, self.resolution)
+        pos = np.minimum(np.searchsorted(self.cells, cells), len(self.cells) - 1)
+        indexed = np.flatnonzero(self.cells[pos] == cells)
+        positions, counts = csr_positions(self.cell_offsets, pos[indexed])
+        points = np.repeat(indexed, counts)
+        segments = self.cell_segments[positions]
+
+        distances, fractions = point_segment_distance(px[points], py[points], self.ax[segments],
+                                                      self.ay[segments], self.bx[segments], self.by[segments])
+
+        # Nearest candidate per point (candidates are grouped by point): the
+        # first candidate of each group at the group minimum
+        best_segment = np.full(n, -1, dtype=np.int64)
+        best_distance = np.full(n, np.inf)
+        best_fraction = np.zeros(n)
+        counts = counts[counts > 0]
+        if len(counts):
+            starts = np.cumsum(counts) - counts
+            minimum = np.repeat(np.minimum.reduceat(distances, starts), counts)
+            at_minimum = np.flatnonzero(distances == minimum)
+            first = at_minimum[np.r_[True, points[at_minimum][1:] != points[at_minimum][:-1]]]
+            best_segment[points[first]] = segments[first]
+            best_distance[points[first]] = distances[first]
+            best_fraction[points[first]] = fractions[first]
+
+        # Points without a candidate inside the exact radius: coarser index, then all segments
+        far = np.flatnonzero(best_distance > self.exact_radius)
+        if len(far):
+            if self.coarse is not None:
+                segment, distance, fraction = self.coarse._snap_segments(lat[far], lon[far])
+            else:
+                segment, distance, fraction = self._scan(px[far], py[far])
+            best_segment[far], best_distance[far], best_fraction[far] = segment, distance, fraction
+
+        return best_segment, best_distance, best_fraction
+
+    def _scan(self, px: np.ndarray, py: np.ndarray, chunk_pairs: int = 4_000_000) -> tuple:
+        """(segment, distance, fraction) of the nearest segment of each point over all segments."""
+        segment = np.empty(len(px), dtype=np.int64)
+        distance, fraction = np.empty(len(px)), np.empty(len(px))
+        step = max(1, chunk_pairs // max(self.n_segments, 1))
+        for lo in range(0, len(px), step):
+            hi = min(lo + step, len(px))
+            d, t = point_segment_distance(px[lo:hi, None], py[lo:hi, None], self.ax, self.ay, self.bx, self.by)
+            nearest = np.argmin(d, axis=1)
+            rows = np.arange(hi - lo)
+            segment[lo:hi], distance[lo:hi], fraction[lo:hi] = nearest, d[rows, nearest], t[rows, nearest]
+        return segment, distance, fraction
+
+    def snap_brute_force(self, lat, lon) -> dict:
+        """Same result as snap_many by scanning all segments for every point (baseline)."""
+        px, py = self.projection.forward(np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64))
+        segment, distance, fraction = self._scan(px, py)
+        return {"edges": self.edge_ids[self.segment_edges[segment]], "distances": distance, "fractions": fraction}
+
+
+# ============================================================================
+# MAIN EXECUTION
+# ============================================================================
+
+def random_points_near_edges(index: SnapIndex, n_points: int, spread_m: float = 30.0, seed: int = 0) -> tuple:
+    """(lat, lon) of points scattered around random segments (Gaussian offset of spread_m meters)."""
+    rng = np.random.default_rng(seed)
+    segments = rng.integers(0, index.n_segments, n_points)
+    t = rng.random(n_points)
+    x = index.ax[segments] + t * (index.bx - index.ax)[segments] + rng.normal(0, spread_m, n_points)
+    y = index.ay[segments] + t * (index.by - index.ay)[segments] + rng.normal(0, spread_m, n_points)
+    return index.projection.inverse(x, y)
+
+
+def main(edges_file: str = None, n_points: int = 50_000, n_checks: int = 2000):
+    """Build the index, snap random points and check a sample against the brute-force scan."""
+    edges_file = edges_file or str(config.EDGES_FILE)
+    log_section(logger, "SNAPPING BENCHMARK")
+    log_dict(logger, {"edges_file": edges_file, "resolution": config.SNAP_RESOLUTION,
+                      "points": n_points}, "Configuration")
+
+    start = time.perf_counter()
+    index = SnapIndex.load(edges_file)
+    logger.info(f"✓ Indexed {index.n_segments} segments in {len(index.cells)} cells "
+                f"in {time.perf_counter() - start:.2f}s")
+
+    lat, lon = random_points_near_edges(index, n_points)
+    start = time.perf_counter()
+    result = index.snap_many(lat, lon)
+    elapsed = time.perf_counter() - start
+
+    checks = min(n_checks, n_points)
+    start = time.perf_counter()
+    expected = index.snap_brute_force(lat[:checks], lon[:checks])
+    brute_elapsed = time.perf_counter() - start
+    mismatches = int(np.count_nonzero(~np.isclose(result["distances"][:checks], expected["distances"])))
+
+    log_dict(logger, {
+        "index_points_per_s": f"{n_points / elapsed:,.0f}",
+        "brute_force_points_per_s": f"{checks / brute_elapsed:,.0f}",
+        "median_distance_m": f"{np.median(result['distances']):.1f}",
+        "mismatches": f"{mismatches} of {checks}"
+    }, "Results")
+    log_section(logger, "COMPLETED")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None, *(int(arg) for arg in sys.argv[2:3]))
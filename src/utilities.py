@@ -7,12 +7,21 @@ Core utilities for Shortcuts Generation using PySpark and H3.
 Key features:
 - Simplified cell assignment with assign_cell_downward/upward
 - Uses None for non-usable shortcuts (filter with isNotNull())
+- Native bitwise H3 expressions (resolution, parent, LCA) that run in the JVM
+- Per-cell size statistics and kernel planning (dense / scipy / distributed)
+- Shuffle volume measurement through the Spark UI REST API
+- Optional bucketed (from_edge) persistent layout for the working tables
+- Dirty-cell tracking: cells whose input is unchanged are not recomputed
+- Multi-profile tables: one cost/via column pair per cost profile, merged
+  per profile in a single pass
 """
 
 import os
 import sys
+import json
+import urllib.request
 from pathlib import Path
-from pyspark.sql import SparkSession, DataFrame
+from pyspark.sql import SparkSession, DataFrame, Column
 from pyspark.sql import functions as F
 from pyspark.sql.types import (
     StructType, StructField, DoubleType, IntegerType, LongType, ByteType
@@ -20,6 +29,9 @@ from pyspark.sql.types import (
 from pyspark.sql.window import Window
 import h3
 
+from h3_bitwise import H3_MAX_RES, H3_RES_OFFSET, H3_RES_MASK, H3_DIGIT_MASKS
+from shortest_path_kernels import profile_columns
+
 
 # ============================================================================
 # 1. SPARK SESSION INITIALIZATION
@@ -41,24 +53,69 @@ def initialize_spark(app_name: str = "ShortcutsGeneration", driver_memory: str =
     os.environ['PYSPARK_PYTHON'] = sys.executable
     os.environ['PYSPARK_DRIVER_PYTHON'] = sys.executable
 
+    import config
+
     spark = (
         SparkSession.builder
         .appName(app_name)
         .config("spark.driver.memory", driver_memory)
         .config("spark.executorEnv.PYTHONPATH", pythonpath_value)
+        # Joins on (from_edge, to_edge) reuse the from_edge partitioning of the shortcuts table
+        .config("spark.sql.requireAllClusterKeysForCoPartition", "false")
+        .config("spark.sql.warehouse.dir", str(config.WAREHOUSE_DIR))
         .getOrCreate()
     )
 
     for module_file in src_dir.glob("*.py"):
         spark.sparkContext.addPyFile(str(module_file))
     
-    import config
     checkpoint_dir = str(config.CHECKPOINT_DIR)
     spark.sparkContext.setCheckpointDir(checkpoint_dir)
     
     return spark
 
 
+def shuffle_write_bytes(spark: SparkSession):
+    """
+    Total shuffle bytes written by the completed stages of this application.
+    
+    Read from the Spark UI REST API; returns None when the UI is disabled or
+    unreachable. Take the difference of two calls to measure a computation
+    (stages evicted by spark.ui.retainedStages are not counted).
+    """
+    ui_url = spark.sparkContext.uiWebUrl
+    if not ui_url:
+        return None
+    
+    url = f"{ui_url}/api/v1/applications/{spark.sparkContext.applicationId}/stages?status=complete"
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            stages = json.load(response)
+    except (OSError, ValueError):
+        return None
+    
+    return sum(stage.get("shuffleWriteBytes", 0) for stage in stages)
+
+
+def shuffle_bytes_since(spark: SparkSession, shuffle_before):
+    """Shuffle bytes written since an earlier shuffle_write_bytes call (None if unknown)."""
+    shuffle_after = shuffle_write_bytes(spark)
+    if shuffle_before is None or shuffle_after is None:
+        return None
+    return shuffle_after - shuffle_before
+
+
+def format_bytes(num_bytes) -> str:
+    """Human-readable byte count ("n/a" when unknown)."""
+    if num_bytes is None:
+        return "n/a"
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
+
+
 # ============================================================================
 # 2. DATA LOADING
 # ============================================================================
@@ -119,10 +176,140 @@ def update_dummy_costs_for_edges(spark: SparkSession, file_path: str, edges_df:
     return edges_result
 
 
+def profile_cost(length: Column, maxspeed: Column, speed_factor: float = 1.0, max_speed: float = None) -> Column:
+    """
+    Edge cost of a profile as a native expression: length / speed.
+    
+    speed = maxspeed * speed_factor, capped at max_speed; inf for maxspeed <= 0
+    (as dummy_cost).
+    """
+    speed = maxspeed.cast("double") * F.lit(float(speed_factor))
+    if max_speed is not None:
+        speed = F.least(speed, F.lit(float(max_speed)))
+    return F.when(maxspeed <= 0, F.lit(float("inf"))).otherwise(length.cast("double") / speed)
+
+
+def update_profile_costs_for_edges(spark: SparkSession, file_path: str, edges_df: DataFrame, profiles: dict) -> DataFrame:
+    """Add one cost_<profile> column per profile to the edges DataFrame."""
+    edges_df_cost = spark.read.csv(file_path, header=True, inferSchema=True)
+    
+    if "edge_index" in edges_df_cost.columns and "id" not in edges_df_cost.columns:
+        edges_df_cost = edges_df_cost.withColumnRenamed("edge_index", "id")
+    
+    cost_columns, _ = profile_columns(list(profiles))
+    edges_df_cost = edges_df_cost.select(
+        "id",
+        *[
+            profile_cost(F.col("length"), F.col("maxspeed"), **settings).alias(cost_column)
+            for cost_column, settings in zip(cost_columns, profiles.values())
+        ]
+    )
+    
+    edges_result = edges_df.drop(*[c for c in cost_columns if c in edges_df.columns])
+    return edges_result.join(edges_df_cost, on="id", how="left")
+
+
+def initial_profile_shortcuts_table(spark: SparkSession, file_path: str, edges_cost_df: DataFrame, profiles: list) -> DataFrame:
+    """Initial shortcuts with cost_<p> = cost of from_edge and via_<p> = to_edge for every profile."""
+    cost_columns, via_columns = profile_columns(profiles)
+    shortcuts_df = spark.read.csv(file_path, header=True, inferSchema=True).select("from_edge", "to_edge")
+    
+    shortcuts_df = shortcuts_df.join(
+        edges_cost_df.select("id", *cost_columns),
+        shortcuts_df.from_edge == edges_cost_df.id,
+        "left"
+    ).drop(edges_cost_df.id)
+    
+    return shortcuts_df.select(
+        "from_edge", "to_edge", *cost_columns,
+        *[F.col("to_edge").alias(via_column) for via_column in via_columns]
+    )
+
+
 # ============================================================================
 # 4. H3 UTILITIES
 # ============================================================================
 
+# H3 index layout and digit masks are shared with the NumPy implementation
+# (h3_bitwise.py): resolution nibble at bit 52, unused digits set to 7.
+
+
+def _as_column(value) -> Column:
+    """Wrap plain Python values as literals; pass Columns through."""
+    return value if isinstance(value, Column) else F.lit(value)
+
+
+def h3_resolution(cell: Column) -> Column:
+    """Native expression: resolution of an H3 cell (-1 for cell 0)."""
+    return F.when(cell == 0, F.lit(-1)).otherwise(
+        F.shiftright(cell, H3_RES_OFFSET).bitwiseAND(0xF)
+    ).cast(IntegerType())
+
+
+def h3_parent(cell: Column, target_res) -> Column:
+    """
+    Native expression: parent of an H3 cell at target_res.
+
+    Same semantics as get_parent_cell: 0 for cell 0 or target_res < 0,
+    the cell itself when target_res is finer than the cell.
+
+    Args:
+        cell: H3 cell column (long)
+        target_res: Target resolution, either an int or an integer Column
+    """
+    if isinstance(target_res, Column):
+        digit_mask = F.element_at(
+            F.array(*[F.lit(m) for m in H3_DIGIT_MASKS]),
+            F.greatest(target_res, F.lit(0)) + 1
+        )
+        res_bits = F.shiftleft(F.greatest(target_res, F.lit(0)).cast(LongType()), H3_RES_OFFSET)
+    else:
+        digit_mask = F.lit(H3_DIGIT_MASKS[max(target_res, 0)])
+        res_bits = F.lit(max(target_res, 0) << H3_RES_OFFSET)
+    target_res = _as_column(target_res)
+
+    parent = (
+        cell.bitwiseAND(F.lit(~H3_RES_MASK))
+        .bitwiseOR(res_bits)
+        .bitwiseOR(digit_mask)
+    )
+
+    return (
+        F.when((cell == 0) | (target_res < 0), F.lit(0))
+        .when(target_res > h3_resolution(cell), cell)
+        .otherwise(parent)
+    ).cast(LongType())
+
+
+def h3_lca_resolution(cell1: Column, cell2: Column) -> Column:
+    """
+    Native expression: resolution of the LCA of two H3 cells (-1 if none).
+
+    The LCA is the longest common digit prefix: the cells share a parent at
+    resolution r iff (cell1 XOR cell2), ignoring the resolution nibble, has no
+    bits above the digits finer than r.
+    """
+    diff = cell1.bitwiseXOR(cell2).bitwiseAND(F.lit(~H3_RES_MASK))
+
+    # Finest resolution whose prefix is shared (first match wins)
+    common_res = F.when(diff <= H3_DIGIT_MASKS[H3_MAX_RES], F.lit(H3_MAX_RES))
+    for res in range(H3_MAX_RES - 1, -1, -1):
+        common_res = common_res.when(diff <= H3_DIGIT_MASKS[res], F.lit(res))
+    common_res = common_res.otherwise(F.lit(-1))
+
+    return F.when((cell1 == 0) | (cell2 == 0), F.lit(-1)).otherwise(
+        F.least(h3_resolution(cell1), h3_resolution(cell2), common_res)
+    ).cast(IntegerType())
+
+
+def h3_lca(cell1: Column, cell2: Column) -> Column:
+    """Native expression: LCA cell of two H3 cells (0 if none)."""
+    return h3_parent(cell1, h3_lca_resolution(cell1, cell2))
+
+
+# Python reference implementations (row-at-a-time UDFs).
+# The native expressions above give bit-identical results.
+
 def _find_lca_impl(cell1: int, cell2: int) -> tuple:
     """Find the LCA of two H3 cells. Returns (lca_cell, lca_res)."""
     if cell1 == 0 or cell2 == 0:
@@ -169,32 +356,43 @@ def get_parent_cell(cell: int, target_res: int) -> int:
 
 
 # ============================================================================
-# 5. CELL ASSIGNMENT (FORWARD AND BACKWARD PASSES)
+# 5. SHORTCUT GEOMETRY
 # ============================================================================
 
-def assign_cell_forward(shortcuts_df: DataFrame, edges_df: DataFrame, current_res: int) -> DataFrame:
+# Per-shortcut attributes that depend only on (from_edge, to_edge).
+# They are stored on the working shortcuts table and computed once per key.
+SHORTCUT_GEOMETRY_COLUMNS = {
+    "lca_in": IntegerType(),      # lca_res of edge A (from_edge)
+    "lca_out": IntegerType(),     # lca_res of edge B (to_edge)
+    "lca_res": IntegerType(),     # max(lca_in, lca_out)
+    "inner_cell": LongType(),     # LCA(A.to, B.from)
+    "outer_cell": LongType(),     # LCA(A.from, B.to)
+    "inner_res": IntegerType(),
+    "outer_res": IntegerType(),
+}
+
+
+def has_shortcut_geometry(shortcuts_df: DataFrame) -> bool:
+    """Check whether the shortcuts table already carries the geometry columns."""
+    return all(col in shortcuts_df.columns for col in SHORTCUT_GEOMETRY_COLUMNS)
+
+
+def add_shortcut_geometry(shortcuts_df: DataFrame, edges_df: DataFrame) -> DataFrame:
     """
-    Assign current_cell for FORWARD pass (resolution 15 → -1).
+    Compute inner/outer cell geometry for shortcuts (A, B).
     
-    Key insight: A shortcut that satisfies BOTH inner_res and outer_res conditions
-    should be processed in BOTH cells to enable merging with different shortcuts.
-    
-    This function returns a union of:
-    - Shortcuts assigned to inner_cell (when lca_res <= current_res <= inner_res)
-    - Shortcuts assigned to outer_cell (when lca_res <= current_res <= outer_res)
+    inner_cell = LCA(A.to, B.from)  - junction point where A ends and B starts
+    outer_cell = LCA(A.from, B.to)  - outer boundary from A's start to B's end
+    lca_res    = max(lca_res_A, lca_res_B)
     
     Args:
-        shortcuts_df: Shortcuts DataFrame (incoming_edge, outgoing_edge, via_edge, cost)
-        edges_df: Edges DataFrame with lca_res, incoming_cell, outgoing_cell
-        current_res: Target H3 resolution level
+        shortcuts_df: Shortcuts DataFrame (from_edge, to_edge, ...)
+        edges_df: Edges DataFrame with id, from_cell, to_cell, lca_res
     
     Returns:
-        DataFrame with current_cell column added (may have duplicates for shortcuts in both cells)
+        shortcuts_df with SHORTCUT_GEOMETRY_COLUMNS added (replacing stale ones)
     """
-    # Drop existing temp columns if present
-    for col in ["lca_res", "inner_cell", "outer_cell", "inner_res", "outer_res", "current_cell"]:
-        if col in shortcuts_df.columns:
-            shortcuts_df = shortcuts_df.drop(col)
+    shortcuts_df = shortcuts_df.drop(*[c for c in SHORTCUT_GEOMETRY_COLUMNS if c in shortcuts_df.columns])
     
     # Join incoming edge info: A = (A.from -> A.to)
     # CONVENTION: to_cell = A.to (where A ends), from_cell = A.from (where A starts)
@@ -203,7 +401,7 @@ def assign_cell_forward(shortcuts_df: DataFrame, edges_df: DataFrame, current_re
             F.col("id").alias("_in_id"),
             F.col("to_cell").alias("a_to"),     # A.to = where A ends
             F.col("from_cell").alias("a_from"),   # A.from = where A starts
-            F.col("lca_res").alias("lca_res_A")
+            F.col("lca_res").alias("lca_in")
         ),
         shortcuts_df.from_edge == F.col("_in_id"),
         "left"
@@ -215,41 +413,46 @@ def assign_cell_forward(shortcuts_df: DataFrame, edges_df: DataFrame, current_re
             F.col("id").alias("_out_id"),
             F.col("to_cell").alias("b_to"),     # B.to = where B ends
             F.col("from_cell").alias("b_from"),   # B.from = where B starts
-            F.col("lca_res").alias("lca_res_B")
+            F.col("lca_res").alias("lca_out")
         ),
         shortcuts_df.to_edge == F.col("_out_id"),
         "left"
     ).drop("_out_id")
     
-    # Compute lca_res = max(lca_res_A, lca_res_B)
     shortcuts_df = shortcuts_df.withColumn(
         "lca_res",
-        F.greatest(F.col("lca_res_A"), F.col("lca_res_B"))
-    )
-    
-    # Compute inner_cell = LCA(A.to, B.from) - junction point where A ends and B starts
-    # For direct shortcuts (A.to == B.from), inner_res = 15
-    shortcuts_df = shortcuts_df.withColumn(
+        F.greatest(F.col("lca_in"), F.col("lca_out"))
+    ).withColumn(
+        # For direct shortcuts (A.to == B.from), inner_res = 15
         "inner_cell",
-        find_lca(F.col("a_to"), F.col("b_from"))
-    )
-    
-    # Compute outer_cell = LCA(A.from, B.to) - outer boundary from A's start to B's end
-    shortcuts_df = shortcuts_df.withColumn(
+        h3_lca(F.col("a_to"), F.col("b_from"))
+    ).withColumn(
         "outer_cell",
-        find_lca(F.col("a_from"), F.col("b_to"))
-    )
-    
-    # Compute resolutions
-    shortcuts_df = shortcuts_df.withColumn(
+        h3_lca(F.col("a_from"), F.col("b_to"))
+    ).withColumn(
         "inner_res",
-        find_resolution(F.col("inner_cell"))
-    )
-    shortcuts_df = shortcuts_df.withColumn(
+        h3_resolution(F.col("inner_cell"))
+    ).withColumn(
         "outer_res",
-        find_resolution(F.col("outer_cell"))
+        h3_resolution(F.col("outer_cell"))
     )
     
+    return shortcuts_df.drop("a_from", "a_to", "b_from", "b_to")
+
+
+# ============================================================================
+# 6. CELL ASSIGNMENT (FORWARD AND BACKWARD PASSES)
+# ============================================================================
+
+def _assign_inner_outer(shortcuts_df: DataFrame, edges_df: DataFrame, current_res: int) -> DataFrame:
+    """Union of inner_cell and outer_cell assignments at current_res."""
+    if "current_cell" in shortcuts_df.columns:
+        shortcuts_df = shortcuts_df.drop("current_cell")
+    
+    # Geometry is normally carried on the table; compute it for legacy inputs
+    if not has_shortcut_geometry(shortcuts_df):
+        shortcuts_df = add_shortcut_geometry(shortcuts_df, edges_df)
+    
     # Part 1: Assign to INNER_CELL
     # Valid when: lca_res <= current_res <= inner_res
     inner_valid = (
@@ -259,7 +462,7 @@ def assign_cell_forward(shortcuts_df: DataFrame, edges_df: DataFrame, current_re
     
     inner_df = shortcuts_df.filter(inner_valid).withColumn(
         "current_cell",
-        get_parent_cell(F.col("inner_cell"), F.lit(current_res))
+        h3_parent(F.col("inner_cell"), current_res)
     )
     
     # Part 2: Assign to OUTER_CELL
@@ -271,18 +474,37 @@ def assign_cell_forward(shortcuts_df: DataFrame, edges_df: DataFrame, current_re
     
     outer_df = shortcuts_df.filter(outer_valid).withColumn(
         "current_cell",
-        get_parent_cell(F.col("outer_cell"), F.lit(current_res))
+        h3_parent(F.col("outer_cell"), current_res)
     )
     
     # Union both (shortcuts valid for both will appear twice with different cells)
-    result = inner_df.unionByName(outer_df)
+    return inner_df.unionByName(outer_df)
+
+
+def assign_cell_forward(shortcuts_df: DataFrame, edges_df: DataFrame, current_res: int) -> DataFrame:
+    """
+    Assign current_cell for FORWARD pass (resolution 15 → -1).
+    
+    Key insight: A shortcut that satisfies BOTH inner_res and outer_res conditions
+    should be processed in BOTH cells to enable merging with different shortcuts.
+    
+    This function returns a union of:
+    - Shortcuts assigned to inner_cell (when lca_res <= current_res <= inner_res)
+    - Shortcuts assigned to outer_cell (when lca_res <= current_res <= outer_res)
+    
+    The geometry columns stored on the table (see add_shortcut_geometry) are
+    reused, so no joins with edges_df are needed per resolution.
     
-    # Drop temp columns
-    result = result.drop("a_from", "a_to", "b_from", "b_to",
-                         "lca_res_A", "lca_res_B", "lca_res",
-                         "inner_cell", "outer_cell", "inner_res", "outer_res")
+    Args:
+        shortcuts_df: Shortcuts DataFrame (from_edge, to_edge, via_edge, cost, geometry)
+        edges_df: Edges DataFrame with lca_res, from_cell, to_cell
+                  (only used if shortcuts_df has no geometry columns)
+        current_res: Target H3 resolution level
     
-    return result
+    Returns:
+        DataFrame with current_cell column added (may have duplicates for shortcuts in both cells)
+    """
+    return _assign_inner_outer(shortcuts_df, edges_df, current_res)
 
 
 def assign_cell_backward(shortcuts_df: DataFrame, edges_df: DataFrame, current_res: int) -> DataFrame:
@@ -297,106 +519,14 @@ def assign_cell_backward(shortcuts_df: DataFrame, edges_df: DataFrame, current_r
     - Shortcuts assigned to outer_cell (Case 4: Up→Down, or shortcuts valid for outer but not inner)
     
     Args:
-        shortcuts_df: Shortcuts DataFrame
-        edges_df: Edges DataFrame
+        shortcuts_df: Shortcuts DataFrame (with geometry columns)
+        edges_df: Edges DataFrame (only used if shortcuts_df has no geometry columns)
         current_res: Target H3 resolution level
     
     Returns:
         DataFrame with current_cell column added (may have duplicates for shortcuts in both cells)
     """
-    # Drop existing temp columns if present
-    for col in ["lca_res", "inner_cell", "outer_cell", "inner_res", "outer_res", "current_cell"]:
-        if col in shortcuts_df.columns:
-            shortcuts_df = shortcuts_df.drop(col)
-    
-    # Join incoming edge info: A = (A.from -> A.to)
-    # CONVENTION: to_cell = A.to (where A ends), from_cell = A.from (where A starts)
-    shortcuts_df = shortcuts_df.join(
-        edges_df.select(
-            F.col("id").alias("_in_id"),
-            F.col("to_cell").alias("a_to"),     # A.to = where A ends
-            F.col("from_cell").alias("a_from"),   # A.from = where A starts
-            F.col("lca_res").alias("lca_res_A")
-        ),
-        shortcuts_df.from_edge == F.col("_in_id"),
-        "left"
-    ).drop("_in_id")
-    
-    # Join outgoing edge info: B = (B.from -> B.to)
-    shortcuts_df = shortcuts_df.join(
-        edges_df.select(
-            F.col("id").alias("_out_id"),
-            F.col("to_cell").alias("b_to"),     # B.to = where B ends
-            F.col("from_cell").alias("b_from"),   # B.from = where B starts
-            F.col("lca_res").alias("lca_res_B")
-        ),
-        shortcuts_df.to_edge == F.col("_out_id"),
-        "left"
-    ).drop("_out_id")
-    
-    # Compute lca_res = max(lca_res_A, lca_res_B)
-    shortcuts_df = shortcuts_df.withColumn(
-        "lca_res",
-        F.greatest(F.col("lca_res_A"), F.col("lca_res_B"))
-    )
-    
-    # Compute inner_cell = LCA(A.to, B.from) - junction point where A ends and B starts
-    # For direct shortcuts (A.to == B.from), inner_res = 15
-    shortcuts_df = shortcuts_df.withColumn(
-        "inner_cell",
-        find_lca(F.col("a_to"), F.col("b_from"))
-    )
-    
-    # Compute outer_cell = LCA(A.from, B.to) - outer boundary from A's start to B's end
-    shortcuts_df = shortcuts_df.withColumn(
-        "outer_cell",
-        find_lca(F.col("a_from"), F.col("b_to"))
-    )
-    
-    # Compute resolutions
-    shortcuts_df = shortcuts_df.withColumn(
-        "inner_res",
-        find_resolution(F.col("inner_cell"))
-    )
-    shortcuts_df = shortcuts_df.withColumn(
-        "outer_res",
-        find_resolution(F.col("outer_cell"))
-    )
-    
-    # Part 1: Assign to INNER_CELL
-    # Valid when: lca_res <= current_res <= inner_res
-    inner_valid = (
-        (F.col("lca_res") <= current_res) & 
-        (F.col("inner_res") >= current_res)
-    )
-    
-    inner_df = shortcuts_df.filter(inner_valid).withColumn(
-        "current_cell",
-        get_parent_cell(F.col("inner_cell"), F.lit(current_res))
-    )
-    
-    # Part 2: Assign to OUTER_CELL
-    # Valid when: lca_res <= current_res <= outer_res
-    # This handles Case 4 (Up→Down) AND shortcuts valid for outer that weren't handled by inner
-    outer_valid = (
-        (F.col("lca_res") <= current_res) & 
-        (F.col("outer_res") >= current_res)
-    )
-    
-    outer_df = shortcuts_df.filter(outer_valid).withColumn(
-        "current_cell",
-        get_parent_cell(F.col("outer_cell"), F.lit(current_res))
-    )
-    
-    # Union both (shortcuts valid for both will appear twice with different cells)
-    result = inner_df.unionByName(outer_df)
-    
-    # Drop temp columns
-    result = result.drop("a_from", "a_to", "b_from", "b_to",
-                         "lca_res_A", "lca_res_B", "lca_res",
-                         "inner_cell", "outer_cell", "inner_res", "outer_res")
-    
-    return result
+    return _assign_inner_outer(shortcuts_df, edges_df, current_res)
 
 
 def filter_active_shortcuts(shortcuts_df: DataFrame) -> DataFrame:
@@ -410,40 +540,237 @@ def filter_active_shortcuts(shortcuts_df: DataFrame) -> DataFrame:
 
 
 # ============================================================================
-# 6. MERGING RESULTS
+# 7. MERGING RESULTS
 # ============================================================================
 
-def merge_shortcuts(main_df: DataFrame, new_shortcuts: DataFrame) -> DataFrame:
+def partition_by_key(shortcuts_df: DataFrame) -> DataFrame:
     """
-    Merge new shortcuts into main table, keeping minimum cost paths.
+    Hash-partition the shortcuts table by from_edge.
+    
+    Joins on (from_edge, to_edge) against a table partitioned this way do not
+    reshuffle it (with spark.sql.requireAllClusterKeysForCoPartition=false,
+    set in initialize_spark). The partition count is fixed to
+    spark.sql.shuffle.partitions so adaptive execution cannot coalesce it
+    away, and matches the bucket count of the bucketed layout. On a table
+    Spark already knows to be partitioned this way the repartition is
+    dropped by the planner.
+    """
+    num_partitions = int(shortcuts_df.sparkSession.conf.get("spark.sql.shuffle.partitions"))
+    return shortcuts_df.repartition(num_partitions, "from_edge")
+
+
+def replace_changed_keys(main_df: DataFrame, changes: DataFrame, keys: list) -> DataFrame:
+    """
+    Replace the rows of main_df whose key appears in changes, and add the new keys.
+    
+    changes is shuffled onto the partitioning of main_df and the two are
+    joined partition by partition (full outer join, hashed on the changes
+    side), so when main_df is partitioned by from_edge its rows stay in place
+    and the shuffle is the size of changes. Each output partition holds the
+    same from_edge hash range as the input; Spark does not carry this through
+    a full outer join, which is why the bucketed layout writes it back
+    without a shuffle while the checkpoint layout repartitions it (see
+    ShortcutsTableStore).
+    """
+    value_columns = [c for c in main_df.columns if c not in keys]
+    changed = partition_by_key(changes).select(
+        *keys,
+        *[F.col(c).alias(f"new_{c}") for c in value_columns],
+        F.lit(True).alias("changed")
+    )
+    
+    return main_df.join(
+        changed.hint("shuffle_hash"), on=keys, how="full_outer"
+    ).select(
+        *keys,
+        *[
+            F.when(F.col("changed"), F.col(f"new_{c}")).otherwise(F.col(c)).alias(c)
+            for c in value_columns
+        ]
+    )
+
+
+def merge_shortcuts_with_stats(
+    main_df: DataFrame,
+    new_shortcuts: DataFrame,
+    edges_df: DataFrame = None
+) -> tuple:
+    """
+    Incrementally merge new shortcuts into the main table, keeping minimum cost paths.
+    
+    Only keys of the batch are ranked and compared: the batch is shuffled
+    onto the partitioning of the main table, reduced to its cheapest row per
+    key and joined with it. Rows that are new or cheaper than the main row
+    replace it partition by partition (see replace_changed_keys), so the main
+    rows are not shuffled when main_df is partitioned by from_edge; nothing is
+    rewritten when the batch changes no key.
+    
+    If main_df carries the geometry columns, they are kept for existing keys and
+    computed (via edges_df) only for keys that are new in this merge.
     
     Args:
-        main_df: Main shortcuts DataFrame
+        main_df: Main shortcuts DataFrame (from partition_by_key or a bucketed read)
         new_shortcuts: Newly computed shortcuts
+        edges_df: Edges DataFrame, required to keep geometry on the table
     
     Returns:
-        Updated DataFrame with best shortcuts
+        (updated DataFrame with the partitions of main_df, {"inserted": n, "improved": n})
     """
-    # Standardize columns
-    main_df = main_df.select("from_edge", "to_edge", "cost", "via_edge")
-    new_shortcuts = new_shortcuts.select("from_edge", "to_edge", "cost", "via_edge")
+    keys = ["from_edge", "to_edge"]
+    base_columns = ["from_edge", "to_edge", "cost", "via_edge"]
+    keep_geometry = edges_df is not None and has_shortcut_geometry(main_df)
+    geometry_columns = list(SHORTCUT_GEOMETRY_COLUMNS) if keep_geometry else []
     
-    combined = main_df.unionByName(new_shortcuts)
+    # Standardize columns
+    main_df = main_df.select(*base_columns, *geometry_columns)
     
-    # Keep minimum cost for each (source, target) pair
-    window_spec = Window.partitionBy("from_edge", "to_edge").orderBy(F.col("cost").asc())
+    # Keep minimum cost for each (source, target) pair of the batch
+    window_spec = Window.partitionBy(*keys).orderBy(F.col("cost").asc())
     
-    result = combined.withColumn(
+    batch = partition_by_key(new_shortcuts.select(*base_columns)).withColumn(
         "rank", F.row_number().over(window_spec)
     ).filter(
         F.col("rank") == 1
     ).drop("rank")
     
-    return result
+    # Compare with the main rows of the same keys (geometry depends only on the key)
+    main_side = main_df.select(
+        *keys, F.col("cost").alias("main_cost"), *geometry_columns
+    )
+    changes = batch.join(
+        main_side, on=keys, how="left"
+    ).filter(
+        F.col("main_cost").isNull() | (F.col("cost") < F.col("main_cost"))
+    ).withColumn(
+        "inserted", F.col("main_cost").isNull()
+    ).drop("main_cost").localCheckpoint()
+    
+    counts = changes.agg(
+        F.count("*").alias("changed"),
+        F.sum(F.col("inserted").cast("int")).alias("inserted")
+    ).collect()[0]
+    inserted = counts["inserted"] or 0
+    stats = {"inserted": inserted, "improved": counts["changed"] - inserted}
+    
+    if counts["changed"] == 0:
+        return main_df, stats
+    
+    if keep_geometry:
+        # Compute geometry only for keys that were not in the main table
+        fresh = add_shortcut_geometry(
+            changes.filter(F.col("inserted")).select(*base_columns),
+            edges_df
+        )
+        changes = changes.filter(~F.col("inserted")).select(
+            *base_columns, *geometry_columns
+        ).unionByName(fresh.select(*base_columns, *geometry_columns))
+    else:
+        changes = changes.select(*base_columns)
+    
+    return replace_changed_keys(main_df, changes, keys), stats
+
+
+def merge_profile_shortcuts_with_stats(
+    main_df: DataFrame,
+    new_shortcuts: DataFrame,
+    profiles: list,
+    edges_df: DataFrame = None
+) -> tuple:
+    """
+    Incrementally merge multi-profile shortcuts, keeping the minimum cost per profile.
+    
+    Same scheme as merge_shortcuts_with_stats with one join for all profiles:
+    the batch is reduced to the cheapest (cost_<p>, via_<p>) per key and
+    profile, and a key changes when it is new or strictly cheaper in at least
+    one profile; each profile then takes the batch value only where it is
+    cheaper.
+    
+    Returns:
+        (updated DataFrame with the partitions of main_df, {"inserted": n, "improved": n})
+        where improved counts keys improved in at least one profile
+    """
+    keys = ["from_edge", "to_edge"]
+    cost_columns, via_columns = profile_columns(profiles)
+    value_columns = cost_columns + via_columns
+    keep_geometry = edges_df is not None and has_shortcut_geometry(main_df)
+    geometry_columns = list(SHORTCUT_GEOMETRY_COLUMNS) if keep_geometry else []
+    
+    main_df = main_df.select(*keys, *value_columns, *geometry_columns)
+    
+    # Cheapest (cost, via) of the batch per key and profile
+    batch = partition_by_key(new_shortcuts).groupBy(*keys).agg(*[
+        F.min(F.struct(cost_column, via_column)).alias(f"best_{cost_column}")
+        for cost_column, via_column in zip(cost_columns, via_columns)
+    ]).select(
+        *keys,
+        *[F.col(f"best_{c}.{c}").alias(c) for c in cost_columns],
+        *[F.col(f"best_{c}.{v}").alias(v) for c, v in zip(cost_columns, via_columns)]
+    )
+    
+    main_side = main_df.select(
+        *keys, *[F.col(c).alias(f"main_{c}") for c in value_columns], *geometry_columns
+    )
+    is_new = F.col(f"main_{cost_columns[0]}").isNull()
+    cheaper = [F.col(c) < F.col(f"main_{c}") for c in cost_columns]
+    any_cheaper = cheaper[0]
+    for condition in cheaper[1:]:
+        any_cheaper = any_cheaper | condition
+    
+    changes = batch.join(
+        main_side, on=keys, how="left"
+    ).filter(
+        is_new | any_cheaper
+    ).select(
+        *keys,
+        *[
+            F.when(is_new | better, F.col(c)).otherwise(F.col(f"main_{c}")).alias(c)
+            for c, better in zip(cost_columns, cheaper)
+        ],
+        *[
+            F.when(is_new | better, F.col(v)).otherwise(F.col(f"main_{v}")).alias(v)
+            for v, better in zip(via_columns, cheaper)
+        ],
+        *geometry_columns,
+        is_new.alias("inserted")
+    ).localCheckpoint()
+    
+    counts = changes.agg(
+        F.count("*").alias("changed"),
+        F.sum(F.col("inserted").cast("int")).alias("inserted")
+    ).collect()[0]
+    inserted = counts["inserted"] or 0
+    stats = {"inserted": inserted, "improved": counts["changed"] - inserted}
+    
+    if counts["changed"] == 0:
+        return main_df, stats
+    
+    base_columns = keys + value_columns
+    if keep_geometry:
+        fresh = add_shortcut_geometry(
+            changes.filter(F.col("inserted")).select(*base_columns),
+            edges_df
+        )
+        changes = changes.filter(~F.col("inserted")).select(
+            *base_columns, *geometry_columns
+        ).unionByName(fresh.select(*base_columns, *geometry_columns))
+    else:
+        changes = changes.select(*base_columns)
+    
+    return replace_changed_keys(main_df, changes, keys), stats
+
+
+def merge_shortcuts(main_df: DataFrame, new_shortcuts: DataFrame, edges_df: DataFrame = None) -> DataFrame:
+    """
+    Merge new shortcuts into main table, keeping minimum cost paths.
+    
+    See merge_shortcuts_with_stats; this variant only returns the table.
+    """
+    merged, _ = merge_shortcuts_with_stats(main_df, new_shortcuts, edges_df)
+    return merged
 
 
 # ============================================================================
-# 7. FINAL OUTPUT PREPARATION
+# 8. FINAL OUTPUT PREPARATION
 # ============================================================================
 
 def add_final_info(shortcuts_df: DataFrame, edges_df: DataFrame) -> DataFrame:
@@ -456,6 +783,9 @@ def add_final_info(shortcuts_df: DataFrame, edges_df: DataFrame) -> DataFrame:
     
     A shortcut is valid if: lca_res <= inner_res OR lca_res <= outer_res
     
+    Geometry columns carried on the working table are reused; they are only
+    computed here if missing.
+    
     Args:
         shortcuts_df: Shortcuts DataFrame
         edges_df: Edges DataFrame
@@ -463,57 +793,8 @@ def add_final_info(shortcuts_df: DataFrame, edges_df: DataFrame) -> DataFrame:
     Returns:
         DataFrame with cell and inside columns, filtered to valid shortcuts
     """
-    # Join incoming edge info: A = (A.from -> A.to)
-    # CONVENTION: to_cell = A.to (where A ends), from_cell = A.from (where A starts)
-    shortcuts_df = shortcuts_df.join(
-        edges_df.select(
-            F.col("id").alias("_in_id"),
-            F.col("to_cell").alias("a_to"),     # A.to = where A ends
-            F.col("from_cell").alias("a_from"),   # A.from = where A starts
-            F.col("lca_res").alias("lca_in")
-        ),
-        shortcuts_df.from_edge == F.col("_in_id"),
-        "left"
-    ).drop("_in_id")
-    
-    # Join outgoing edge info: B = (B.from -> B.to)
-    shortcuts_df = shortcuts_df.join(
-        edges_df.select(
-            F.col("id").alias("_out_id"),
-            F.col("to_cell").alias("b_to"),     # B.to = where B ends
-            F.col("from_cell").alias("b_from"),   # B.from = where B starts
-            F.col("lca_res").alias("lca_out")
-        ),
-        shortcuts_df.to_edge == F.col("_out_id"),
-        "left"
-    ).drop("_out_id")
-    
-    # Compute lca_res
-    shortcuts_df = shortcuts_df.withColumn(
-        "lca_res",
-        F.greatest(F.col("lca_in"), F.col("lca_out"))
-    )
-    
-    # Compute inner_cell = LCA(A.to, B.from) - junction point where A ends and B starts
-    # For direct shortcuts (A.to == B.from), inner_res = 15
-    shortcuts_df = shortcuts_df.withColumn(
-        "inner_cell",
-        find_lca(F.col("a_to"), F.col("b_from"))
-    )
-    shortcuts_df = shortcuts_df.withColumn(
-        "inner_res",
-        find_resolution(F.col("inner_cell"))
-    )
-    
-    # Compute outer_cell = LCA(A.from, B.to) - outer boundary from A's start to B's end
-    shortcuts_df = shortcuts_df.withColumn(
-        "outer_cell",
-        find_lca(F.col("a_from"), F.col("b_to"))
-    )
-    shortcuts_df = shortcuts_df.withColumn(
-        "outer_res",
-        find_resolution(F.col("outer_cell"))
-    )
+    if not has_shortcut_geometry(shortcuts_df):
+        shortcuts_df = add_shortcut_geometry(shortcuts_df, edges_df)
     
     # Validity filter: keep only shortcuts where lca_res <= inner_res OR lca_res <= outer_res
     # NOTE: This is a validity check only. With the current algorithm, all generated
@@ -545,15 +826,218 @@ def add_final_info(shortcuts_df: DataFrame, edges_df: DataFrame) -> DataFrame:
     # Compute cell = parent(outer_cell, whole_res)
     shortcuts_df = shortcuts_df.withColumn(
         "cell",
-        get_parent_cell(F.col("outer_cell"), F.col("whole_res"))
+        h3_parent(F.col("outer_cell"), F.col("whole_res"))
     )
     
     # Drop temp columns, keep final output
     shortcuts_df = shortcuts_df.drop(
-        "a_from", "a_to", "b_from", "b_to", 
-        "lca_in", "lca_out", "lca_res", "whole_res",
-        "inner_cell", "inner_res", "outer_cell", "outer_res"
+        "whole_res", "current_cell", *SHORTCUT_GEOMETRY_COLUMNS
     )
     
     return shortcuts_df
 
+
+# ============================================================================
+# 9. ENGINE PLANNING
+# ============================================================================
+
+ENGINE_DENSE = "dense"
+ENGINE_SCIPY = "scipy"
+ENGINE_DISTRIBUTED = "distributed"
+
+
+def collect_cell_stats(active_df: DataFrame) -> DataFrame:
+    """
+    Size statistics of each active cell.
+    
+    Returns:
+        DataFrame (current_cell, n_edges, n_nodes): n_edges is the number of
+        active shortcuts, n_nodes the number of distinct edges they connect
+    """
+    n_edges = active_df.groupBy("current_cell").agg(F.count("*").alias("n_edges"))
+    
+    n_nodes = active_df.select(
+        "current_cell",
+        F.explode(F.array("from_edge", "to_edge")).alias("node")
+    ).groupBy("current_cell").agg(F.countDistinct("node").alias("n_nodes"))
+    
+    return n_edges.join(n_nodes, on="current_cell")
+
+
+def plan_cell_engines(cell_stats: DataFrame, dense_max_nodes: int, scipy_max_nodes: int) -> DataFrame:
+    """
+    Choose the shortest path kernel of each cell from its size.
+    
+    - dense: n_nodes <= dense_max_nodes (vectorized min-plus, tiny cells)
+    - scipy: n_nodes <= scipy_max_nodes (Dijkstra in one Python worker)
+    - distributed: larger cells (spread over the cluster)
+    
+    Args:
+        cell_stats: Output of collect_cell_stats
+        dense_max_nodes: Largest cell handled by the dense kernel
+        scipy_max_nodes: Largest cell handled by a single worker
+    
+    Returns:
+        cell_stats with an added engine column
+    """
+    return cell_stats.withColumn(
+        "engine",
+        F.when(F.col("n_nodes") <= dense_max_nodes, F.lit(ENGINE_DENSE))
+        .when(F.col("n_nodes") <= scipy_max_nodes, F.lit(ENGINE_SCIPY))
+        .otherwise(F.lit(ENGINE_DISTRIBUTED))
+    )
+
+
+# ============================================================================
+# 10. PERSISTENT LAYOUT OF THE WORKING TABLES
+# ============================================================================
+
+LAYOUT_CHECKPOINT = "checkpoint"
+LAYOUT_BUCKETED = "bucketed"
+
+
+class ShortcutsTableStore:
+    """
+    Persists the working shortcuts table between resolutions.
+    
+    - checkpoint: localCheckpoint() of the table partitioned by from_edge
+      (default). Spark cannot tell that a merged table is still partitioned,
+      so each merge result is reshuffled once here.
+    - bucketed: saved as a table bucketed and sorted by from_edge, and read
+      back, so joins and merges on the key find the table already
+      partitioned. A merge result is written back bucket by bucket without
+      a shuffle. Edges are bucketed by id with the same bucket count.
+    
+    Bucketed tables alternate between two names, since a table cannot be
+    overwritten while the new version is computed from it.
+    """
+    
+    def __init__(
+        self,
+        spark: SparkSession,
+        layout: str = LAYOUT_CHECKPOINT,
+        num_buckets: int = 64,
+        table_prefix: str = "shortcuts_work"
+    ):
+        if layout not in (LAYOUT_CHECKPOINT, LAYOUT_BUCKETED):
+            raise ValueError(f"Unknown shortcuts layout: {layout}")
+        
+        self.spark = spark
+        self.layout = layout
+        self.num_buckets = num_buckets
+        self.table_prefix = table_prefix
+        self.step = 0
+        
+        if layout == LAYOUT_BUCKETED:
+            # Shuffles on the key then line up with the buckets
+            spark.conf.set("spark.sql.shuffle.partitions", str(num_buckets))
+    
+    def _write_bucketed(self, df: DataFrame, table_name: str, key: str) -> DataFrame:
+        """Save df bucketed and sorted by key, and read it back."""
+        df.write.mode("overwrite").bucketBy(
+            self.num_buckets, key
+        ).sortBy(key).saveAsTable(table_name)
+        return self.spark.table(table_name)
+    
+    def persist(self, shortcuts_df: DataFrame) -> DataFrame:
+        """Materialize the working shortcuts table in the configured layout."""
+        if self.layout == LAYOUT_CHECKPOINT:
+            return partition_by_key(shortcuts_df).localCheckpoint()
+        
+        table_name = f"{self.table_prefix}_{self.step % 2}"
+        self.step += 1
+        return self._write_bucketed(shortcuts_df, table_name, "from_edge")
+    
+    def persist_edges(self, edges_df: DataFrame) -> DataFrame:
+        """Materialize the edges table in the configured layout."""
+        if self.layout == LAYOUT_CHECKPOINT:
+            return edges_df.cache()
+        return self._write_bucketed(edges_df, f"{self.table_prefix}_edges", "id")
+    
+    def cleanup(self):
+        """Drop the bucketed tables written by this store."""
+        if self.layout == LAYOUT_CHECKPOINT:
+            return
+        for suffix in ["0", "1", "edges"]:
+            self.spark.sql(f"DROP TABLE IF EXISTS {self.table_prefix}_{suffix}")
+
+
+# ============================================================================
+# 11. DIRTY CELL TRACKING
+# ============================================================================
+
+SIGNATURE_COLUMNS = ["current_cell", "sig_rows", "sig_hash_low", "sig_hash_high"]
+
+
+def cell_signatures(active_df: DataFrame, value_columns: list = ("via_edge", "cost")) -> DataFrame:
+    """
+    Order-independent signature of the input rows of each active cell.
+    
+    A cell can hold the same shortcut twice (once through its inner and once
+    through its outer cell), so the row hashes are summed, not XORed: under
+    XOR two equal hashes cancel and a change to a duplicated row goes unseen.
+    The 64-bit hashes are summed as two 32-bit halves, which cannot overflow.
+    
+    Returns:
+        DataFrame (current_cell, sig_rows, sig_hash_low, sig_hash_high): row
+        count and sums of the halves of the 64-bit hashes of
+        (from_edge, to_edge, *value_columns)
+    """
+    row_hash = F.xxhash64("from_edge", "to_edge", *value_columns)
+    return active_df.groupBy("current_cell").agg(
+        F.count("*").alias("sig_rows"),
+        F.sum(row_hash.bitwiseAND(F.lit(0xFFFFFFFF))).alias("sig_hash_low"),
+        F.sum(F.shiftright(row_hash, 32)).alias("sig_hash_high")
+    )
+
+
+class DirtyCellTracker:
+    """
+    Tracks the input of every cell to skip cells that did not change.
+    
+    The kernels are deterministic, so a cell whose active rows are the same
+    as the last time it was processed (same resolution and emission mode)
+    yields the same shortcuts, which are already merged. Typical case: a
+    backward cell receiving exactly its forward input.
+    """
+    
+    def __init__(self, enabled: bool = True, value_columns: list = ("via_edge", "cost")):
+        self.enabled = enabled
+        self.value_columns = list(value_columns)
+        self.signatures = {}
+    
+    def filter_dirty(self, active_df: DataFrame, current_res: int, boundary: bool = False) -> tuple:
+        """
+        Keep only the active rows of cells that changed since they were last processed.
+        
+        Args:
+            active_df: Active shortcuts with current_cell
+            current_res: Resolution of the cells
+            boundary: Cells run with boundary-only emission (a different output)
+        
+        Returns:
+            (filtered active_df, {"cells": n or None, "skipped": n})
+        """
+        if not self.enabled:
+            return active_df, {"cells": None, "skipped": 0}
+        
+        signatures = cell_signatures(active_df, self.value_columns).localCheckpoint()
+        cells = signatures.count()
+        
+        key = (current_res, boundary)
+        previous = self.signatures.get(key)
+        self.signatures[key] = signatures
+        
+        if previous is None:
+            return active_df, {"cells": cells, "skipped": 0}
+        
+        dirty_cells = signatures.join(
+            previous, on=SIGNATURE_COLUMNS, how="left_anti"
+        ).select("current_cell").localCheckpoint()
+        skipped = cells - dirty_cells.count()
+        
+        if skipped == 0:
+            return active_df, {"cells": cells, "skipped": 0}
+        
+        dirty_df = active_df.join(F.broadcast(dirty_cells), on="current_cell", how="left_semi")
+        return dirty_df, {"cells": cells, "skipped": skipped}
@@ -0,0 +1,54 @@
+"""
+Cell signatures used to skip unchanged cells (utilities.cell_signatures).
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+pyspark = pytest.importorskip("pyspark")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from pyspark.sql import SparkSession  # noqa: E402
+
+from utilities import DirtyCellTracker, cell_signatures  # noqa: E402
+
+COLUMNS = ["from_edge", "to_edge", "via_edge", "cost", "current_cell"]
+
+
+@pytest.fixture(scope="module")
+def spark():
+    session = SparkSession.builder.master("local[1]").appName("test_cell_signatures").getOrCreate()
+    yield session
+    session.stop()
+
+
+def _signature(spark, rows):
+    row = cell_signatures(spark.createDataFrame(rows, COLUMNS)).collect()[0]
+    return row["sig_rows"], row["sig_hash_low"], row["sig_hash_high"]
+
+
+def test_signature_ignores_row_order(spark):
+    rows = [(1, 2, 2, 1.5, 10), (2, 3, 3, 2.0, 10), (1, 3, 2, 3.5, 10)]
+    assert _signature(spark, rows) == _signature(spark, rows[::-1])
+
+
+def test_duplicated_row_with_changed_cost_changes_signature(spark):
+    # The same shortcut reaches the cell twice (through its inner and its outer cell)
+    before = [(1, 2, 2, 1.5, 10), (1, 2, 2, 1.5, 10), (2, 3, 3, 2.0, 10)]
+    after = [(1, 2, 2, 1.0, 10), (1, 2, 2, 1.0, 10), (2, 3, 3, 2.0, 10)]
+    assert _signature(spark, before) != _signature(spark, after)
+
+
+def test_tracker_reprocesses_cell_with_changed_duplicate(spark):
+    tracker = DirtyCellTracker()
+    before = spark.createDataFrame([(1, 2, 2, 1.5, 10), (1, 2, 2, 1.5, 10), (4, 5, 5, 1.0, 20)], COLUMNS)
+    after = spark.createDataFrame([(1, 2, 2, 1.0, 10), (1, 2, 2, 1.0, 10), (4, 5, 5, 1.0, 20)], COLUMNS)
+
+    tracker.filter_dirty(before, current_res=8)
+    dirty_df, stats = tracker.filter_dirty(after, current_res=8)
+
+    assert stats == {"cells": 2, "skipped": 1}
+    assert {row["current_cell"] for row in dirty_df.collect()} == {10}
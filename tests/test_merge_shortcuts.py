@@ -0,0 +1,55 @@
+"""
+Incremental merge of new shortcuts into the working table (utilities.merge_shortcuts_with_stats).
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+pyspark = pytest.importorskip("pyspark")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from pyspark.sql import SparkSession  # noqa: E402
+
+from utilities import merge_shortcuts_with_stats, partition_by_key  # noqa: E402
+
+COLUMNS = ["from_edge", "to_edge", "cost", "via_edge"]
+
+
+@pytest.fixture(scope="module")
+def spark():
+    session = SparkSession.builder.master("local[1]").appName("test_merge_shortcuts").config(
+        "spark.sql.shuffle.partitions", "4"
+    ).getOrCreate()
+    yield session
+    session.stop()
+
+
+def _rows(df):
+    return sorted(tuple(row) for row in df.select(*COLUMNS).collect())
+
+
+def test_merge_inserts_improves_and_keeps(spark):
+    main = partition_by_key(spark.createDataFrame(
+        [(1, 2, 5.0, 2), (1, 3, 4.0, 3), (2, 3, 1.0, 3)], COLUMNS
+    ))
+    batch = spark.createDataFrame(
+        [(1, 2, 3.0, 7), (1, 2, 6.0, 8), (1, 3, 9.0, 9), (4, 5, 2.0, 5)], COLUMNS
+    )
+
+    merged, stats = merge_shortcuts_with_stats(main, batch)
+
+    assert stats == {"inserted": 1, "improved": 1}
+    assert _rows(merged) == [(1, 2, 3.0, 7), (1, 3, 4.0, 3), (2, 3, 1.0, 3), (4, 5, 2.0, 5)]
+
+
+def test_merge_without_changes_returns_main(spark):
+    main = partition_by_key(spark.createDataFrame([(1, 2, 5.0, 2)], COLUMNS))
+    batch = spark.createDataFrame([(1, 2, 5.0, 9)], COLUMNS)
+
+    merged, stats = merge_shortcuts_with_stats(main, batch)
+
+    assert stats == {"inserted": 0, "improved": 0}
+    assert _rows(merged) == [(1, 2, 5.0, 2)]